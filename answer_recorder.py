@@ -0,0 +1,294 @@
+# answer_recorder.py — отложенная запись ответов в user_sessions
+#
+# На SQLite каждый commit — это fsync, который выстраивает все потоки
+# обработчиков в очередь. Поэтому ответы копятся в буфере и пишутся одной
+# транзакцией раз в ANSWER_FLUSH_SIZE записей или ANSWER_FLUSH_INTERVAL_MS
+# миллисекунд. В той же транзакции обновляются агрегаты статистики
+# (progress.py) и частые неверные ответы (difficulty.py). При остановке бота
+# буфер сбрасывается в БД.
+#
+# Если пачка не записалась из-за самой БД (недоступна, заблокирована), она
+# возвращается в буфер и запись повторяется. Любая другая ошибка обычно
+# означает одну плохую строку (ответ на удалённое задание и т. п.) — тогда
+# пачка пишется по одной строке, а строки, которые не записываются и так,
+# уходят в ANSWER_DEAD_LETTER_PATH и больше не мешают остальным.
+#
+# buffered() отдаёт ещё не записанные ответы ученика (в буфере и в
+# записи): планировщику (scheduler.py) они нужны, даже когда БД недоступна.
+import asyncio
+import json
+import logging
+import os
+import threading
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import exc, insert
+
+import difficulty
+import metrics
+import progress
+from db import SessionLocal
+from models import UserSession
+
+logger = logging.getLogger(__name__)
+
+ANSWER_FLUSH_SIZE = int(os.getenv("ANSWER_FLUSH_SIZE", "50"))
+ANSWER_FLUSH_INTERVAL_MS = int(os.getenv("ANSWER_FLUSH_INTERVAL_MS", "500"))
+# Сколько записей держать в памяти, если БД недоступна
+ANSWER_BUFFER_LIMIT = int(os.getenv("ANSWER_BUFFER_LIMIT", "10000"))
+# Куда откладывать ответы, которые не записываются даже по одному (JSON Lines)
+ANSWER_DEAD_LETTER_PATH = os.getenv("ANSWER_DEAD_LETTER_PATH", "answers_dead_letter.jsonl")
+# Максимальная пауза между повторами неудачной записи, сек
+_MAX_RETRY_DELAY = 30.0
+
+dead_letter_total = metrics.Counter("hskbot_answers_dead_letter_total", "Ответы, отложенные как незаписываемые")
+
+
+def _db_unavailable(error: Exception) -> bool:
+    """Ошибка самой БД, а не строк: запись стоит повторить позже"""
+    return isinstance(error, (exc.OperationalError, exc.InterfaceError, exc.DisconnectionError, exc.TimeoutError))
+
+
+def _dead_letter(row: Dict[str, Any], error: Exception) -> None:
+    dead_letter_total.inc()
+    logger.error(f"Ответ не записан, отложен в {ANSWER_DEAD_LETTER_PATH}: {row} — {error}")
+    try:
+        with open(ANSWER_DEAD_LETTER_PATH, "a", encoding="utf-8") as f:
+            f.write(json.dumps({**row, "error": str(error)[:500]}, ensure_ascii=False, default=str) + "\n")
+    except OSError as e:
+        logger.error(f"Не удалось дописать {ANSWER_DEAD_LETTER_PATH}: {e}")
+
+
+def _trim(buffer: List[Dict[str, Any]], limit: int) -> None:
+    """Ограничить буфер: при переполнении теряются самые старые ответы"""
+    if len(buffer) > limit:
+        dropped = len(buffer) - limit
+        del buffer[:dropped]
+        logger.error(f"Буфер ответов переполнен, потеряно записей: {dropped}")
+
+
+class AnswerRecorder:
+    def __init__(self, flush_size: int, flush_interval_ms: int, buffer_limit: int):
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval_ms / 1000
+        self.buffer_limit = buffer_limit
+
+        self._buffer: List[Dict[str, Any]] = []
+        # строки, которые сейчас пишутся
+        self._writing: List[Dict[str, Any]] = []
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._retry_delay = 0.0
+
+    def record(self, user_id: int, task_id: int, user_answer: str, is_correct: Optional[bool]) -> datetime:
+        """Поставить ответ в буфер на запись; возвращает его submitted_at"""
+        row = {
+            "user_id": user_id,
+            "task_id": task_id,
+            "user_answer": user_answer,
+            "is_correct": is_correct,
+            "submitted_at": datetime.utcnow(),
+        }
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="answer-recorder", daemon=True)
+                self._thread.start()
+            self._buffer.append(row)
+            _trim(self._buffer, self.buffer_limit)
+            full = len(self._buffer) >= self.flush_size
+
+        if full:
+            self._wakeup.set()
+        return row["submitted_at"]
+
+    def pending(self) -> int:
+        with self._lock:
+            return len(self._buffer)
+
+    def buffered(self, user_id: int) -> List[Dict[str, Any]]:
+        """Ответы ученика, ещё не записанные в БД"""
+        with self._lock:
+            return [row for row in self._writing + self._buffer if row["user_id"] == user_id]
+
+    def _write(self, rows: List[Dict[str, Any]]) -> None:
+        db = SessionLocal()
+        try:
+            db.execute(insert(UserSession), rows)
+            progress.apply(db, rows)
+            difficulty.apply(db, rows)
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    def _write_one_by_one(self, rows: List[Dict[str, Any]]) -> None:
+        """Записать строки по одной; записанные и отложенные убираются из rows"""
+        while rows:
+            try:
+                self._write(rows[:1])
+            except Exception as e:
+                if _db_unavailable(e):
+                    raise
+                _dead_letter(rows[0], e)
+            del rows[0]
+
+    def flush(self) -> bool:
+        """Записать буфер одной транзакцией. False — БД недоступна, строки вернулись в буфер"""
+        with self._flush_lock:
+            with self._lock:
+                rows, self._buffer = self._buffer, []
+                self._writing = rows
+            if not rows:
+                return True
+
+            try:
+                try:
+                    self._write(rows)
+                except Exception as e:
+                    if _db_unavailable(e):
+                        raise
+                    logger.warning(f"Пачка ответов ({len(rows)} шт.) не записалась, пишем по одному: {e}")
+                    self._write_one_by_one(rows)
+                with self._lock:
+                    self._writing = []
+                return True
+            except Exception as e:
+                logger.error(f"Ошибка записи ответов ({len(rows)} шт.), повторим позже: {e}")
+                with self._lock:
+                    self._writing = []
+                    self._buffer[:0] = rows
+                    _trim(self._buffer, self.buffer_limit)
+                return False
+
+    def _run(self) -> None:
+        while not self._stopped.is_set():
+            self._wakeup.wait(self.flush_interval + self._retry_delay)
+            self._wakeup.clear()
+            if self.flush():
+                self._retry_delay = 0.0
+            else:
+                self._retry_delay = min(max(self._retry_delay * 2, 1.0), _MAX_RETRY_DELAY)
+
+    def shutdown(self, attempts: int = 3) -> None:
+        """Остановить фоновый поток и сбросить буфер в БД"""
+        self._stopped.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+
+        for _ in range(attempts):
+            if self.flush():
+                return
+        logger.error(f"При остановке не записано ответов: {self.pending()}")
+
+
+class AsyncAnswerRecorder:
+    """То же для асинхронного бота: запись через AsyncSession из фоновой задачи"""
+
+    def __init__(self, flush_size: int, flush_interval_ms: int, buffer_limit: int):
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval_ms / 1000
+        self.buffer_limit = buffer_limit
+
+        self._buffer: List[Dict[str, Any]] = []
+        self._writing: List[Dict[str, Any]] = []
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._retry_delay = 0.0
+
+    def record(self, user_id: int, task_id: int, user_answer: str, is_correct: Optional[bool]) -> datetime:
+        if self._task is None:
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+        submitted_at = datetime.utcnow()
+        self._buffer.append({
+            "user_id": user_id,
+            "task_id": task_id,
+            "user_answer": user_answer,
+            "is_correct": is_correct,
+            "submitted_at": submitted_at,
+        })
+        _trim(self._buffer, self.buffer_limit)
+        if len(self._buffer) >= self.flush_size:
+            self._wakeup.set()
+        return submitted_at
+
+    def buffered(self, user_id: int) -> List[Dict[str, Any]]:
+        return [row for row in self._writing + self._buffer if row["user_id"] == user_id]
+
+    async def _write(self, rows: List[Dict[str, Any]]) -> None:
+        from db_async import AsyncSessionLocal
+
+        async with AsyncSessionLocal() as db:
+            await db.execute(insert(UserSession), rows)
+            await db.run_sync(progress.apply, rows)
+            await db.run_sync(difficulty.apply, rows)
+            await db.commit()
+
+    async def _write_one_by_one(self, rows: List[Dict[str, Any]]) -> None:
+        while rows:
+            try:
+                await self._write(rows[:1])
+            except Exception as e:
+                if _db_unavailable(e):
+                    raise
+                _dead_letter(rows[0], e)
+            del rows[0]
+
+    async def flush(self) -> bool:
+        rows, self._buffer = self._buffer, []
+        if not rows:
+            return True
+        self._writing = rows
+        try:
+            try:
+                await self._write(rows)
+            except Exception as e:
+                if _db_unavailable(e):
+                    raise
+                logger.warning(f"Пачка ответов ({len(rows)} шт.) не записалась, пишем по одному: {e}")
+                await self._write_one_by_one(rows)
+            return True
+        except asyncio.CancelledError:
+            # задачу остановили посреди записи — незаписанные строки вернутся в буфер для shutdown()
+            self._buffer[:0] = rows
+            raise
+        except Exception as e:
+            logger.error(f"Ошибка записи ответов ({len(rows)} шт.), повторим позже: {e}")
+            self._buffer[:0] = rows
+            _trim(self._buffer, self.buffer_limit)
+            return False
+        finally:
+            self._writing = []
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.flush_interval + self._retry_delay)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            if await self.flush():
+                self._retry_delay = 0.0
+            else:
+                self._retry_delay = min(max(self._retry_delay * 2, 1.0), _MAX_RETRY_DELAY)
+
+    async def shutdown(self, attempts: int = 3) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        for _ in range(attempts):
+            if await self.flush():
+                return
+        logger.error(f"При остановке не записано ответов: {len(self._buffer)}")
+
+
+answer_recorder = AnswerRecorder(ANSWER_FLUSH_SIZE, ANSWER_FLUSH_INTERVAL_MS, ANSWER_BUFFER_LIMIT)
+
+async_answer_recorder = AsyncAnswerRecorder(ANSWER_FLUSH_SIZE, ANSWER_FLUSH_INTERVAL_MS, ANSWER_BUFFER_LIMIT)
@@ -0,0 +1,79 @@
+# async_main.py — запуск бота на asyncio (AsyncTeleBot, AsyncSession, ainvoke)
+#
+# Те же сценарии, что и в main.py, но все ожидания (Telegram, БД, GigaChat)
+# идут в одном цикле событий, а не в пуле потоков. Запуск:
+#   python async_main.py
+import os
+from dotenv import load_dotenv
+load_dotenv()
+import asyncio
+import logging
+import signal
+
+from telebot import asyncio_helper
+from telebot.async_telebot import AsyncTeleBot
+
+from db import init_db
+from db_async import async_engine
+from handlers.async_user_handlers import register_async_user_handlers
+from handlers.async_admin_handlers import register_async_admin_handlers, resume_async_broadcasts
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
+if not TOKEN:
+    raise ValueError("TELEGRAM_BOT_TOKEN не указан в .env")
+
+# Другой адрес Bot API, например tools/fake_telegram.py для офлайн-проверки
+if os.getenv("TELEGRAM_API_URL"):
+    asyncio_helper.API_URL = os.getenv("TELEGRAM_API_URL")
+
+bot = AsyncTeleBot(TOKEN)
+
+
+async def main():
+    import catalog
+    from answer_recorder import async_answer_recorder
+    from reference import init_reference_data
+    from startup import load_llm
+    import metrics
+
+    # схема и справочники создаются синхронным кодом — один раз при старте
+    await asyncio.to_thread(init_db)
+    await asyncio.to_thread(init_reference_data)
+    # каталог заданий — тоже: обработчики читают его из цикла событий
+    await asyncio.to_thread(catalog.reload)
+
+    register_async_user_handlers(bot)
+    register_async_admin_handlers(bot)
+
+    # METRICS_PORT — метрики для Prometheus на локальном порту
+    metrics.start_server()
+
+    polling = asyncio.create_task(bot.infinity_polling())
+    # LLM-стек грузим в фоне, когда опрос уже запущен
+    asyncio.get_running_loop().run_in_executor(None, load_llm)
+    asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, polling.cancel)
+
+    # рассылки, прерванные прошлой остановкой, продолжаются с контрольной точки
+    await resume_async_broadcasts(bot)
+
+    logger.info("Бот запущен (asyncio).")
+    try:
+        await bot.delete_webhook()
+        await polling
+    except asyncio.CancelledError:
+        pass
+    finally:
+        # при остановке дописываем в БД накопленные ответы
+        await async_answer_recorder.shutdown()
+        await bot.close_session()
+        await async_engine.dispose()
+
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass
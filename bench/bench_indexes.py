@@ -0,0 +1,123 @@
+# bench/bench_indexes.py — планы и время запросов до и после migrations.py
+#
+# На копии hsk.db (старая схема, без индексов) создаётся --rows строк
+# user_sessions, затем одни и те же запросы выполняются до и после
+# run_migrations(): печатаются EXPLAIN QUERY PLAN и среднее время.
+#
+#   python -m bench.bench_indexes --rows 2000000
+import argparse
+import os
+import random
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from bench.fakes import seed_database  # noqa: E402
+
+QUERIES = {
+    "задание по номеру": (
+        "SELECT id FROM tasks WHERE level_id = :level_id AND section_id = :section_id AND task_number = :task_number"
+    ),
+    "история пользователя": (
+        "SELECT task_id, is_correct, submitted_at FROM user_sessions"
+        " WHERE user_id = :user_id ORDER BY submitted_at DESC LIMIT 20"
+    ),
+    "точность пользователя": (
+        "SELECT COUNT(*), SUM(is_correct) FROM user_sessions WHERE user_id = :user_id"
+    ),
+    "точность по заданию": (
+        "SELECT COUNT(*), SUM(is_correct) FROM user_sessions WHERE task_id = :task_id"
+    ),
+}
+
+
+def fill_sessions(conn: sqlite3.Connection, rows: int, users: int, seed: int) -> None:
+    rnd = random.Random(seed)
+    task_ids = [row[0] for row in conn.execute("SELECT id FROM tasks")]
+    start = datetime(2025, 1, 1)
+    chunk = 100000
+    for offset in range(0, rows, chunk):
+        conn.executemany(
+            "INSERT INTO user_sessions (user_id, task_id, user_answer, is_correct, submitted_at) VALUES (?, ?, ?, ?, ?)",
+            [
+                (
+                    rnd.randrange(users),
+                    rnd.choice(task_ids),
+                    "ABBBA",
+                    rnd.random() < 0.6,
+                    (start + timedelta(seconds=rnd.randrange(180 * 86400))).isoformat(" "),
+                )
+                for _ in range(min(chunk, rows - offset))
+            ]
+        )
+        conn.commit()
+
+
+def measure(conn: sqlite3.Connection, sql: str, params_list) -> tuple:
+    plan = "; ".join(row[-1] for row in conn.execute("EXPLAIN QUERY PLAN " + sql, params_list[0]))
+    started = time.perf_counter()
+    for params in params_list:
+        conn.execute(sql, params).fetchall()
+    return plan, (time.perf_counter() - started) / len(params_list)
+
+
+def run_all(conn: sqlite3.Connection, samples: dict) -> dict:
+    return {name: measure(conn, sql, samples[name]) for name, sql in QUERIES.items()}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Запросы к tasks и user_sessions до и после миграций")
+    parser.add_argument("--rows", type=int, default=2000000, help="строк в user_sessions")
+    parser.add_argument("--users", type=int, default=50000)
+    parser.add_argument("--repeat", type=int, default=20, help="повторов каждого запроса")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="hsk-indexes-")
+    db_path = os.path.join(workdir, "hsk.db")
+    seed_database(os.path.join(ROOT, "hsk.db"), db_path, extra_tasks=200)
+
+    conn = sqlite3.connect(db_path)
+    print(f"Заполняем user_sessions: {args.rows} строк...")
+    fill_sessions(conn, args.rows, args.users, args.seed)
+
+    rnd = random.Random(args.seed)
+    tasks = conn.execute("SELECT id, level_id, section_id, task_number FROM tasks").fetchall()
+    samples = {
+        "задание по номеру": [
+            dict(zip(("level_id", "section_id", "task_number"), rnd.choice(tasks)[1:])) for _ in range(args.repeat)
+        ],
+        "история пользователя": [{"user_id": rnd.randrange(args.users)} for _ in range(args.repeat)],
+        "точность пользователя": [{"user_id": rnd.randrange(args.users)} for _ in range(args.repeat)],
+        "точность по заданию": [{"task_id": rnd.choice(tasks)[0]} for _ in range(args.repeat)],
+    }
+
+    before = run_all(conn, samples)
+    conn.close()
+
+    os.environ["DATABASE_URL"] = f"sqlite:///{db_path}"
+    from db import engine
+    from migrations import run_migrations
+
+    started = time.perf_counter()
+    version = run_migrations(engine)
+    print(f"Миграции до версии {version}: {time.perf_counter() - started:.1f} с\n")
+
+    conn = sqlite3.connect(db_path)
+    after = run_all(conn, samples)
+    conn.close()
+
+    for name in QUERIES:
+        (plan_before, t_before), (plan_after, t_after) = before[name], after[name]
+        print(f"{name}: {t_before * 1000:.2f} мс → {t_after * 1000:.2f} мс (x{t_before / max(t_after, 1e-9):.0f})")
+        print(f"  до:    {plan_before}")
+        print(f"  после: {plan_after}")
+
+    engine.dispose()
+    shutil.rmtree(workdir, ignore_errors=True)
@@ -0,0 +1,111 @@
+# bench/bench_runtimes.py — сравнение main.py (потоки) и async_main.py (asyncio)
+#
+# Оба варианта бота запускаются по очереди на копии hsk.db против
+# tools/fake_telegram.py. Каждый из USERS пользователей проходит один и тот же
+# сценарий: ждёт ответа бота и ещё --think секунд перед следующим сообщением;
+# у каждого вызова Bot API задержка --latency. Печатаются время прогона, ответов в секунду и
+# перцентили времени ответа.
+#
+#   python -m bench.bench_runtimes --users 500 --latency 0.05
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from bench.stats import percentile  # noqa: E402
+from tools.fake_telegram import FakeTelegram  # noqa: E402
+
+SCRIPT = [
+    "/start",
+    "HSK 1",
+    "Аудирование",
+    "Задание 1",
+    "ABBBA",
+    "Следующее задание",
+    "AACAC",
+    "🏠 В главное меню",
+]
+
+RUNTIMES = {
+    "threads": "main.py",
+    "asyncio": "async_main.py",
+}
+
+
+def run(script: str, users: int, latency: float, think: float, timeout: float) -> Dict[str, float]:
+    workdir = tempfile.mkdtemp(prefix="hsk-bench-")
+    db_path = os.path.join(workdir, "hsk.db")
+    shutil.copy(os.path.join(ROOT, "hsk.db"), db_path)
+
+    fake = FakeTelegram([], latency=latency, think_time=think, script_timeout=60)
+    fake.start()
+    env = dict(
+        os.environ,
+        TELEGRAM_BOT_TOKEN="1:bench",
+        TELEGRAM_API_URL=fake.api_url,
+        BOT_MODE="polling",
+        DATABASE_URL=f"sqlite:///{db_path}",
+        STATE_BACKEND="memory",
+    )
+    bot = subprocess.Popen(
+        [sys.executable, script], cwd=ROOT, env=env,
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        # отсчёт начинаем, когда бот запустился и начал опрашивать getUpdates
+        while not any(method == "getUpdates" for method, _ in list(fake.calls)):
+            if bot.poll() is not None:
+                raise RuntimeError(f"{script} завершился с кодом {bot.returncode}")
+            time.sleep(0.1)
+        started = time.monotonic()
+        for user_id in range(1, users + 1):
+            fake.add_script(1000 + user_id, SCRIPT)
+        finished = fake.wait_idle(timeout)
+        elapsed = time.monotonic() - started
+    finally:
+        bot.terminate()
+        try:
+            bot.wait(timeout=15)
+        except subprocess.TimeoutExpired:
+            bot.kill()
+        fake.stop()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    times = fake.response_times
+    return {
+        "finished": finished,
+        "elapsed": elapsed,
+        "responses": len(times),
+        "rps": len(times) / elapsed if elapsed else 0.0,
+        "p50": percentile(times, 0.50),
+        "p95": percentile(times, 0.95),
+        "p99": percentile(times, 0.99),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Потоки против asyncio на одном сценарии")
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--latency", type=float, default=0.05, help="задержка вызова Bot API, секунды")
+    parser.add_argument("--think", type=float, default=0.2, help="пауза пользователя перед ответом, секунды")
+    parser.add_argument("--timeout", type=float, default=300)
+    parser.add_argument("--runtime", choices=sorted(RUNTIMES), action="append",
+                        help="какие варианты запускать (по умолчанию оба)")
+    args = parser.parse_args()
+
+    print(f"Ожидается ответов: {args.users * len(SCRIPT)}")
+    print(f"{'runtime':<8} {'time,s':>8} {'resp':>6} {'resp/s':>8} {'p50,ms':>8} {'p95,ms':>8} {'p99,ms':>8}")
+    for name in args.runtime or sorted(RUNTIMES, reverse=True):
+        r = run(RUNTIMES[name], args.users, args.latency, args.think, args.timeout)
+        print(
+            f"{name:<8} {r['elapsed']:>8.1f} {r['responses']:>6} {r['rps']:>8.1f} "
+            f"{r['p50'] * 1000:>8.0f} {r['p95'] * 1000:>8.0f} {r['p99'] * 1000:>8.0f}"
+            + ("" if r["finished"] else "  (не уложились в --timeout)")
+        )
@@ -0,0 +1,126 @@
+# bench/bench_startup.py — время запуска бота с бюджетом
+#
+# Бот запускается --runs раз на копии hsk.db против tools/fake_telegram.py.
+# Засекается время от старта процесса до первого getUpdates (бот готов
+# принимать обновления) и до ответа на /start, отправленный сразу после
+# запуска. Если медиана готовности больше --budget секунд, скрипт
+# завершается с кодом 1 — так бюджет можно проверять в CI.
+#
+#   python -m bench.bench_startup --runs 5 --budget 1.5
+#   python -m bench.bench_startup --profile   # плюс отчёт main.py --profile-startup
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from bench.stats import percentile  # noqa: E402
+from tools.fake_telegram import FakeTelegram, message_update  # noqa: E402
+
+RUNTIMES = {
+    "threads": "main.py",
+    "asyncio": "async_main.py",
+}
+
+
+def _env(db_path: str, api_url: str = "") -> Dict[str, str]:
+    return dict(
+        os.environ,
+        TELEGRAM_BOT_TOKEN="1:bench",
+        TELEGRAM_API_URL=api_url,
+        BOT_MODE="polling",
+        DATABASE_URL=f"sqlite:///{db_path}",
+        STATE_BACKEND="memory",
+    )
+
+
+def _copy_db(workdir: str) -> str:
+    db_path = os.path.join(workdir, "hsk.db")
+    shutil.copy(os.path.join(ROOT, "hsk.db"), db_path)
+    return db_path
+
+
+def run_once(script: str, timeout: float) -> Dict[str, float]:
+    workdir = tempfile.mkdtemp(prefix="hsk-bench-")
+    db_path = _copy_db(workdir)
+    fake = FakeTelegram([message_update(1, 1001, "/start")])
+    fake.start()
+    started = time.monotonic()
+    bot = subprocess.Popen(
+        [sys.executable, script], cwd=ROOT, env=_env(db_path, fake.api_url),
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    ready = answered = None
+    try:
+        while answered is None and time.monotonic() - started < timeout:
+            if bot.poll() is not None:
+                raise RuntimeError(f"{script} завершился с кодом {bot.returncode}")
+            methods = [method for method, _ in list(fake.calls)]
+            now = time.monotonic() - started
+            if ready is None and "getUpdates" in methods:
+                ready = now
+            if "sendMessage" in methods:
+                answered = now
+            time.sleep(0.01)
+    finally:
+        bot.terminate()
+        try:
+            bot.wait(timeout=15)
+        except subprocess.TimeoutExpired:
+            bot.kill()
+        fake.stop()
+        shutil.rmtree(workdir, ignore_errors=True)
+    if answered is None:
+        raise RuntimeError(f"{script} не ответил на /start за {timeout:g} с")
+    return {"ready": ready, "answered": answered}
+
+
+def profile() -> str:
+    workdir = tempfile.mkdtemp(prefix="hsk-bench-")
+    try:
+        result = subprocess.run(
+            [sys.executable, "main.py", "--profile-startup"], cwd=ROOT, env=_env(_copy_db(workdir)),
+            capture_output=True, text=True, check=True,
+        )
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return result.stdout
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Время запуска бота")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--budget", type=float, default=float(os.getenv("STARTUP_BUDGET", "1.5")),
+                        help="предел медианы готовности (до первого getUpdates), секунды")
+    parser.add_argument("--timeout", type=float, default=60)
+    parser.add_argument("--runtime", choices=sorted(RUNTIMES), action="append",
+                        help="какие варианты запускать (по умолчанию оба)")
+    parser.add_argument("--profile", action="store_true", help="напечатать отчёт main.py --profile-startup")
+    args = parser.parse_args()
+
+    if args.profile:
+        print(profile())
+
+    print(f"{'runtime':<8} {'ready p50,s':>12} {'ready max,s':>12} {'/start p50,s':>13}")
+    over_budget: List[str] = []
+    for name in args.runtime or sorted(RUNTIMES, reverse=True):
+        runs = [run_once(RUNTIMES[name], args.timeout) for _ in range(args.runs)]
+        ready = [r["ready"] for r in runs]
+        p50 = percentile(ready, 0.50)
+        print(
+            f"{name:<8} {p50:>12.2f} {max(ready):>12.2f} "
+            f"{percentile([r['answered'] for r in runs], 0.50):>13.2f}"
+        )
+        if p50 > args.budget:
+            over_budget.append(name)
+
+    if over_budget:
+        print(f"❌ Бюджет запуска {args.budget:g} с превышен: {', '.join(over_budget)}")
+        sys.exit(1)
+    print(f"✅ Запуск укладывается в бюджет {args.budget:g} с")
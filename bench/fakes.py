@@ -0,0 +1,128 @@
+# bench/fakes.py — подмены внешних сервисов для нагрузочного прогона
+#
+#   FakeTransport — вместо HTTP к Bot API (apihelper.CUSTOM_REQUEST_SENDER):
+#                   запоминает вызовы и отвечает фиктивным сообщением
+#   stub_chain    — цепочка с тем же промптом, но вместо GigaChat пауза и шаблонный ответ
+#   seed_database — копия hsk.db с дополнительными синтетическими заданиями
+import itertools
+import json
+import shutil
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+from langchain_core.messages import AIMessage
+from langchain_core.output_parsers import StrOutputParser
+from langchain_core.runnables import RunnableLambda
+
+BOT_USER = {"id": 1, "is_bot": True, "first_name": "HSK Bot", "username": "hsk_test_bot"}
+
+
+class _Response:
+    status_code = 200
+    reason = "OK"
+
+    def __init__(self, result: Any):
+        self.text = json.dumps({"ok": True, "result": result})
+
+    def json(self) -> Dict[str, Any]:
+        return json.loads(self.text)
+
+
+class FakeTransport:
+    """Замена HTTP-запросов TeleBot: apihelper.CUSTOM_REQUEST_SENDER = FakeTransport(...)"""
+
+    def __init__(self, latency: float = 0):
+        self.latency = latency
+        # (время, метод, chat_id)
+        self.calls: List[Tuple[float, str, Optional[int]]] = []
+        self._lock = threading.Lock()
+        self._message_ids = itertools.count(1)
+
+    def __call__(self, method: str, url: str, params: Optional[Dict[str, Any]] = None, **kwargs) -> _Response:
+        api_method = urlsplit(url).path.rsplit("/", 1)[-1]
+        params = params or {}
+        chat_id = int(params["chat_id"]) if params.get("chat_id") else None
+        if self.latency:
+            time.sleep(self.latency)
+        with self._lock:
+            self.calls.append((time.monotonic(), api_method, chat_id))
+            message_id = next(self._message_ids)
+
+        if api_method == "getMe":
+            return _Response(BOT_USER)
+        if api_method.startswith("send") or api_method.startswith("edit"):
+            return _Response({
+                "message_id": message_id,
+                "date": int(time.time()),
+                "chat": {"id": chat_id or 0, "type": "private"},
+                "from": BOT_USER,
+            })
+        return _Response(True)
+
+    def count(self) -> int:
+        with self._lock:
+            return len(self.calls)
+
+
+class StubChat:
+    """Вместо GigaChat: пауза latency секунд и ответ фиксированного формата"""
+
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, prompt) -> AIMessage:
+        time.sleep(self.latency)
+        with self._lock:
+            self.calls += 1
+        return AIMessage(content=(
+            "Сильные стороны: текст по теме.\n"
+            "Ошибки (макс. 3): нет.\n"
+            "Улучшенный вариант: 我喜欢学习汉语。— Я люблю изучать китайский.\n"
+            "Совет для подготовки: пишите каждый день."
+        ))
+
+
+def stub_chain(chat: StubChat):
+    from llm import PROMPT
+
+    return PROMPT | RunnableLambda(chat) | StrOutputParser()
+
+
+def seed_database(source: str, target: str, extra_tasks: int) -> None:
+    """Копия source с extra_tasks дополнительными заданиями в каждом разделе каждого уровня"""
+    shutil.copy(source, target)
+    if not extra_tasks:
+        return
+
+    conn = sqlite3.connect(target)
+    try:
+        levels = [row[0] for row in conn.execute("SELECT id FROM exam_levels")]
+        sections = conn.execute("SELECT id, name FROM sections").fetchall()
+        rows = []
+        for level_id in levels:
+            for section_id, section_name in sections:
+                start = conn.execute(
+                    "SELECT COALESCE(MAX(task_number), 0) FROM tasks WHERE level_id = ? AND section_id = ?",
+                    (level_id, section_id)
+                ).fetchone()[0]
+                for number in range(start + 1, start + extra_tasks + 1):
+                    rows.append((
+                        level_id, section_id, number,
+                        f"bench-photo-{level_id}-{section_id}-{number}",
+                        f"bench-audio-{level_id}-{section_id}-{number}" if section_name == "Аудирование" else None,
+                        "Синтетическое задание для нагрузочного прогона.",
+                        None if section_name == "Письмо" else json.dumps("ABBBA"),
+                    ))
+        conn.executemany(
+            "INSERT INTO tasks (level_id, section_id, task_number, photo_file_id, audio_file_id,"
+            " comment_text, correct_answer, created_at) VALUES (?, ?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)",
+            rows
+        )
+        conn.commit()
+    finally:
+        conn.close()
@@ -0,0 +1,344 @@
+# bench/load_test.py — нагрузочный прогон настоящих обработчиков без сети
+#
+# Обработчики из register_user_handlers/register_admin_handlers работают на
+# копии hsk.db (bench/fakes.seed_database). Bot API заменён FakeTransport,
+# GigaChat — заглушкой с задержкой --llm-latency. Сценарии пользователей
+# (/start → уровень → раздел → задание → ответ → следующее задание, часть
+# пользователей сдаёт письмо) проигрываются с частотой --rate сообщений в
+# секунду. Сообщения одного пользователя обрабатываются по порядку, как в
+# webhook.py.
+#
+# Итог: пропускная способность, p50/p95/p99 по обработчикам и от отправки
+# сообщения до конца обработки, число запросов к БД.
+#
+#   python -m bench.load_test --users 300 --rate 100 --json bench.json
+#   python -m bench.load_test --baseline bench.json   # код 1 при регрессии
+import argparse
+import functools
+import json
+import logging
+import os
+import queue
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from typing import Any, Dict, List, Tuple
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from bench.fakes import FakeTransport, StubChat, seed_database, stub_chain  # noqa: E402
+from bench.stats import HandlerStats, percentile  # noqa: E402
+
+ADMIN_ID = 1
+
+PRACTICE_SCRIPT = [
+    "/start",
+    "HSK 1",
+    "Аудирование",
+    "Задание 1",
+    "ABBBA",
+    "Следующее задание",
+    "AACAC",
+    "К списку заданий",
+    "🏠 В главное меню",
+]
+
+WRITING_SCRIPT = [
+    "/start",
+    "HSK 1",
+    "Письмо",
+    "Задание 1",
+    None,  # текст сочинения, у каждого пользователя свой
+]
+
+
+def make_update(update_id: int, user_id: int, text: str) -> Dict[str, Any]:
+    message = {
+        "message_id": update_id,
+        "date": int(time.time()),
+        "chat": {"id": user_id, "type": "private"},
+        "from": {"id": user_id, "is_bot": False, "first_name": f"user{user_id}"},
+        "text": text,
+    }
+    if text.startswith("/"):
+        message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+    return {"update_id": update_id, "message": message}
+
+
+def build_schedule(users: int, writing_share: float, rate: float) -> List[Tuple[float, Dict[str, Any]]]:
+    """(время от старта, update): шаги всех пользователей по кругу, rate сообщений в секунду"""
+    writers = int(users * writing_share)
+    scripts = {}
+    for i in range(users):
+        user_id = 1000 + i
+        if i < writers:
+            essay = f"我叫学生{user_id}。我每天学习汉语，我觉得汉语很有意思。"
+            scripts[user_id] = [essay if text is None else text for text in WRITING_SCRIPT]
+        else:
+            scripts[user_id] = PRACTICE_SCRIPT
+
+    schedule = []
+    longest = max((len(s) for s in scripts.values()), default=0)
+    for step in range(longest):
+        for user_id, script in scripts.items():
+            if step < len(script):
+                update_id = len(schedule) + 1
+                schedule.append((len(schedule) / rate, make_update(update_id, user_id, script[step])))
+    return schedule
+
+
+class LoadTest:
+    def __init__(self, args):
+        self.args = args
+        self.stats = HandlerStats()
+        self.latencies: List[float] = []
+        self.errors = 0
+        self.queries = 0
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._writing_pending = 0
+        self._writing_done = threading.Condition(self._lock)
+
+    # --- окружение ---
+
+    def setup(self) -> None:
+        self.workdir = tempfile.mkdtemp(prefix="hsk-load-")
+        db_path = os.path.join(self.workdir, "hsk.db")
+        seed_database(os.path.join(ROOT, "hsk.db"), db_path, self.args.extra_tasks)
+
+        # модули бота читают настройки при импорте — окружение задаём до него
+        os.environ.update({
+            "DATABASE_URL": f"sqlite:///{db_path}",
+            "TELEGRAM_BOT_TOKEN": "1:bench",
+            "ADMIN_IDS": str(ADMIN_ID),
+            "STATE_BACKEND": "memory",
+        })
+
+        from sqlalchemy import event
+        from telebot import TeleBot, apihelper
+
+        import db
+        import llm
+        from handlers.admin_handlers import register_admin_handlers
+        from handlers.user_handlers import register_user_handlers
+        from router import router_for
+        from writing_queue import writing_queue
+
+        db.init_db()
+        from reference import init_reference_data
+        init_reference_data()
+
+        event.listen(db.engine, "before_cursor_execute", self._count_query)
+
+        self.transport = FakeTransport(latency=self.args.api_latency)
+        apihelper.CUSTOM_REQUEST_SENDER = self.transport
+        self.chat = StubChat(self.args.llm_latency)
+        llm._chain = stub_chain(self.chat)
+
+        self.bot = TeleBot("1:bench", threaded=False)
+        register_user_handlers(self.bot)
+        register_admin_handlers(self.bot)
+
+        router = router_for(self.bot)
+        resolve = router.resolve
+        router.resolve = lambda message: self.timed(resolve(message))
+
+        submit = writing_queue.submit
+
+        def timed_submit(user_id, job):
+            queued_at = time.perf_counter()
+
+            def run():
+                start = self._queries_here()
+                try:
+                    job()
+                finally:
+                    self.stats.add("writing_feedback", time.perf_counter() - queued_at, self._queries_here() - start)
+                    with self._lock:
+                        self._writing_pending -= 1
+                        self._writing_done.notify_all()
+
+            position = submit(user_id, run)
+            with self._lock:
+                self._writing_pending += 1
+            return position
+
+        writing_queue.submit = timed_submit
+
+        # ответы уходят через outbox — время до ответа Bot API считаем отдельно
+        from outbox import outbox
+        call = outbox.call
+
+        def timed_call(method, chat_id, *args, **kwargs):
+            queued_at = time.perf_counter()
+            future = call(method, chat_id, *args, **kwargs)
+            future.add_done_callback(lambda _: self.stats.add("outbox_delivery", time.perf_counter() - queued_at, 0))
+            return future
+
+        outbox.call = timed_call
+
+    def _count_query(self, *args) -> None:
+        self._local.queries = getattr(self._local, "queries", 0) + 1
+        with self._lock:
+            self.queries += 1
+
+    def _queries_here(self) -> int:
+        return getattr(self._local, "queries", 0)
+
+    def timed(self, handler):
+        if handler is None:
+            return None
+
+        @functools.wraps(handler)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            queries = self._queries_here()
+            try:
+                return handler(*args, **kwargs)
+            finally:
+                self.stats.add(handler.__name__, time.perf_counter() - start, self._queries_here() - queries)
+
+        return wrapper
+
+    # --- прогон ---
+
+    def _worker(self, updates: "queue.Queue", started: float) -> None:
+        from telebot import types
+
+        while True:
+            item = updates.get()
+            if item is None:
+                return
+            due, update = item
+            try:
+                self.bot.process_new_updates([types.Update.de_json(update)])
+            except Exception as e:
+                logging.error(f"Ошибка обработки обновления {update['update_id']}: {e}")
+                with self._lock:
+                    self.errors += 1
+            with self._lock:
+                self.latencies.append(time.monotonic() - started - due)
+
+    def run(self) -> Dict[str, Any]:
+        from answer_recorder import answer_recorder
+        from outbox import outbox
+
+        schedule = build_schedule(self.args.users, self.args.writing_share, self.args.rate)
+        queues = [queue.Queue() for _ in range(self.args.workers)]
+        started = time.monotonic()
+        threads = [
+            threading.Thread(target=self._worker, args=(q, started), daemon=True)
+            for q in queues
+        ]
+        for t in threads:
+            t.start()
+
+        # как в webhook.py: сообщения одного пользователя — всегда одному воркеру
+        for due, update in schedule:
+            delay = started + due - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            queues[update["message"]["from"]["id"] % len(queues)].put((due, update))
+        for q in queues:
+            q.put(None)
+        for t in threads:
+            t.join()
+        handled = time.monotonic() - started
+
+        with self._lock:
+            self._writing_done.wait_for(lambda: self._writing_pending <= 0, timeout=self.args.timeout)
+        outbox.flush(self.args.timeout)
+        answer_recorder.flush()
+        elapsed = time.monotonic() - started
+
+        return {
+            "summary": {
+                "updates": len(schedule),
+                "target_rate": self.args.rate,
+                "throughput": len(schedule) / handled if handled else 0.0,
+                "duration_s": elapsed,
+                "e2e_p50_ms": percentile(self.latencies, 0.50) * 1000,
+                "e2e_p95_ms": percentile(self.latencies, 0.95) * 1000,
+                "e2e_p99_ms": percentile(self.latencies, 0.99) * 1000,
+                "errors": self.errors,
+                "bot_api_calls": self.transport.count(),
+                "llm_calls": self.chat.calls,
+                "db_queries": self.queries,
+            },
+            "handlers": self.stats.summary(),
+        }
+
+
+def print_report(report: Dict[str, Any]) -> None:
+    s = report["summary"]
+    print(f"Обновлений: {s['updates']}, цель {s['target_rate']:.0f}/с, обработано {s['throughput']:.1f}/с, "
+          f"всего {s['duration_s']:.1f} с, ошибок {s['errors']}")
+    print(f"От сообщения до ответа: p50 {s['e2e_p50_ms']:.0f} мс, p95 {s['e2e_p95_ms']:.0f} мс, "
+          f"p99 {s['e2e_p99_ms']:.0f} мс")
+    print(f"Вызовов Bot API: {s['bot_api_calls']}, GigaChat: {s['llm_calls']}, запросов к БД: {s['db_queries']}")
+    print()
+    print(f"{'обработчик':<28} {'вызовов':>8} {'p50,мс':>8} {'p95,мс':>8} {'p99,мс':>8} {'SQL/вызов':>10}")
+    for name, h in report["handlers"].items():
+        print(f"{name:<28} {h['calls']:>8} {h['p50_ms']:>8.1f} {h['p95_ms']:>8.1f} "
+              f"{h['p99_ms']:>8.1f} {h['queries_per_call']:>10.2f}")
+
+
+def find_regressions(report: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> List[str]:
+    """Что стало хуже базового прогона: p95 больше чем на tolerance, запросов к БД больше"""
+    problems = []
+    old, new = baseline["summary"], report["summary"]
+    if new["e2e_p95_ms"] > old["e2e_p95_ms"] * (1 + tolerance):
+        problems.append(f"p95 до ответа: {old['e2e_p95_ms']:.0f} → {new['e2e_p95_ms']:.0f} мс")
+    if new["throughput"] < old["throughput"] * (1 - tolerance):
+        problems.append(f"пропускная способность: {old['throughput']:.1f} → {new['throughput']:.1f}/с")
+    for name, h in report["handlers"].items():
+        was = baseline["handlers"].get(name)
+        if not was:
+            continue
+        if h["p95_ms"] > was["p95_ms"] * (1 + tolerance):
+            problems.append(f"{name}: p95 {was['p95_ms']:.1f} → {h['p95_ms']:.1f} мс")
+        if h["queries_per_call"] > was["queries_per_call"] + 0.01:
+            problems.append(f"{name}: запросов к БД {was['queries_per_call']:.2f} → {h['queries_per_call']:.2f}")
+    return problems
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Нагрузочный прогон обработчиков бота без сети")
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--rate", type=float, default=50, help="сообщений в секунду")
+    parser.add_argument("--writing-share", type=float, default=0.1, help="доля пользователей, сдающих письмо")
+    parser.add_argument("--workers", type=int, default=8, help="потоков обработки, как WEBHOOK_WORKERS")
+    parser.add_argument("--api-latency", type=float, default=0.03, help="задержка вызова Bot API, секунды")
+    parser.add_argument("--llm-latency", type=float, default=2.0, help="задержка ответа GigaChat, секунды")
+    parser.add_argument("--extra-tasks", type=int, default=20, help="синтетических заданий в каждом разделе")
+    parser.add_argument("--timeout", type=float, default=300, help="сколько ждать проверки писем, секунды")
+    parser.add_argument("--json", help="сохранить отчёт в файл")
+    parser.add_argument("--baseline", help="отчёт прошлого прогона для сравнения")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="допустимое ухудшение p95 и пропускной способности")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    test = LoadTest(args)
+    test.setup()
+    try:
+        report = test.run()
+    finally:
+        shutil.rmtree(test.workdir, ignore_errors=True)
+    print_report(report)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            problems = find_regressions(report, json.load(f), args.tolerance)
+        if problems:
+            print("\nРегрессии относительно", args.baseline)
+            for problem in problems:
+                print(" -", problem)
+            sys.exit(1)
+        print("\nРегрессий нет.")
@@ -0,0 +1,38 @@
+# bench/stats.py — перцентили и сводка по обработчикам для нагрузочных прогонов
+import threading
+from collections import defaultdict
+from typing import Dict, List
+
+
+def percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(int(len(values) * q), len(values) - 1)]
+
+
+class HandlerStats:
+    """Время и число запросов к БД по каждому обработчику; пишется из разных потоков"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._times: Dict[str, List[float]] = defaultdict(list)
+        self._queries: Dict[str, int] = defaultdict(int)
+
+    def add(self, name: str, seconds: float, queries: int) -> None:
+        with self._lock:
+            self._times[name].append(seconds)
+            self._queries[name] += queries
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        with self._lock:
+            return {
+                name: {
+                    "calls": len(times),
+                    "p50_ms": percentile(times, 0.50) * 1000,
+                    "p95_ms": percentile(times, 0.95) * 1000,
+                    "p99_ms": percentile(times, 0.99) * 1000,
+                    "queries_per_call": self._queries[name] / len(times),
+                }
+                for name, times in sorted(self._times.items())
+            }
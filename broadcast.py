@@ -0,0 +1,198 @@
+# broadcast.py — рассылка сообщения админа всем ученикам
+#
+# Получатели — различные user_id из user_sessions. Они читаются потоковым
+# курсором (stream_results + yield_per) пачками по BROADCAST_CHUNK в порядке
+# user_id, а не загружаются в память целиком. После каждой пачки в
+# broadcasts сохраняются последний обработанный user_id и счётчики: после
+# перезапуска бота рассылка продолжается с этого места (повторно может
+# прийти только недоотправленная пачка).
+#
+# Скорость — BROADCAST_RATE сообщений в секунду, чуть ниже общего лимита
+# Telegram, чтобы ответы ученикам не ждали в очереди за рассылкой, и не
+# больше BROADCAST_WINDOW неподтверждённых отправок одновременно. Кто
+# ответил 403 (заблокировал бота), записывается в blocked_users и
+# пропускается, пока снова не начнёт решать задания.
+import logging
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, wait
+from datetime import datetime
+from typing import Callable, Dict, List, Optional
+
+from sqlalchemy import text
+
+from db import SessionLocal, engine, upsert
+from models import BlockedUser, Broadcast
+
+logger = logging.getLogger(__name__)
+
+BROADCAST_CHUNK = int(os.getenv("BROADCAST_CHUNK", "100"))
+BROADCAST_RATE = float(os.getenv("BROADCAST_RATE", "25"))
+BROADCAST_WINDOW = int(os.getenv("BROADCAST_WINDOW", "20"))
+BROADCAST_PROGRESS_INTERVAL = float(os.getenv("BROADCAST_PROGRESS_INTERVAL", "5"))
+
+# Заблокировавший бота снова получает рассылки, если решал задания после блокировки
+RECIPIENTS = text(
+    "SELECT s.user_id FROM user_sessions s"
+    " LEFT JOIN blocked_users b ON b.user_id = s.user_id"
+    " WHERE s.user_id > :after"
+    " GROUP BY s.user_id"
+    " HAVING MAX(b.blocked_at) IS NULL OR MAX(s.submitted_at) > MAX(b.blocked_at)"
+    " ORDER BY s.user_id"
+)
+
+# send(user_id, text) -> Future с результатом отправки; report(text) — прогресс для админа
+Send = Callable[[int, str], Future]
+Report = Callable[[str], None]
+
+
+def recipients_count() -> int:
+    with engine.connect() as conn:
+        return conn.execute(text(f"SELECT COUNT(*) FROM ({RECIPIENTS.text}) r"), {"after": 0}).scalar()
+
+
+def create(message_text: str, admin_id: int) -> int:
+    db = SessionLocal()
+    try:
+        row = Broadcast(text=message_text, created_by=admin_id)
+        db.add(row)
+        db.commit()
+        return row.id
+    finally:
+        db.close()
+
+
+def unfinished() -> List[Broadcast]:
+    """Рассылки, прерванные остановкой бота"""
+    db = SessionLocal()
+    try:
+        return db.query(Broadcast).filter(Broadcast.status == "running").order_by(Broadcast.id).all()
+    finally:
+        db.close()
+
+
+def progress_text(row: Broadcast, done: bool = False) -> str:
+    title = f"✅ Рассылка #{row.id} завершена" if done else f"📣 Рассылка #{row.id} идёт"
+    return (
+        f"{title}\n\n"
+        f"Доставлено: {row.delivered}\n"
+        f"Заблокировали бота: {row.blocked}\n"
+        f"Ошибок: {row.failed}"
+    )
+
+
+class _Pacer:
+    """Не чаще rate вызовов в секунду"""
+
+    def __init__(self, rate: float):
+        self.interval = 1 / rate
+        self.next_at = time.monotonic()
+
+    def wait(self) -> None:
+        now = time.monotonic()
+        if self.next_at > now:
+            time.sleep(self.next_at - now)
+        self.next_at = max(self.next_at, now) + self.interval
+
+
+def _send_chunk(user_ids: List[int], message_text: str, send: Send, pacer: _Pacer) -> Dict[int, Optional[int]]:
+    """Отправить пачку; для каждого получателя None — доставлено, иначе код ошибки (0 — без кода)"""
+    outcomes: Dict[int, Optional[int]] = {}
+    in_flight: Dict[Future, int] = {}
+
+    def collect(futures) -> None:
+        for future in futures:
+            user_id = in_flight.pop(future)
+            error = future.exception()
+            outcomes[user_id] = None if error is None else (getattr(error, "error_code", None) or 0)
+
+    for user_id in user_ids:
+        if len(in_flight) >= BROADCAST_WINDOW:
+            done, _ = wait(list(in_flight), return_when=FIRST_COMPLETED)
+            collect(done)
+        pacer.wait()
+        in_flight[send(user_id, message_text)] = user_id
+    collect(wait(list(in_flight)).done)
+    return outcomes
+
+
+def _checkpoint(broadcast_id: int, last_user_id: int, outcomes: Dict[int, Optional[int]]) -> Broadcast:
+    blocked = [user_id for user_id, code in outcomes.items() if code == 403]
+    db = SessionLocal()
+    try:
+        now = datetime.utcnow()
+        upsert(db, BlockedUser, [{"user_id": user_id, "blocked_at": now} for user_id in blocked],
+               ["user_id"], ["blocked_at"])
+        row = db.get(Broadcast, broadcast_id)
+        row.last_user_id = last_user_id
+        row.delivered += sum(1 for code in outcomes.values() if code is None)
+        row.blocked += len(blocked)
+        row.failed += sum(1 for code in outcomes.values() if code not in (None, 403))
+        db.commit()
+        db.refresh(row)
+        db.expunge(row)
+        return row
+    finally:
+        db.close()
+
+
+def _finish(broadcast_id: int) -> Broadcast:
+    db = SessionLocal()
+    try:
+        row = db.get(Broadcast, broadcast_id)
+        row.status = "done"
+        row.finished_at = datetime.utcnow()
+        db.commit()
+        db.refresh(row)
+        db.expunge(row)
+        return row
+    finally:
+        db.close()
+
+
+def run(broadcast_id: int, send: Send, report: Report) -> None:
+    """Разослать с места последней контрольной точки до конца"""
+    db = SessionLocal()
+    try:
+        row = db.get(Broadcast, broadcast_id)
+        db.expunge(row)
+    finally:
+        db.close()
+    if row.status != "running":
+        return
+
+    logger.info(f"Рассылка #{broadcast_id}: продолжаем после user_id {row.last_user_id}")
+    pacer = _Pacer(BROADCAST_RATE)
+    reported_at = time.monotonic()
+    try:
+        with engine.connect() as conn:
+            result = conn.execution_options(stream_results=True, yield_per=BROADCAST_CHUNK).execute(
+                RECIPIENTS, {"after": row.last_user_id}
+            )
+            for chunk in result.partitions(BROADCAST_CHUNK):
+                user_ids = [user_id for (user_id,) in chunk]
+                outcomes = _send_chunk(user_ids, row.text, send, pacer)
+                row = _checkpoint(broadcast_id, user_ids[-1], outcomes)
+                if time.monotonic() - reported_at >= BROADCAST_PROGRESS_INTERVAL:
+                    reported_at = time.monotonic()
+                    report(progress_text(row))
+        row = _finish(broadcast_id)
+    except Exception as e:
+        # контрольная точка сохранена — рассылка продолжится при следующем запуске
+        logger.error(f"Рассылка #{broadcast_id} прервана: {e}")
+        report(f"❌ Рассылка #{broadcast_id} прервана: {str(e)[:200]}\nОна продолжится после перезапуска бота.")
+        return
+
+    logger.info(f"Рассылка #{broadcast_id} завершена: доставлено {row.delivered}, "
+                f"заблокировали {row.blocked}, ошибок {row.failed}")
+    report(progress_text(row, done=True))
+
+
+def start(broadcast_id: int, send: Send, report: Report) -> threading.Thread:
+    """Запустить рассылку в фоновом потоке"""
+    thread = threading.Thread(
+        target=run, args=(broadcast_id, send, report), name=f"broadcast-{broadcast_id}", daemon=True
+    )
+    thread.start()
+    return thread
@@ -0,0 +1,153 @@
+# catalog.py — каталог заданий в памяти процесса
+#
+# Каталог меняется только когда админ сохраняет задание, поэтому студенческая
+# навигация (список заданий, «Задание N», «Следующее задание») читает из
+# снимка в памяти и не ходит в БД. После сохранения вызывается invalidate(),
+# и снимок перечитывается одним запросом при следующем обращении.
+#
+# Асинхронный бот так не может: запрос из обработчика остановил бы цикл
+# событий. Он загружает каталог при старте и после каждого изменения
+# (мастер, /import) зовёт reload() в рабочем потоке: новый снимок строится
+# целиком, а обращения до замены видят прежний.
+import itertools
+import logging
+from bisect import bisect_right
+from dataclasses import dataclass
+from threading import Lock
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy.orm import joinedload
+
+from db import SessionLocal
+from models import Task
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class CatalogTask:
+    """Неизменяемая копия задания — не зависит от сессии SQLAlchemy"""
+    id: int
+    level_id: int
+    section_id: int
+    task_number: int
+    photo_file_id: str
+    audio_file_id: Optional[str]
+    comment_text: str
+    correct_answer: Any
+    level_name: str
+    section_name: str
+
+
+_versions = itertools.count(1)
+
+
+class _Snapshot:
+    def __init__(self, tasks: List[CatalogTask]):
+        self.version = next(_versions)
+        self.by_id: Dict[int, CatalogTask] = {}
+        self.by_section: Dict[Tuple[int, int], List[CatalogTask]] = {}
+        self.by_number: Dict[Tuple[int, int, int], CatalogTask] = {}
+        self.numbers: Dict[Tuple[int, int], List[int]] = {}
+
+        # tasks уже отсортированы по (task_number, id)
+        for t in tasks:
+            self.by_id[t.id] = t
+            key = (t.level_id, t.section_id)
+            # при дублях номера побеждает первое добавленное задание
+            if (t.level_id, t.section_id, t.task_number) in self.by_number:
+                continue
+            self.by_number[(t.level_id, t.section_id, t.task_number)] = t
+            self.by_section.setdefault(key, []).append(t)
+            self.numbers.setdefault(key, []).append(t.task_number)
+
+
+_snapshot: Optional[_Snapshot] = None
+_lock = Lock()
+
+
+def _load() -> _Snapshot:
+    db = SessionLocal()
+    try:
+        rows = db.query(Task).options(
+            joinedload(Task.level),
+            joinedload(Task.section)
+        ).order_by(Task.task_number, Task.id).all()
+
+        tasks = [
+            CatalogTask(
+                id=t.id,
+                level_id=t.level_id,
+                section_id=t.section_id,
+                task_number=t.task_number,
+                photo_file_id=t.photo_file_id,
+                audio_file_id=t.audio_file_id,
+                comment_text=t.comment_text,
+                correct_answer=t.correct_answer,
+                level_name=t.level.name,
+                section_name=t.section.name,
+            )
+            for t in rows
+        ]
+    finally:
+        db.close()
+
+    logger.info(f"Каталог заданий загружен: {len(tasks)} заданий.")
+    return _Snapshot(tasks)
+
+
+def _get() -> _Snapshot:
+    global _snapshot
+    snap = _snapshot
+    if snap is not None:
+        return snap
+
+    with _lock:
+        if _snapshot is None:
+            _snapshot = _load()
+        return _snapshot
+
+
+def reload() -> None:
+    """Перечитать каталог сразу (а не при следующем обращении)"""
+    global _snapshot
+    # читатели блокировку не берут, пока снимок есть, — до замены им отдаётся прежний
+    with _lock:
+        _snapshot = _load()
+
+
+def invalidate() -> None:
+    """Сбросить снимок — вызывается после изменения заданий"""
+    global _snapshot
+    # под блокировкой, чтобы не перетереть None снимком, который грузится прямо сейчас
+    with _lock:
+        _snapshot = None
+
+
+def version() -> int:
+    """Номер снимка — меняется при каждой перезагрузке каталога"""
+    return _get().version
+
+
+def get_tasks(level_id: int, section_id: int) -> List[CatalogTask]:
+    """Задания раздела, упорядоченные по номеру"""
+    return list(_get().by_section.get((level_id, section_id), []))
+
+
+def get_task(level_id: int, section_id: int, task_number: int) -> Optional[CatalogTask]:
+    return _get().by_number.get((level_id, section_id, task_number))
+
+
+def get_task_by_id(task_id: int) -> Optional[CatalogTask]:
+    return _get().by_id.get(task_id)
+
+
+def get_next_task(task: CatalogTask) -> Optional[CatalogTask]:
+    """Следующее по номеру задание в том же уровне и разделе"""
+    snap = _get()
+    key = (task.level_id, task.section_id)
+    numbers = snap.numbers.get(key, [])
+    i = bisect_right(numbers, task.task_number)
+    if i >= len(numbers):
+        return None
+    return snap.by_section[key][i]
@@ -1,14 +1,61 @@
-from sqlalchemy import create_engine
+from sqlalchemy.dialects import postgresql, sqlite
 from sqlalchemy.orm import sessionmaker
 from models import Base
+import metrics
 import os
+import storage
 
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///hsk.db")
-engine = create_engine(DATABASE_URL, echo=False)
+# настройки движка и пула зависят от профиля (DB_PROFILE, см. storage.py)
+engine = storage.make_engine(DATABASE_URL)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+metrics.instrument_engine(engine)
 
 def init_db():
+    from migrations import run_migrations
+
+    storage.check(engine)
     Base.metadata.create_all(bind=engine)
+    run_migrations(engine)
+
+def _insert(db, model, caller):
+    """INSERT с поддержкой ON CONFLICT для диалекта сессии"""
+    dialect = db.get_bind().dialect.name
+    if dialect == "postgresql":
+        return postgresql.insert(model)
+    if dialect == "sqlite":
+        return sqlite.insert(model)
+    # storage.check() не пускает такую БД при запуске — сюда попадаем только в обход init_db()
+    raise RuntimeError(f"{caller} не поддерживает диалект {dialect}")
+
+def insert_ignore(db, model, rows, index_elements):
+    """Массовая вставка строк, уже существующие (по index_elements) пропускаются"""
+    if not rows:
+        return
+    stmt = _insert(db, model, "insert_ignore")
+    db.execute(stmt.values(rows).on_conflict_do_nothing(index_elements=index_elements))
+
+def upsert(db, model, rows, index_elements, update_columns):
+    """Массовая вставка; у существующих (по index_elements) строк обновляются update_columns"""
+    if not rows:
+        return
+    stmt = _insert(db, model, "upsert").values(rows)
+    db.execute(stmt.on_conflict_do_update(
+        index_elements=index_elements,
+        set_={column: stmt.excluded[column] for column in update_columns}
+    ))
+
+def upsert_add(db, model, rows, index_elements, add_columns, update_columns=()):
+    """
+    Массовая вставка счётчиков: у существующих строк к add_columns
+    прибавляются новые значения, update_columns заменяются
+    """
+    if not rows:
+        return
+    stmt = _insert(db, model, "upsert_add").values(rows)
+    set_ = {column: getattr(model, column) + stmt.excluded[column] for column in add_columns}
+    set_.update({column: stmt.excluded[column] for column in update_columns})
+    db.execute(stmt.on_conflict_do_update(index_elements=index_elements, set_=set_))
 
 def get_db():
     db = SessionLocal()
@@ -0,0 +1,29 @@
+# db_async.py — асинхронный движок SQLAlchemy для async_main.py
+import os
+
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+import metrics
+import storage
+from db import DATABASE_URL
+
+# Асинхронные драйверы для тех же баз, что и в db.py
+_ASYNC_DRIVERS = {
+    "sqlite://": "sqlite+aiosqlite://",
+    "postgresql://": "postgresql+asyncpg://",
+}
+
+
+def _async_url(url: str) -> str:
+    for prefix, async_prefix in _ASYNC_DRIVERS.items():
+        if url.startswith(prefix):
+            return async_prefix + url[len(prefix):]
+    return url
+
+
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL", _async_url(DATABASE_URL))
+_PROFILE = storage.profile_for(ASYNC_DATABASE_URL)
+async_engine = create_async_engine(ASYNC_DATABASE_URL, echo=False, **storage.engine_options(ASYNC_DATABASE_URL, _PROFILE))
+storage.configure(async_engine.sync_engine, _PROFILE)
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+metrics.instrument_engine(async_engine.sync_engine)
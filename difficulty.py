@@ -0,0 +1,196 @@
+# difficulty.py — самые сложные задания и частые неверные ответы для админа
+#
+# Отчёт читает только заранее посчитанные данные: task_stats (progress.py)
+# и task_wrong_answers — по каждому заданию не больше DIFFICULTY_TOP_K
+# частых неверных ответов. Они поддерживаются алгоритмом Space-Saving:
+# когда все K счётчиков заняты, новый ответ вытесняет самый редкий и
+# наследует его счёт, поэтому таблица не растёт, а по-настоящему частые
+# ответы в ней гарантированно остаются. apply() вызывает answer_recorder в
+# той же транзакции, что и запись ответов; историю переносит миграция 4.
+#
+# Ответы нормализуются так же, как их сравнивает проверка (grading.py):
+# «Ｂ», «В» и «B» в задании с вариантами — один счётчик, а не три.
+#
+# Частый неверный ответ по заданию почти всегда значит ошибку в ключе,
+# введённом в мастере добавления задания.
+import logging
+import os
+from collections import Counter, defaultdict
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from sqlalchemy import delete, func, select, tuple_
+from sqlalchemy.engine import Connection
+from sqlalchemy.orm import Session
+
+import grading
+import reference
+from db import SessionLocal, upsert
+from models import Task, TaskStats, TaskWrongAnswer, UserSession
+
+logger = logging.getLogger(__name__)
+
+DIFFICULTY_TOP_K = int(os.getenv("DIFFICULTY_TOP_K", "10"))
+# Задания с меньшим числом проверенных ответов в отчёт не попадают
+DIFFICULTY_MIN_GRADED = int(os.getenv("DIFFICULTY_MIN_GRADED", "5"))
+DIFFICULTY_REPORT_TASKS = int(os.getenv("DIFFICULTY_REPORT_TASKS", "10"))
+
+# Сколько частых ответов показывать по каждому заданию
+_SHOWN_ANSWERS = 3
+_ANSWER_LENGTH = 64
+
+
+def normalize(answer: Optional[str], spec: Any = None) -> str:
+    """Ответ так, как его сравнивает проверка задания со спецификацией spec"""
+    answer = answer or ""
+    kind = spec.get("kind") if isinstance(spec, dict) else None
+    if kind == "choices":
+        text = "".join(grading.fold_options(answer).split())
+    elif kind == "set":
+        # «D, E», «E D» и «ED» — один и тот же набор
+        options = grading.option_set(answer)
+        text = ",".join(sorted(options)) if options else grading.fold_options(answer)
+    elif kind == "chinese":
+        text = grading.fold_chinese(answer)
+    else:
+        # exact различает регистр: «YES» при ключе «yes» — отдельная ошибка
+        text = grading.fold_width(answer)
+    return text[:_ANSWER_LENGTH]
+
+
+class SpaceSaving:
+    """Top-K частых значений потока в k счётчиках (Metwally, Agrawal, El Abbadi, 2005)"""
+
+    def __init__(self, k: int, counters: Optional[Dict[str, Tuple[int, int]]] = None):
+        self.k = k
+        # значение -> (счёт, погрешность); счёт завышен не больше чем на погрешность
+        self.counters: Dict[str, Tuple[int, int]] = dict(counters or {})
+
+    def add(self, item: str, count: int = 1) -> None:
+        if item in self.counters:
+            current, error = self.counters[item]
+            self.counters[item] = (current + count, error)
+        elif len(self.counters) < self.k:
+            self.counters[item] = (count, 0)
+        else:
+            victim = min(self.counters, key=lambda key: self.counters[key][0])
+            floor, _ = self.counters.pop(victim)
+            self.counters[item] = (floor + count, floor)
+
+    def top(self, n: int) -> List[Tuple[str, int, int]]:
+        ranked = sorted(self.counters.items(), key=lambda item: (-item[1][0], item[0]))
+        return [(item, count, error) for item, (count, error) in ranked[:n]]
+
+
+# --- Обновление ---
+
+def apply(db: Session, rows: Sequence[Dict[str, Any]]) -> None:
+    """Учесть неверные ответы из пачки новых строк user_sessions; commit — на вызывающем"""
+    wrong: Dict[int, List[Optional[str]]] = defaultdict(list)
+    for row in rows:
+        if row["is_correct"] is False:
+            wrong[row["task_id"]].append(row["user_answer"])
+    if not wrong:
+        return
+
+    # LEFT JOIN от tasks: ответы на удалённые задания пропускаются
+    sketches: Dict[int, SpaceSaving] = {}
+    specs: Dict[int, Any] = {}
+    for task_id, spec, answer, count, error in db.execute(
+        select(Task.id, Task.correct_answer, TaskWrongAnswer.answer, TaskWrongAnswer.count, TaskWrongAnswer.error)
+        .outerjoin(TaskWrongAnswer, TaskWrongAnswer.task_id == Task.id)
+        .where(Task.id.in_(wrong))
+    ):
+        sketch = sketches.setdefault(task_id, SpaceSaving(DIFFICULTY_TOP_K))
+        specs[task_id] = spec
+        if answer is not None:
+            sketch.counters[answer] = (count, error)
+
+    evicted: List[Tuple[int, str]] = []
+    changed: List[Dict[str, Any]] = []
+    for task_id, sketch in sketches.items():
+        before = dict(sketch.counters)
+        for answer in wrong[task_id]:
+            sketch.add(normalize(answer, specs[task_id]))
+        evicted += [(task_id, answer) for answer in before if answer not in sketch.counters]
+        changed += [
+            {"task_id": task_id, "answer": answer, "count": count, "error": error}
+            for answer, (count, error) in sketch.counters.items()
+            if before.get(answer) != (count, error)
+        ]
+
+    if evicted:
+        db.execute(delete(TaskWrongAnswer).where(
+            tuple_(TaskWrongAnswer.task_id, TaskWrongAnswer.answer).in_(evicted)
+        ))
+    upsert(db, TaskWrongAnswer, changed, ["task_id", "answer"], ["count", "error"])
+
+
+def rebuild(conn: Connection) -> int:
+    """Точные top-K неверных ответов по всей истории; возвращает число заданий"""
+    conn.execute(delete(TaskWrongAnswer))
+
+    specs = dict(conn.execute(select(Task.id, Task.correct_answer)).all())
+    counts: Dict[int, Counter] = defaultdict(Counter)
+    for task_id, answer, count in conn.execute(
+        select(UserSession.task_id, UserSession.user_answer, func.count())
+        .join(Task, Task.id == UserSession.task_id)
+        .where(UserSession.is_correct.is_(False))
+        .group_by(UserSession.task_id, UserSession.user_answer)
+    ):
+        # разные написания одного ответа сливаются после нормализации
+        counts[task_id][normalize(answer, specs[task_id])] += count
+
+    rows = [
+        {"task_id": task_id, "answer": answer, "count": count, "error": 0}
+        for task_id, answers in counts.items()
+        for answer, count in answers.most_common(DIFFICULTY_TOP_K)
+    ]
+    for start in range(0, len(rows), 1000):
+        conn.execute(TaskWrongAnswer.__table__.insert(), rows[start:start + 1000])
+    return len(counts)
+
+
+# --- Отчёт ---
+
+def report_text(db: Session) -> str:
+    error_rate = (TaskStats.graded - TaskStats.correct) * 1.0 / TaskStats.graded
+    hardest = db.execute(
+        select(Task, TaskStats)
+        .join(TaskStats, TaskStats.task_id == Task.id)
+        .where(TaskStats.graded >= DIFFICULTY_MIN_GRADED)
+        .order_by(error_rate.desc(), TaskStats.graded.desc())
+        .limit(DIFFICULTY_REPORT_TASKS)
+    ).all()
+    if not hardest:
+        return f"📉 Пока нет заданий хотя бы с {DIFFICULTY_MIN_GRADED} проверенными ответами."
+
+    answers: Dict[int, SpaceSaving] = defaultdict(lambda: SpaceSaving(DIFFICULTY_TOP_K))
+    for row in db.execute(
+        select(TaskWrongAnswer).where(TaskWrongAnswer.task_id.in_([task.id for task, _ in hardest]))
+    ).scalars():
+        answers[row.task_id].counters[row.answer] = (row.count, row.error)
+
+    lines = [f"📉 Самые сложные задания (от {DIFFICULTY_MIN_GRADED} проверенных ответов)"]
+    for place, (task, stats) in enumerate(hardest, start=1):
+        wrong = stats.graded - stats.correct
+        lines += [
+            "",
+            f"{place}. {reference.level_name(task.level_id)} · {reference.section_name(task.section_id)} · "
+            f"№{task.task_number} — ошибок {round(wrong * 100 / stats.graded)}% ({wrong} из {stats.graded})",
+        ]
+        if task.correct_answer:
+            lines.append(f"   Ключ: {grading.answer_text(task.correct_answer)}")
+        top = answers[task.id].top(_SHOWN_ANSWERS)
+        if top:
+            # ~ — счёт приблизительный: ответ вытеснил более редкий и унаследовал его счёт
+            shown = ", ".join(f"{answer or '(пусто)'} ×{'~' if error else ''}{count}" for answer, count, error in top)
+            lines.append(f"   Частые ответы: {shown}")
+    return "\n".join(lines)
+
+
+def get_report_text() -> str:
+    db = SessionLocal()
+    try:
+        return report_text(db)
+    finally:
+        db.close()
@@ -0,0 +1,173 @@
+# feedback_cache.py — кэш разборов письменных заданий от LLM
+#
+# Студенты часто отправляют тот же (или почти тот же) текст повторно.
+# Ключ кэша — хэш от уровня, текста задания и нормализованного ответа, так что
+# различия в пробелах, полноширинной пунктуации и «мусоре» в конце текста не
+# приводят к новому запросу к GigaChat.
+#
+# Два уровня: LRU в памяти процесса и таблица llm_feedback_cache в БД с TTL
+# и ограничением на число строк.
+import hashlib
+import logging
+import os
+import re
+import threading
+import unicodedata
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Dict, Optional, Tuple
+
+from db import SessionLocal
+from models import FeedbackCacheEntry
+
+logger = logging.getLogger(__name__)
+
+FEEDBACK_CACHE_MEMORY_SIZE = int(os.getenv("FEEDBACK_CACHE_MEMORY_SIZE", "256"))
+FEEDBACK_CACHE_MAX_ROWS = int(os.getenv("FEEDBACK_CACHE_MAX_ROWS", "5000"))
+FEEDBACK_CACHE_TTL = timedelta(days=int(os.getenv("FEEDBACK_CACHE_TTL_DAYS", "30")))
+# Очистка таблицы запускается раз в столько записей
+_CLEANUP_EVERY = 50
+
+# Китайская пунктуация, которую NFKC не приводит к ASCII
+_PUNCTUATION = str.maketrans({
+    "。": ".", "、": ",", "「": '"', "」": '"', "『": '"', "』": '"',
+    "《": '"', "》": '"', "〈": '"', "〉": '"', "【": "[", "】": "]",
+    "“": '"', "”": '"', "‘": "'", "’": "'", "…": "...", "—": "-",
+})
+_CJK = r"\u2e80-\u9fff\uf900-\ufaff"
+_SPACES_AROUND_CJK = re.compile(rf"\s*([{_CJK}])\s*")
+_SPACES = re.compile(r"\s+")
+_TRAILING_NOISE = re.compile(r"[\s.,!?;:\-~\"'\[\]()]+$")
+
+
+def normalize_text(text: str) -> str:
+    """Привести ответ к каноническому виду для ключа кэша"""
+    # NFKC переводит полноширинные символы (，！？ＡＢ１２) в обычные
+    text = unicodedata.normalize("NFKC", text).translate(_PUNCTUATION)
+    text = _SPACES.sub(" ", text).strip()
+    # пробелы между иероглифами ничего не значат
+    text = _SPACES_AROUND_CJK.sub(r"\1", text)
+    text = _TRAILING_NOISE.sub("", text)
+    return text.lower()
+
+
+def make_key(level_name: str, comment: str, user_text: str) -> str:
+    raw = "\x1f".join((level_name, comment.strip(), normalize_text(user_text)))
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class FeedbackCache:
+    def __init__(self, memory_size: int, max_rows: int, ttl: timedelta):
+        self.memory_size = memory_size
+        self.max_rows = max_rows
+        self.ttl = ttl
+
+        self._memory: "OrderedDict[str, Tuple[str, datetime]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._puts = 0
+        self.hits_memory = 0
+        self.hits_db = 0
+        self.misses = 0
+
+    def get(self, key: str) -> Optional[str]:
+        now = datetime.utcnow()
+        with self._lock:
+            item = self._memory.get(key)
+            if item is not None:
+                feedback, created_at = item
+                if now - created_at < self.ttl:
+                    self._memory.move_to_end(key)
+                    self.hits_memory += 1
+                    return feedback
+                del self._memory[key]
+
+        feedback = self._get_from_db(key, now)
+        with self._lock:
+            if feedback is None:
+                self.misses += 1
+            else:
+                self.hits_db += 1
+        return feedback
+
+    def _get_from_db(self, key: str, now: datetime) -> Optional[str]:
+        db = SessionLocal()
+        try:
+            entry = db.get(FeedbackCacheEntry, key)
+            if entry is None or now - entry.created_at >= self.ttl:
+                return None
+            entry.last_used_at = now
+            db.commit()
+            self._remember(key, entry.feedback, entry.created_at)
+            return entry.feedback
+        except Exception as e:
+            logger.error(f"Ошибка чтения кэша разборов: {e}")
+            return None
+        finally:
+            db.close()
+
+    def put(self, key: str, feedback: str) -> None:
+        now = datetime.utcnow()
+        self._remember(key, feedback, now)
+
+        db = SessionLocal()
+        try:
+            db.merge(FeedbackCacheEntry(key=key, feedback=feedback, created_at=now, last_used_at=now))
+            db.commit()
+        except Exception as e:
+            logger.error(f"Ошибка записи кэша разборов: {e}")
+            return
+        finally:
+            db.close()
+
+        with self._lock:
+            self._puts += 1
+            cleanup = self._puts % _CLEANUP_EVERY == 0
+        if cleanup:
+            self.cleanup()
+
+    def _remember(self, key: str, feedback: str, created_at: datetime) -> None:
+        with self._lock:
+            self._memory[key] = (feedback, created_at)
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.memory_size:
+                self._memory.popitem(last=False)
+
+    def cleanup(self) -> None:
+        """Удалить просроченные записи и самые давно использованные сверх лимита"""
+        db = SessionLocal()
+        try:
+            expired = db.query(FeedbackCacheEntry).filter(
+                FeedbackCacheEntry.created_at < datetime.utcnow() - self.ttl
+            ).delete(synchronize_session=False)
+
+            # last_used_at самой «свежей» из вытесняемых записей
+            boundary = db.query(FeedbackCacheEntry.last_used_at).order_by(
+                FeedbackCacheEntry.last_used_at.desc()
+            ).offset(self.max_rows).limit(1).scalar()
+            evicted = 0
+            if boundary is not None:
+                evicted = db.query(FeedbackCacheEntry).filter(
+                    FeedbackCacheEntry.last_used_at <= boundary
+                ).delete(synchronize_session=False)
+            db.commit()
+            if expired or evicted:
+                logger.info(f"Кэш разборов: удалено просроченных {expired}, вытеснено {evicted}.")
+        except Exception as e:
+            logger.error(f"Ошибка очистки кэша разборов: {e}")
+        finally:
+            db.close()
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            hits = self.hits_memory + self.hits_db
+            total = hits + self.misses
+            return {
+                "hits_memory": self.hits_memory,
+                "hits_db": self.hits_db,
+                "misses": self.misses,
+                "hit_rate": hits / total if total else 0.0,
+                "memory_entries": len(self._memory),
+            }
+
+
+feedback_cache = FeedbackCache(FEEDBACK_CACHE_MEMORY_SIZE, FEEDBACK_CACHE_MAX_ROWS, FEEDBACK_CACHE_TTL)
@@ -0,0 +1,167 @@
+# grading.py — проверка ответов на задания с единственным правильным ответом
+#
+# Ключ задания разбирается один раз — при сохранении (мастер, /import,
+# миграция 5) — в спецификацию проверки, которая хранится в
+# tasks.correct_answer как JSON:
+#   {"kind": "choices", "key": "ABBBA", "options": "AB", "answer": "ABBBA"}
+# kind — имя проверки в GRADERS, key — уже нормализованный ключ, answer —
+# ключ в том виде, как его ввёл админ (для фидбека). При ответе остаётся
+# нормализовать ответ ученика и сравнить.
+#
+# Виды проверки (выбираются по ключу, см. compile_answer):
+#   choices — строка вариантов по порядку, «ABBBA»: ответ по каждому вопросу;
+#   set     — набор вариантов в любом порядке, «A, C»;
+#   chinese — текст с иероглифами: без пробелов и знаков препинания;
+#   exact   — всё остальное («3»): совпадение после приведения ширины символов.
+# Везде полноширинные символы приводятся к обычным (NFKC), а в вариантах
+# кириллические А, В, С, Е считаются латинскими — так пишут в подсказках.
+# В ключе кириллица считается вариантами, только если это одна буква («В»)
+# или буквы через разделители («А, С»): «все» и «вес» — слова, а не «BCE».
+import re
+import unicodedata
+from typing import Any, Callable, Dict, Optional, Tuple
+
+Spec = Dict[str, Any]
+Grader = Callable[[Spec, str], Tuple[bool, str]]
+
+GRADERS: Dict[str, Grader] = {}
+
+# Для предпросмотра в мастере добавления задания
+KIND_TITLES = {
+    "choices": "варианты по порядку",
+    "set": "набор вариантов в любом порядке",
+    "chinese": "текст без учёта пробелов и знаков препинания",
+    "exact": "точное совпадение",
+}
+
+_OPTION_LETTERS = "ABCDEF"
+_CYRILLIC_OPTIONS = str.maketrans("АВСЕавсе", "ABCEABCE")
+_OPTIONS_RE = re.compile(f"[{_OPTION_LETTERS}]+")
+_OPTION_SEPARATORS_RE = re.compile(r"[\s,;/、]+")
+_CHINESE_RE = re.compile("[\u3400-\u9fff\uf900-\ufaff]")
+
+
+def register(kind: str) -> Callable[[Grader], Grader]:
+    def decorator(grader: Grader) -> Grader:
+        GRADERS[kind] = grader
+        return grader
+    return decorator
+
+
+# --- Нормализация ---
+
+def fold_width(text: str) -> str:
+    """Полноширинные цифры, буквы и знаки — к обычным; пробелы по краям и повторы убираются"""
+    return " ".join(unicodedata.normalize("NFKC", text).split())
+
+
+def fold_options(text: str) -> str:
+    return fold_width(text).translate(_CYRILLIC_OPTIONS).upper()
+
+
+def fold_chinese(text: str) -> str:
+    """Текст без пробелов и знаков препинания (китайских и латинских)"""
+    return "".join(
+        ch for ch in unicodedata.normalize("NFKC", text).casefold()
+        if not ch.isspace() and not unicodedata.category(ch).startswith("P")
+    )
+
+
+def option_set(text: str) -> Optional[frozenset]:
+    parts = [part for part in _OPTION_SEPARATORS_RE.split(fold_options(text)) if part]
+    # «AC» без разделителей — тоже набор из двух вариантов
+    if len(parts) == 1:
+        parts = list(parts[0])
+    if not parts or not all(len(part) == 1 and part in _OPTION_LETTERS for part in parts):
+        return None
+    return frozenset(parts)
+
+
+# --- Разбор ключа ---
+
+def compile_answer(section_name: Optional[str], answer: Any) -> Optional[Spec]:
+    """Спецификация проверки для ключа из мастера или импорта; None — без автопроверки"""
+    if isinstance(answer, dict):
+        return answer
+    if section_name == "Письмо" or answer is None or not str(answer).strip():
+        return None
+
+    answer = str(answer).strip()
+    options = fold_options(answer)
+    if _OPTIONS_RE.fullmatch(options) and (len(options) == 1 or _OPTIONS_RE.fullmatch(fold_width(answer).upper())):
+        # «Верно/неверно» — только A и B, иначе даём все варианты
+        return {
+            "kind": "choices",
+            "key": options,
+            "options": "AB" if set(options) <= set("AB") else _OPTION_LETTERS,
+            "answer": answer,
+        }
+
+    if _OPTION_SEPARATORS_RE.search(options):
+        options_given = option_set(answer)
+        if options_given and len(options_given) > 1:
+            return {"kind": "set", "key": sorted(options_given), "answer": answer}
+
+    if _CHINESE_RE.search(answer):
+        return {"kind": "chinese", "key": fold_chinese(answer), "answer": answer}
+
+    return {"kind": "exact", "key": fold_width(answer), "answer": answer}
+
+
+def answer_text(spec: Any) -> Optional[str]:
+    """Ключ в том виде, как его ввёл админ"""
+    if isinstance(spec, dict):
+        return spec.get("answer")
+    return spec
+
+
+# --- Проверки ---
+
+def _verdict(spec: Spec, is_correct: bool) -> Tuple[bool, str]:
+    return is_correct, "Правильно!" if is_correct else f"Неверно. Правильный ответ: {spec['answer']}"
+
+
+@register("choices")
+def _grade_choices(spec: Spec, user_answer: str) -> Tuple[bool, str]:
+    expected = spec["key"]
+    answer = "".join(fold_options(user_answer).split())
+    if len(expected) == 1:
+        return _verdict(spec, answer == expected)
+    if len(answer) != len(expected) or any(c not in spec["options"] for c in answer):
+        sample = (spec["options"] * len(expected))[:len(expected)]
+        return False, (
+            "Неверный формат ответа.\n"
+            f"Введите {len(expected)} букв ({'/'.join(spec['options'])}) слитно, например: {sample}"
+        )
+
+    if answer == expected:
+        return True, "Все ответы верны! Отлично!"
+    # Подсветим ошибки
+    result = [f"{i}. {'✅' if u == e else f'❌ ({e})'}" for i, (u, e) in enumerate(zip(answer, expected), 1)]
+    return False, "Проверьте ответы:\n" + "\n".join(result)
+
+
+@register("set")
+def _grade_set(spec: Spec, user_answer: str) -> Tuple[bool, str]:
+    return _verdict(spec, option_set(user_answer) == frozenset(spec["key"]))
+
+
+@register("chinese")
+def _grade_chinese(spec: Spec, user_answer: str) -> Tuple[bool, str]:
+    return _verdict(spec, fold_chinese(user_answer) == spec["key"])
+
+
+@register("exact")
+def _grade_exact(spec: Spec, user_answer: str) -> Tuple[bool, str]:
+    return _verdict(spec, fold_width(user_answer) == spec["key"])
+
+
+def grade_answer(task, user_answer: str) -> Tuple[Optional[bool], str]:
+    """Проверить ответ. Возвращает (верно ли, текст фидбека); None — ключа нет"""
+    spec = task.correct_answer
+    if not isinstance(spec, dict):
+        # задание сохранено до миграции 5
+        spec = compile_answer(task.section_name, spec)
+    if spec is None:
+        return None, "Ответ принят. Ключ к этому заданию ещё не добавлен."
+    return GRADERS[spec["kind"]](spec, user_answer)
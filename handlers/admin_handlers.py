@@ -1,11 +1,22 @@
 # handlers/admin_handlers.py
 from telebot import TeleBot, types
 import os
+import threading
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
 from db import SessionLocal
-from models import ExamLevel, Section, Task
+from models import Task
+import broadcast
+import catalog
+import difficulty
+import grading
+import metrics
+import reference
+import task_import
 import logging
-from state import set_user_state, get_user_state, is_admin_mode, clear_user_state
+from outbox import outbox
+from router import router_for
+from state import set_user_state, get_user_state, clear_user_state
 
 logger = logging.getLogger(__name__)
 
@@ -23,70 +34,146 @@ except Exception as e:
 def is_admin(user_id: int) -> bool:
     return user_id in ADMIN_IDS
 
+def admin_menu_markup() -> types.ReplyKeyboardMarkup:
+    markup = types.ReplyKeyboardMarkup(resize_keyboard=True, one_time_keyboard=True)
+    markup.add("➕ Добавить задание")
+    markup.add("📦 Импорт заданий")
+    markup.add("📣 Рассылка")
+    markup.add("📉 Сложные задания")
+    markup.add("↩️ Выход")
+    return markup
+
+def preview_text(data) -> str:
+    section = data["section_name"]
+    preview = (
+        f"🔍 *Предпросмотр задания*\n\n"
+        f"📌 Уровень: {data['level_name']}\n"
+        f"📚 Раздел: {section}\n"
+        f"🔢 Номер: {data['task_number']}\n"
+        f"💬 Комментарий: {data['comment']}\n"
+    )
+    if section != "Письмо":
+        spec = grading.compile_answer(section, data["correct_answer"])
+        preview += f"✅ Правильный ответ: `{data['correct_answer']}`\n"
+        preview += f"🧮 Проверка: {grading.KIND_TITLES[spec['kind']]}\n"
+    return preview
+
+def confirm_markup() -> types.ReplyKeyboardMarkup:
+    markup = types.ReplyKeyboardMarkup(resize_keyboard=True, one_time_keyboard=True)
+    markup.add("✅ Подтвердить", "❌ Отменить")
+    return markup
+
+def broadcast_preview_text(text: str, recipients: int) -> str:
+    return f"📣 Получателей: {recipients}\n\n{text}\n\nОтправить?"
+
+def task_from_data(data):
+    """Task из данных мастера добавления; None, если уровень или раздел не найдены"""
+    level_id = reference.level_id(data["level_name"])
+    section_id = reference.section_id(data["section_name"])
+    if not level_id or not section_id:
+        return None
+
+    return Task(
+        level_id=level_id,
+        section_id=section_id,
+        task_number=data["task_number"],
+        photo_file_id=data["photo_file_id"],
+        audio_file_id=data.get("audio_file_id"),
+        comment_text=data["comment"],
+        # ключ хранится уже разобранным — при ответе остаётся только сравнить
+        correct_answer=grading.compile_answer(data["section_name"], data.get("correct_answer"))
+    )
+
+def saved_text(data) -> str:
+    return (
+        f"✅ Задание добавлено!\n\n"
+        f"Уровень: {data['level_name']}\n"
+        f"Раздел: {data['section_name']}\n"
+        f"Номер: {data['task_number']}"
+    )
+
+def duplicate_text(data) -> str:
+    return (
+        f"⚠️ Задание №{data['task_number']} уже есть в разделе "
+        f"«{data['section_name']}» уровня {data['level_name']}.\n"
+        f"Начните заново через /admin и укажите другой номер."
+    )
+
 def register_admin_handlers(bot: TeleBot):
+    # ответы админу — через ту же очередь исходящих, что и ученикам и рассылкам:
+    # общий лимит Telegram один на бота, а порядок сообщений в чате сохраняется
+    outbox.bind(bot)
+    router = router_for(bot)
+    router.guard("admin", is_admin)
 
     # --- Вход в админку ---
-    @bot.message_handler(commands=['admin'])
+    @router.command("admin")
     def admin_start(message):
         if not is_admin(message.from_user.id):
-            bot.send_message(message.chat.id, "🚫 Доступ запрещён.")
+            outbox.send_message(message.chat.id, "🚫 Доступ запрещён.")
             return
 
         # Переключаем в админ-режим
         set_user_state(message.from_user.id, mode="admin", step="main_menu", data={})
 
-        markup = types.ReplyKeyboardMarkup(resize_keyboard=True, one_time_keyboard=True)
-        markup.add("➕ Добавить задание")
-        markup.add("↩️ Выход")
-        bot.send_message(
+        outbox.send_message(
             message.chat.id,
             "🔐 Админ-панель\nВыберите действие:",
-            reply_markup=markup
+            reply_markup=admin_menu_markup()
         )
 
+    # --- Метрики бота (только для админов) ---
+    @router.command("metrics")
+    def admin_metrics(message):
+        if not is_admin(message.from_user.id):
+            outbox.send_message(message.chat.id, "🚫 Доступ запрещён.")
+            return
+
+        outbox.send_message(message.chat.id, metrics.summary_text())
+
+    # --- Самые сложные задания и частые неверные ответы ---
+    @router.command("difficulty")
+    @router.text("📉 Сложные задания", mode="admin")
+    def admin_difficulty(message):
+        if not is_admin(message.from_user.id):
+            outbox.send_message(message.chat.id, "🚫 Доступ запрещён.")
+            return
+
+        try:
+            text = difficulty.get_report_text()
+        except Exception as e:
+            logger.error(f"Ошибка в admin_difficulty: {e}")
+            text = "❌ Не удалось построить отчёт."
+        outbox.send_message(message.chat.id, text)
+
     # --- Выход из админки ---
-    @bot.message_handler(func=lambda msg: (
-        is_admin(msg.from_user.id) and
-        is_admin_mode(msg.from_user.id) and
-        msg.text == "↩️ Выход"
-    ))
+    @router.text("↩️ Выход", mode="admin")
     def admin_exit(message):
         clear_user_state(message.from_user.id)
-        bot.send_message(
+        outbox.send_message(
             message.chat.id,
             "✅ Вы вышли из админ-панели.",
             reply_markup=types.ReplyKeyboardRemove()
         )
         # Опционально: вернуть в стартовое меню
-        from handlers.user_handlers import send_welcome
-        send_welcome(message)
+        router.call_command("start", message)
 
     # --- Начало добавления задания ---
-    @bot.message_handler(func=lambda msg: (
-        is_admin(msg.from_user.id) and
-        is_admin_mode(msg.from_user.id) and
-        msg.text == "➕ Добавить задание"
-    ))
+    @router.text("➕ Добавить задание", mode="admin")
     def start_add_task(message):
         set_user_state(message.from_user.id,
                        step="choose_level",
                        data={})
 
         markup = types.ReplyKeyboardMarkup(resize_keyboard=True, one_time_keyboard=True)
-        levels = [f"HSK {i}" for i in range(1, 6)]
-        markup.add(*levels)
-        bot.send_message(message.chat.id, "1️⃣ Выберите уровень:", reply_markup=markup)
+        markup.add(*reference.LEVEL_NAMES)
+        outbox.send_message(message.chat.id, "1️⃣ Выберите уровень:", reply_markup=markup)
 
     # --- Шаг 1: выбор уровня ---
-    @bot.message_handler(func=lambda msg: (
-        is_admin(msg.from_user.id) and
-        is_admin_mode(msg.from_user.id) and
-        get_user_state(msg.from_user.id).get("step") == "choose_level"
-    ))
+    @router.step("choose_level", mode="admin")
     def choose_level_admin(message):
-        valid_levels = [f"HSK {i}" for i in range(1, 6)]
-        if message.text not in valid_levels:
-            bot.send_message(message.chat.id, "❌ Неверный уровень. Выберите из списка.")
+        if message.text not in reference.LEVEL_NAMES:
+            outbox.send_message(message.chat.id, "❌ Неверный уровень. Выберите из списка.")
             return
 
         data = get_user_state(message.from_user.id).get("data", {})
@@ -94,19 +181,14 @@ def register_admin_handlers(bot: TeleBot):
         set_user_state(message.from_user.id, step="choose_section", data=data)
 
         markup = types.ReplyKeyboardMarkup(resize_keyboard=True, one_time_keyboard=True)
-        markup.add("Аудирование", "Чтение", "Письмо")
-        bot.send_message(message.chat.id, "2️⃣ Выберите раздел:", reply_markup=markup)
+        markup.add(*reference.SECTION_NAMES)
+        outbox.send_message(message.chat.id, "2️⃣ Выберите раздел:", reply_markup=markup)
 
     # --- Шаг 2: выбор раздела ---
-    @bot.message_handler(func=lambda msg: (
-        is_admin(msg.from_user.id) and
-        is_admin_mode(msg.from_user.id) and
-        get_user_state(msg.from_user.id).get("step") == "choose_section"
-    ))
+    @router.step("choose_section", mode="admin")
     def choose_section_admin(message):
-        valid_sections = ["Аудирование", "Чтение", "Письмо"]
-        if message.text not in valid_sections:
-            bot.send_message(message.chat.id, "❌ Неверный раздел. Выберите из списка.")
+        if message.text not in reference.SECTION_NAMES:
+            outbox.send_message(message.chat.id, "❌ Неверный раздел. Выберите из списка.")
             return
 
         state = get_user_state(message.from_user.id)
@@ -114,39 +196,31 @@ def register_admin_handlers(bot: TeleBot):
         data["section_name"] = message.text
         set_user_state(message.from_user.id, step="task_number", data=data)
 
-        bot.send_message(
+        outbox.send_message(
             message.chat.id,
             "3️⃣ Введите номер задания (целое число ≥ 1):",
             reply_markup=types.ReplyKeyboardRemove()
         )
 
     # --- Шаг 3: номер задания ---
-    @bot.message_handler(func=lambda msg: (
-        is_admin(msg.from_user.id) and
-        is_admin_mode(msg.from_user.id) and
-        get_user_state(msg.from_user.id).get("step") == "task_number"
-    ))
+    @router.step("task_number", mode="admin")
     def enter_task_number(message):
         try:
             num = int(message.text)
             if num < 1:
                 raise ValueError
         except (ValueError, TypeError):
-            bot.send_message(message.chat.id, "❌ Некорректный номер. Введите целое число ≥ 1.")
+            outbox.send_message(message.chat.id, "❌ Некорректный номер. Введите целое число ≥ 1.")
             return
 
         state = get_user_state(message.from_user.id)
         data = state.get("data", {})
         data["task_number"] = num
         set_user_state(message.from_user.id, step="photo", data=data)
-        bot.send_message(message.chat.id, "4️⃣ Отправьте фото задания (в сжатом виде, НЕ документом):")
+        outbox.send_message(message.chat.id, "4️⃣ Отправьте фото задания (в сжатом виде, НЕ документом):")
 
     # --- Шаг 4: фото ---
-    @bot.message_handler(content_types=['photo'], func=lambda msg: (
-        is_admin(msg.from_user.id) and
-        is_admin_mode(msg.from_user.id) and
-        get_user_state(msg.from_user.id).get("step") == "photo"
-    ))
+    @router.step("photo", mode="admin", content_types=("photo",))
     def receive_photo(message):
         photo_file_id = message.photo[-1].file_id
         state = get_user_state(message.from_user.id)
@@ -156,31 +230,23 @@ def register_admin_handlers(bot: TeleBot):
         section = data["section_name"]
         if section == "Аудирование":
             set_user_state(message.from_user.id, step="audio", data=data)
-            bot.send_message(message.chat.id, "5️⃣ Отправьте аудиофайл (голосовое сообщение или MP3):")
+            outbox.send_message(message.chat.id, "5️⃣ Отправьте аудиофайл (голосовое сообщение или MP3):")
         else:
             set_user_state(message.from_user.id, step="comment", data=data)
-            bot.send_message(message.chat.id, "5️⃣ Введите текст комментария к заданию:")
+            outbox.send_message(message.chat.id, "5️⃣ Введите текст комментария к заданию:")
 
     # --- Шаг 5a: аудио ---
-    @bot.message_handler(content_types=['audio', 'voice'], func=lambda msg: (
-        is_admin(msg.from_user.id) and
-        is_admin_mode(msg.from_user.id) and
-        get_user_state(msg.from_user.id).get("step") == "audio"
-    ))
+    @router.step("audio", mode="admin", content_types=("audio", "voice"))
     def receive_audio(message):
         file_id = message.voice.file_id if message.voice else message.audio.file_id
         state = get_user_state(message.from_user.id)
         data = state.get("data", {})
         data["audio_file_id"] = file_id
         set_user_state(message.from_user.id, step="comment", data=data)
-        bot.send_message(message.chat.id, "6️⃣ Введите текст комментария к заданию:")
+        outbox.send_message(message.chat.id, "6️⃣ Введите текст комментария к заданию:")
 
     # --- Шаг 5b/6: комментарий ---
-    @bot.message_handler(func=lambda msg: (
-        is_admin(msg.from_user.id) and
-        is_admin_mode(msg.from_user.id) and
-        get_user_state(msg.from_user.id).get("step") == "comment"
-    ))
+    @router.step("comment", mode="admin")
     def enter_comment(message):
         state = get_user_state(message.from_user.id)
         data = state.get("data", {})
@@ -191,18 +257,14 @@ def register_admin_handlers(bot: TeleBot):
             _show_preview_and_confirm(bot, message.chat.id, data)
         else:
             set_user_state(message.from_user.id, step="correct_answer", data=data)
-            bot.send_message(
+            outbox.send_message(
                 message.chat.id,
                 "7️⃣ Введите правильный ответ (точно так, как должен ввести пользователь):\n"
                 "Например: «3» или «北京» или «他去了学校»"
             )
 
     # --- Шаг 6/7: правильный ответ ---
-    @bot.message_handler(func=lambda msg: (
-        is_admin(msg.from_user.id) and
-        is_admin_mode(msg.from_user.id) and
-        get_user_state(msg.from_user.id).get("step") == "correct_answer"
-    ))
+    @router.step("correct_answer", mode="admin")
     def enter_correct_answer(message):
         state = get_user_state(message.from_user.id)
         data = state.get("data", {})
@@ -212,32 +274,14 @@ def register_admin_handlers(bot: TeleBot):
 
     # --- Предпросмотр ---
     def _show_preview_and_confirm(bot, chat_id, data):
-        section = data["section_name"]
-        preview = (
-            f"🔍 *Предпросмотр задания*\n\n"
-            f"📌 Уровень: {data['level_name']}\n"
-            f"📚 Раздел: {section}\n"
-            f"🔢 Номер: {data['task_number']}\n"
-            f"💬 Комментарий: {data['comment']}\n"
-        )
-        if section != "Письмо":
-            preview += f"✅ Правильный ответ: `{data['correct_answer']}`\n"
-
-        markup = types.ReplyKeyboardMarkup(resize_keyboard=True, one_time_keyboard=True)
-        markup.add("✅ Подтвердить", "❌ Отменить")
-        bot.send_message(chat_id, preview, parse_mode="Markdown", reply_markup=markup)
+        outbox.send_message(chat_id, preview_text(data), parse_mode="Markdown", reply_markup=confirm_markup())
 
     # --- Подтверждение / отмена ---
-    @bot.message_handler(func=lambda msg: (
-        is_admin(msg.from_user.id) and
-        is_admin_mode(msg.from_user.id) and
-        get_user_state(msg.from_user.id).get("step") == "confirm" and
-        msg.text in ["✅ Подтвердить", "❌ Отменить"]
-    ))
+    @router.text("✅ Подтвердить", "❌ Отменить", mode="admin", step="confirm")
     def confirm_or_cancel(message):
         if message.text == "❌ Отменить":
             clear_user_state(message.from_user.id)
-            bot.send_message(
+            outbox.send_message(
                 message.chat.id,
                 "↩️ Добавление отменено.",
                 reply_markup=types.ReplyKeyboardMarkup(resize_keyboard=True).add("/admin")
@@ -252,53 +296,163 @@ def register_admin_handlers(bot: TeleBot):
     def _save_task(bot, chat_id, data):
         db: Session = SessionLocal()
         try:
-            level = db.query(ExamLevel).filter(ExamLevel.name == data["level_name"]).first()
-            section = db.query(Section).filter(Section.name == data["section_name"]).first()
-            if not level or not section:
-                bot.send_message(chat_id, "❌ Ошибка: уровень или раздел не найдены.")
+            task = task_from_data(data)
+            if task is None:
+                outbox.send_message(chat_id, "❌ Ошибка: уровень или раздел не найдены.")
                 return
 
-            task = Task(
-                level_id=level.id,
-                section_id=section.id,
-                task_number=data["task_number"],
-                photo_file_id=data["photo_file_id"],
-                audio_file_id=data.get("audio_file_id"),
-                comment_text=data["comment"],
-                correct_answer=data.get("correct_answer")
-            )
             db.add(task)
             db.commit()
+            catalog.invalidate()
 
-            bot.send_message(
+            outbox.send_message(
                 chat_id,
-                f"✅ Задание добавлено!\n\n"
-                f"Уровень: {data['level_name']}\n"
-                f"Раздел: {data['section_name']}\n"
-                f"Номер: {data['task_number']}",
+                saved_text(data),
                 reply_markup=types.ReplyKeyboardMarkup(resize_keyboard=True).add("/admin")
             )
             logger.info(f"Админ {chat_id} добавил задание: {data['level_name']} {data['section_name']} №{data['task_number']}")
 
+        except IntegrityError:
+            # уникальный индекс tasks(level_id, section_id, task_number)
+            db.rollback()
+            outbox.send_message(
+                chat_id,
+                duplicate_text(data),
+                reply_markup=types.ReplyKeyboardMarkup(resize_keyboard=True).add("/admin")
+            )
         except Exception as e:
             logger.error(f"Ошибка сохранения задания: {e}")
-            bot.send_message(chat_id, f"❌ Ошибка при сохранении: {str(e)[:200]}")
+            outbox.send_message(chat_id, f"❌ Ошибка при сохранении: {str(e)[:200]}")
         finally:
             db.close()
 
+    # --- Массовый импорт заданий из файла ---
+    @router.command("import")
+    @router.text("📦 Импорт заданий", mode="admin")
+    def start_import(message):
+        if not is_admin(message.from_user.id):
+            outbox.send_message(message.chat.id, "🚫 Доступ запрещён.")
+            return
+
+        set_user_state(message.from_user.id, mode="admin", step="import_file", data={})
+        outbox.send_message(message.chat.id, task_import.HELP_TEXT, reply_markup=types.ReplyKeyboardRemove())
+
+    @router.step("import_file", mode="admin", content_types=("document",))
+    def receive_import_file(message):
+        document = message.document
+        if task_import.file_too_big(document.file_size):
+            outbox.send_message(message.chat.id, task_import.too_big_text())
+            return
+
+        set_user_state(message.from_user.id, step="main_menu")
+        status = outbox.send_message(message.chat.id, "⏳ Импорт начат...", merge=False).result()
+        # импорт с загрузкой медиа занимает минуты — не держим поток обработчиков
+        threading.Thread(
+            target=_run_import,
+            args=(message.chat.id, status.message_id, document),
+            name="task-import",
+            daemon=True
+        ).start()
+
+    def _run_import(chat_id, message_id, document):
+        media_chat_id = task_import.IMPORT_MEDIA_CHAT_ID or chat_id
+
+        def upload(kind, name, content):
+            if kind == "audio":
+                return outbox.send_audio(media_chat_id, (name, content), disable_notification=True).result().audio.file_id
+            return outbox.send_photo(media_chat_id, (name, content), disable_notification=True).result().photo[-1].file_id
+
+        def report(text):
+            outbox.edit_message_text(text, chat_id, message_id)
+
+        try:
+            content = bot.download_file(bot.get_file(document.file_id).file_path)
+            result = task_import.import_package(document.file_name or "", content, upload, report)
+            text = task_import.result_text(result)
+        except task_import.TaskImportError as e:
+            text = task_import.errors_text(e)
+        except Exception as e:
+            logger.error(f"Ошибка импорта заданий: {e}")
+            text = f"❌ Ошибка импорта, ничего не сохранено: {str(e)[:200]}"
+
+        outbox.send_message(chat_id, text, reply_markup=admin_menu_markup())
+
+    # --- Рассылка всем ученикам ---
+    @router.command("broadcast")
+    @router.text("📣 Рассылка", mode="admin")
+    def start_broadcast(message):
+        if not is_admin(message.from_user.id):
+            outbox.send_message(message.chat.id, "🚫 Доступ запрещён.")
+            return
+
+        set_user_state(message.from_user.id, mode="admin", step="broadcast_text", data={})
+        outbox.send_message(
+            message.chat.id,
+            "📣 Введите текст рассылки для всех учеников:",
+            reply_markup=types.ReplyKeyboardRemove()
+        )
+
+    @router.step("broadcast_text", mode="admin")
+    def enter_broadcast_text(message):
+        text = message.text.strip()
+        if not text:
+            outbox.send_message(message.chat.id, "❌ Текст не может быть пустым.")
+            return
+
+        set_user_state(message.from_user.id, step="broadcast_confirm", data={"text": text})
+        outbox.send_message(
+            message.chat.id,
+            broadcast_preview_text(text, broadcast.recipients_count()),
+            reply_markup=confirm_markup()
+        )
+
+    @router.text("✅ Подтвердить", "❌ Отменить", mode="admin", step="broadcast_confirm")
+    def confirm_broadcast(message):
+        text = get_user_state(message.from_user.id).get("data", {}).get("text")
+        set_user_state(message.from_user.id, step="main_menu", data={})
+        if message.text == "❌ Отменить" or not text:
+            outbox.send_message(message.chat.id, "❌ Рассылка отменена.", reply_markup=admin_menu_markup())
+            return
+
+        broadcast_id = broadcast.create(text, message.from_user.id)
+        status = outbox.send_message(message.chat.id, f"📣 Рассылка #{broadcast_id} запущена...",
+                                     reply_markup=admin_menu_markup(), merge=False).result()
+        _start_broadcast(bot, broadcast_id, message.chat.id, status.message_id)
+
     # --- Обработка неожиданных сообщений ---
-    @bot.message_handler(func=lambda msg: (
-        is_admin(msg.from_user.id) and
-        is_admin_mode(msg.from_user.id) and
-        get_user_state(msg.from_user.id).get("step") not in [
-            "main_menu", "choose_level", "choose_section", "task_number", "confirm"
-        ]
-    ))
+    # текст там, где ждём фото или аудио
+    @router.step("photo", "audio", mode="admin")
     def handle_unexpected_input(message):
         step = get_user_state(message.from_user.id).get("step")
         if step == "photo":
-            bot.send_message(message.chat.id, "⚠️ Ожидалось фото.")
+            outbox.send_message(message.chat.id, "⚠️ Ожидалось фото.")
         elif step == "audio":
-            bot.send_message(message.chat.id, "⚠️ Ожидался аудиофайл.")
-        elif step in ["comment", "correct_answer"]:
-            bot.send_message(message.chat.id, "⚠️ Ожидался текст.")
\ No newline at end of file
+            outbox.send_message(message.chat.id, "⚠️ Ожидался аудиофайл.")
+
+    # фото, аудио или файл там, где ждём текст
+    @router.step("comment", "correct_answer", mode="admin", content_types=("photo", "audio", "voice", "document"))
+    def text_expected(message):
+        outbox.send_message(message.chat.id, "⚠️ Ожидался текст.")
+
+    # не документ там, где ждём файл импорта
+    @router.step("import_file", mode="admin", content_types=("text", "photo", "audio", "voice"))
+    def import_expects_document(message):
+        outbox.send_message(message.chat.id, "⚠️ Ожидался файл (ZIP, JSON или CSV), отправленный документом.")
+
+def _start_broadcast(bot: TeleBot, broadcast_id: int, chat_id: int, message_id: int):
+    # ученикам — через очередь исходящих, она держит лимиты Telegram и повторяет 429
+    outbox.bind(bot)
+    broadcast.start(
+        broadcast_id,
+        send=lambda user_id, text: outbox.send_message(user_id, text),
+        report=lambda text: outbox.edit_message_text(text, chat_id, message_id)
+    )
+
+def resume_broadcasts(bot: TeleBot):
+    """Продолжить рассылки, прерванные остановкой бота"""
+    outbox.bind(bot)
+    for row in broadcast.unfinished():
+        status = outbox.send_message(
+            row.created_by, f"📣 Рассылка #{row.id} продолжается после перезапуска...", merge=False
+        ).result()
+        _start_broadcast(bot, row.id, row.created_by, status.message_id)
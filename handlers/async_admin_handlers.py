@@ -0,0 +1,380 @@
+# handlers/async_admin_handlers.py — мастер добавления заданий для AsyncTeleBot (async_main.py)
+#
+# Повторяет handlers/admin_handlers.py; задание сохраняется через AsyncSession.
+import asyncio
+import logging
+
+from sqlalchemy.exc import IntegrityError
+from telebot import asyncio_helper, types
+from telebot.async_telebot import AsyncTeleBot
+
+import broadcast
+import catalog
+import difficulty
+import metrics
+import reference
+import task_import
+from db_async import AsyncSessionLocal
+from handlers.admin_handlers import (
+    admin_menu_markup,
+    broadcast_preview_text,
+    confirm_markup,
+    duplicate_text,
+    is_admin,
+    preview_text,
+    saved_text,
+    task_from_data,
+)
+from router import router_for
+from state import aclear_user_state, aget_user_state, aset_user_state
+
+logger = logging.getLogger(__name__)
+
+
+def register_async_admin_handlers(bot: AsyncTeleBot):
+    router = router_for(bot)
+    router.guard("admin", is_admin)
+
+    async def _data(message):
+        return (await aget_user_state(message.from_user.id)).get("data", {})
+
+    # --- Вход в админку ---
+    @router.command("admin")
+    async def admin_start(message):
+        if not is_admin(message.from_user.id):
+            await bot.send_message(message.chat.id, "🚫 Доступ запрещён.")
+            return
+
+        await aset_user_state(message.from_user.id, mode="admin", step="main_menu", data={})
+        await bot.send_message(
+            message.chat.id,
+            "🔐 Админ-панель\nВыберите действие:",
+            reply_markup=admin_menu_markup()
+        )
+
+    # --- Метрики бота (только для админов) ---
+    @router.command("metrics")
+    async def admin_metrics(message):
+        if not is_admin(message.from_user.id):
+            await bot.send_message(message.chat.id, "🚫 Доступ запрещён.")
+            return
+
+        await bot.send_message(message.chat.id, metrics.summary_text())
+
+    # --- Самые сложные задания и частые неверные ответы ---
+    @router.command("difficulty")
+    @router.text("📉 Сложные задания", mode="admin")
+    async def admin_difficulty(message):
+        if not is_admin(message.from_user.id):
+            await bot.send_message(message.chat.id, "🚫 Доступ запрещён.")
+            return
+
+        try:
+            async with AsyncSessionLocal() as db:
+                text = await db.run_sync(difficulty.report_text)
+        except Exception as e:
+            logger.error(f"Ошибка в admin_difficulty: {e}")
+            text = "❌ Не удалось построить отчёт."
+        await bot.send_message(message.chat.id, text)
+
+    # --- Выход из админки ---
+    @router.text("↩️ Выход", mode="admin")
+    async def admin_exit(message):
+        await aclear_user_state(message.from_user.id)
+        await bot.send_message(
+            message.chat.id,
+            "✅ Вы вышли из админ-панели.",
+            reply_markup=types.ReplyKeyboardRemove()
+        )
+        await router.call_command("start", message)
+
+    # --- Начало добавления задания ---
+    @router.text("➕ Добавить задание", mode="admin")
+    async def start_add_task(message):
+        await aset_user_state(message.from_user.id, step="choose_level", data={})
+
+        markup = types.ReplyKeyboardMarkup(resize_keyboard=True, one_time_keyboard=True)
+        markup.add(*reference.LEVEL_NAMES)
+        await bot.send_message(message.chat.id, "1️⃣ Выберите уровень:", reply_markup=markup)
+
+    # --- Шаг 1: выбор уровня ---
+    @router.step("choose_level", mode="admin")
+    async def choose_level_admin(message):
+        if message.text not in reference.LEVEL_NAMES:
+            await bot.send_message(message.chat.id, "❌ Неверный уровень. Выберите из списка.")
+            return
+
+        data = await _data(message)
+        data["level_name"] = message.text
+        await aset_user_state(message.from_user.id, step="choose_section", data=data)
+
+        markup = types.ReplyKeyboardMarkup(resize_keyboard=True, one_time_keyboard=True)
+        markup.add(*reference.SECTION_NAMES)
+        await bot.send_message(message.chat.id, "2️⃣ Выберите раздел:", reply_markup=markup)
+
+    # --- Шаг 2: выбор раздела ---
+    @router.step("choose_section", mode="admin")
+    async def choose_section_admin(message):
+        if message.text not in reference.SECTION_NAMES:
+            await bot.send_message(message.chat.id, "❌ Неверный раздел. Выберите из списка.")
+            return
+
+        data = await _data(message)
+        data["section_name"] = message.text
+        await aset_user_state(message.from_user.id, step="task_number", data=data)
+        await bot.send_message(
+            message.chat.id,
+            "3️⃣ Введите номер задания (целое число ≥ 1):",
+            reply_markup=types.ReplyKeyboardRemove()
+        )
+
+    # --- Шаг 3: номер задания ---
+    @router.step("task_number", mode="admin")
+    async def enter_task_number(message):
+        try:
+            num = int(message.text)
+            if num < 1:
+                raise ValueError
+        except (ValueError, TypeError):
+            await bot.send_message(message.chat.id, "❌ Некорректный номер. Введите целое число ≥ 1.")
+            return
+
+        data = await _data(message)
+        data["task_number"] = num
+        await aset_user_state(message.from_user.id, step="photo", data=data)
+        await bot.send_message(message.chat.id, "4️⃣ Отправьте фото задания (в сжатом виде, НЕ документом):")
+
+    # --- Шаг 4: фото ---
+    @router.step("photo", mode="admin", content_types=("photo",))
+    async def receive_photo(message):
+        data = await _data(message)
+        data["photo_file_id"] = message.photo[-1].file_id
+
+        if data["section_name"] == "Аудирование":
+            await aset_user_state(message.from_user.id, step="audio", data=data)
+            await bot.send_message(message.chat.id, "5️⃣ Отправьте аудиофайл (голосовое сообщение или MP3):")
+        else:
+            await aset_user_state(message.from_user.id, step="comment", data=data)
+            await bot.send_message(message.chat.id, "5️⃣ Введите текст комментария к заданию:")
+
+    # --- Шаг 5a: аудио ---
+    @router.step("audio", mode="admin", content_types=("audio", "voice"))
+    async def receive_audio(message):
+        data = await _data(message)
+        data["audio_file_id"] = message.voice.file_id if message.voice else message.audio.file_id
+        await aset_user_state(message.from_user.id, step="comment", data=data)
+        await bot.send_message(message.chat.id, "6️⃣ Введите текст комментария к заданию:")
+
+    # --- Шаг 5b/6: комментарий ---
+    @router.step("comment", mode="admin")
+    async def enter_comment(message):
+        data = await _data(message)
+        data["comment"] = message.text.strip()
+
+        if data["section_name"] == "Письмо":
+            await aset_user_state(message.from_user.id, step="confirm", data=data)
+            await bot.send_message(message.chat.id, preview_text(data), parse_mode="Markdown", reply_markup=confirm_markup())
+        else:
+            await aset_user_state(message.from_user.id, step="correct_answer", data=data)
+            await bot.send_message(
+                message.chat.id,
+                "7️⃣ Введите правильный ответ (точно так, как должен ввести пользователь):\n"
+                "Например: «3» или «北京» или «他去了学校»"
+            )
+
+    # --- Шаг 6/7: правильный ответ ---
+    @router.step("correct_answer", mode="admin")
+    async def enter_correct_answer(message):
+        data = await _data(message)
+        data["correct_answer"] = message.text.strip()
+        await aset_user_state(message.from_user.id, step="confirm", data=data)
+        await bot.send_message(message.chat.id, preview_text(data), parse_mode="Markdown", reply_markup=confirm_markup())
+
+    # --- Подтверждение / отмена ---
+    @router.text("✅ Подтвердить", "❌ Отменить", mode="admin", step="confirm")
+    async def confirm_or_cancel(message):
+        if message.text == "❌ Отменить":
+            await aclear_user_state(message.from_user.id)
+            await bot.send_message(
+                message.chat.id,
+                "↩️ Добавление отменено.",
+                reply_markup=types.ReplyKeyboardMarkup(resize_keyboard=True).add("/admin")
+            )
+            return
+
+        await _save_task(message.chat.id, await _data(message))
+        await aclear_user_state(message.from_user.id)
+
+    # --- Сохранение ---
+    async def _save_task(chat_id, data):
+        try:
+            task = task_from_data(data)
+            if task is None:
+                await bot.send_message(chat_id, "❌ Ошибка: уровень или раздел не найдены.")
+                return
+
+            async with AsyncSessionLocal() as db:
+                db.add(task)
+                await db.commit()
+            # каталог читается синхронной сессией — перечитываем его вне цикла событий
+            await asyncio.to_thread(catalog.reload)
+
+            await bot.send_message(
+                chat_id,
+                saved_text(data),
+                reply_markup=types.ReplyKeyboardMarkup(resize_keyboard=True).add("/admin")
+            )
+            logger.info(f"Админ {chat_id} добавил задание: {data['level_name']} {data['section_name']} №{data['task_number']}")
+
+        except IntegrityError:
+            # уникальный индекс tasks(level_id, section_id, task_number)
+            await bot.send_message(
+                chat_id,
+                duplicate_text(data),
+                reply_markup=types.ReplyKeyboardMarkup(resize_keyboard=True).add("/admin")
+            )
+        except Exception as e:
+            logger.error(f"Ошибка сохранения задания: {e}")
+            await bot.send_message(chat_id, f"❌ Ошибка при сохранении: {str(e)[:200]}")
+
+    # --- Массовый импорт заданий из файла ---
+    @router.command("import")
+    @router.text("📦 Импорт заданий", mode="admin")
+    async def start_import(message):
+        if not is_admin(message.from_user.id):
+            await bot.send_message(message.chat.id, "🚫 Доступ запрещён.")
+            return
+
+        await aset_user_state(message.from_user.id, mode="admin", step="import_file", data={})
+        await bot.send_message(message.chat.id, task_import.HELP_TEXT, reply_markup=types.ReplyKeyboardRemove())
+
+    @router.step("import_file", mode="admin", content_types=("document",))
+    async def receive_import_file(message):
+        document = message.document
+        if task_import.file_too_big(document.file_size):
+            await bot.send_message(message.chat.id, task_import.too_big_text())
+            return
+
+        await aset_user_state(message.from_user.id, step="main_menu")
+        status = await bot.send_message(message.chat.id, "⏳ Импорт начат...")
+        asyncio.create_task(_run_import(message.chat.id, status.message_id, document))
+
+    async def _run_import(chat_id, message_id, document):
+        loop = asyncio.get_running_loop()
+        media_chat_id = task_import.IMPORT_MEDIA_CHAT_ID or chat_id
+
+        # import_package работает в отдельном потоке; запросы к Telegram — в цикле событий
+        def call(coro):
+            return asyncio.run_coroutine_threadsafe(coro, loop).result()
+
+        def upload(kind, name, content):
+            if kind == "audio":
+                return call(bot.send_audio(media_chat_id, (name, content), disable_notification=True)).audio.file_id
+            return call(bot.send_photo(media_chat_id, (name, content), disable_notification=True)).photo[-1].file_id
+
+        def report(text):
+            call(bot.edit_message_text(text, chat_id, message_id))
+
+        try:
+            file = await bot.get_file(document.file_id)
+            content = await bot.download_file(file.file_path)
+            result = await asyncio.to_thread(
+                task_import.import_package, document.file_name or "", content, upload, report
+            )
+            text = task_import.result_text(result)
+        except task_import.TaskImportError as e:
+            text = task_import.errors_text(e)
+        except Exception as e:
+            logger.error(f"Ошибка импорта заданий: {e}")
+            text = f"❌ Ошибка импорта, ничего не сохранено: {str(e)[:200]}"
+
+        await bot.send_message(chat_id, text, reply_markup=admin_menu_markup())
+
+    # --- Рассылка всем ученикам ---
+    @router.command("broadcast")
+    @router.text("📣 Рассылка", mode="admin")
+    async def start_broadcast(message):
+        if not is_admin(message.from_user.id):
+            await bot.send_message(message.chat.id, "🚫 Доступ запрещён.")
+            return
+
+        await aset_user_state(message.from_user.id, mode="admin", step="broadcast_text", data={})
+        await bot.send_message(
+            message.chat.id,
+            "📣 Введите текст рассылки для всех учеников:",
+            reply_markup=types.ReplyKeyboardRemove()
+        )
+
+    @router.step("broadcast_text", mode="admin")
+    async def enter_broadcast_text(message):
+        text = message.text.strip()
+        if not text:
+            await bot.send_message(message.chat.id, "❌ Текст не может быть пустым.")
+            return
+
+        await aset_user_state(message.from_user.id, step="broadcast_confirm", data={"text": text})
+        recipients = await asyncio.to_thread(broadcast.recipients_count)
+        await bot.send_message(
+            message.chat.id,
+            broadcast_preview_text(text, recipients),
+            reply_markup=confirm_markup()
+        )
+
+    @router.text("✅ Подтвердить", "❌ Отменить", mode="admin", step="broadcast_confirm")
+    async def confirm_broadcast(message):
+        text = (await _data(message)).get("text")
+        await aset_user_state(message.from_user.id, step="main_menu", data={})
+        if message.text == "❌ Отменить" or not text:
+            await bot.send_message(message.chat.id, "❌ Рассылка отменена.", reply_markup=admin_menu_markup())
+            return
+
+        broadcast_id = await asyncio.to_thread(broadcast.create, text, message.from_user.id)
+        status = await bot.send_message(message.chat.id, f"📣 Рассылка #{broadcast_id} запущена...",
+                                        reply_markup=admin_menu_markup())
+        _start_broadcast(bot, broadcast_id, message.chat.id, status.message_id)
+
+    # не документ там, где ждём файл импорта
+    @router.step("import_file", mode="admin", content_types=("text", "photo", "audio", "voice"))
+    async def import_expects_document(message):
+        await bot.send_message(message.chat.id, "⚠️ Ожидался файл (ZIP, JSON или CSV), отправленный документом.")
+
+    # --- Текст там, где ждём фото или аудио ---
+    @router.step("photo", "audio", mode="admin")
+    async def handle_unexpected_input(message):
+        step = (await aget_user_state(message.from_user.id)).get("step")
+        if step == "photo":
+            await bot.send_message(message.chat.id, "⚠️ Ожидалось фото.")
+        elif step == "audio":
+            await bot.send_message(message.chat.id, "⚠️ Ожидался аудиофайл.")
+
+    # фото, аудио или файл там, где ждём текст
+    @router.step("comment", "correct_answer", mode="admin", content_types=("photo", "audio", "voice", "document"))
+    async def text_expected(message):
+        await bot.send_message(message.chat.id, "⚠️ Ожидался текст.")
+
+
+def _start_broadcast(bot: AsyncTeleBot, broadcast_id: int, chat_id: int, message_id: int):
+    # broadcast.run работает в своём потоке; отправки выполняются в цикле событий бота
+    loop = asyncio.get_running_loop()
+
+    async def deliver(user_id, text):
+        while True:
+            try:
+                return await bot.send_message(user_id, text)
+            except asyncio_helper.ApiTelegramException as e:
+                if e.error_code != 429:
+                    raise
+                await asyncio.sleep((e.result_json.get("parameters") or {}).get("retry_after", 1))
+
+    broadcast.start(
+        broadcast_id,
+        send=lambda user_id, text: asyncio.run_coroutine_threadsafe(deliver(user_id, text), loop),
+        report=lambda text: asyncio.run_coroutine_threadsafe(bot.edit_message_text(text, chat_id, message_id), loop)
+    )
+
+
+async def resume_async_broadcasts(bot: AsyncTeleBot):
+    """Продолжить рассылки, прерванные остановкой бота"""
+    for row in await asyncio.to_thread(broadcast.unfinished):
+        status = await bot.send_message(row.created_by, f"📣 Рассылка #{row.id} продолжается после перезапуска...")
+        _start_broadcast(bot, row.id, row.created_by, status.message_id)
@@ -0,0 +1,282 @@
+# handlers/async_user_handlers.py — сценарий студента для AsyncTeleBot (async_main.py)
+#
+# Повторяет handlers/user_handlers.py: ожидание ответа — шаг "answer" в
+# состоянии пользователя (state.await_answer), как и в синхронном боте.
+import logging
+
+from telebot import types
+from telebot.async_telebot import AsyncTeleBot
+
+import catalog
+import progress
+import reference
+import scheduler
+from answer_recorder import async_answer_recorder
+from db_async import AsyncSessionLocal
+from grading import grade_answer
+from handlers import keyboards
+from live_message import AsyncLiveMessage
+from resilience import LLMUnavailable, gigachat_breaker
+from router import router_for
+from state import aawait_answer, aclear_user_state, aget_user_state, aset_user_state, atake_pending_answer
+from writing_queue import async_writing_queue, QueueFull, UserLimitReached
+
+logger = logging.getLogger(__name__)
+
+WRITING_PARKED = (
+    "⏳ Проверка ИИ сейчас недоступна. Текст сохранён — "
+    "разбор придёт автоматически, как только сервис восстановится."
+)
+WRITING_UNAVAILABLE = "⏳ Проверка ИИ сейчас недоступна. Попробуйте отправить текст позже."
+ANSWER_EXPIRED = "⌛ Задание слишком долго ждало ответа. Откройте его снова или выберите другое."
+
+
+def register_async_user_handlers(bot: AsyncTeleBot):
+    router = router_for(bot)
+
+    # --- /start — стартовое меню ---
+    @router.command("start")
+    async def send_welcome(message):
+        await aclear_user_state(message.from_user.id)  # выходим из любого режима
+        await bot.send_message(
+            message.chat.id,
+            "👋 Привет! Я — бот для подготовки к HSK.\n\n"
+            "Выберите уровень экзамена:",
+            reply_markup=keyboards.levels_markup()
+        )
+
+    # --- Выбор уровня ---
+    @router.text(*reference.LEVEL_NAMES)
+    async def choose_level(message):
+        level_name = message.text
+        level_id = reference.level_id(level_name)
+        if not level_id:
+            await bot.send_message(message.chat.id, "❌ Уровень не найден. Нажмите /start.")
+            return
+
+        await aset_user_state(message.from_user.id, level_id=level_id, level_name=level_name)
+        await bot.send_message(
+            message.chat.id,
+            f"Вы выбрали {level_name}. Теперь выберите раздел:",
+            reply_markup=keyboards.sections_markup()
+        )
+
+    # --- Выбор раздела ---
+    @router.text(*reference.SECTION_NAMES)
+    async def choose_section(message):
+        section_name = message.text
+        section_id = reference.section_id(section_name)
+        if not section_id:
+            await bot.send_message(message.chat.id, "Раздел не найден.")
+            return
+
+        state = await aget_user_state(message.from_user.id)
+        level_id = state.get("level_id")
+        if not level_id:
+            await bot.send_message(message.chat.id, "Сначала выберите уровень (/start)")
+            return
+
+        await aset_user_state(message.from_user.id, section_id=section_id, section_name=section_name)
+
+        tasks = catalog.get_tasks(level_id, section_id)
+        if not tasks:
+            await bot.send_message(
+                message.chat.id,
+                f"📌 Пока нет заданий для «{section_name}». Обратитесь к администратору."
+            )
+            return
+
+        await bot.send_message(
+            message.chat.id,
+            f"📚 Раздел: *{section_name}*\n"
+            f"Всего заданий: {len(tasks)}\n"
+            f"Выберите номер:",
+            parse_mode="Markdown",
+            reply_markup=keyboards.task_list_markup(tasks, "↩️ Назад к уровням")
+        )
+
+    async def _send_task(message, task, answer_prompt, audio_caption):
+        await aawait_answer(message.from_user.id, task.id)
+
+        await bot.send_photo(message.chat.id, task.photo_file_id, caption="📎 Задание:")
+        if task.audio_file_id:
+            await bot.send_audio(message.chat.id, task.audio_file_id, caption=audio_caption)
+        await bot.send_message(
+            message.chat.id,
+            f"{task.comment_text}\n\n{answer_prompt}",
+            reply_markup=types.ReplyKeyboardRemove()
+        )
+
+    # --- Выбор конкретного задания ---
+    @router.pattern(r"Задание \d+")
+    async def send_task(message):
+        task_num = int(message.text.split()[1])
+
+        state = await aget_user_state(message.from_user.id)
+        level_id = state.get("level_id")
+        section_id = state.get("section_id")
+        if not (level_id and section_id):
+            await bot.send_message(message.chat.id, "Сессия устарела. Начните с /start")
+            return
+
+        try:
+            task = catalog.get_task(level_id, section_id, task_num)
+            if not task:
+                await bot.send_message(message.chat.id, f"Задание {task_num} не найдено.")
+                return
+            await _send_task(message, task, "Введите ответ:", "🎧 Аудио:")
+        except Exception as e:
+            logger.error(f"Ошибка в send_task: {e}")
+            await bot.send_message(message.chat.id, "Ошибка при загрузке задания.")
+
+    # --- Обработка ответа пользователя ---
+    @router.step("answer", mode="user")
+    async def process_answer(message):
+        user_id = message.from_user.id
+        user_answer = message.text.strip()
+
+        task_id = await atake_pending_answer(user_id)
+        if task_id is None:
+            await bot.send_message(user_id, ANSWER_EXPIRED, reply_markup=keyboards.after_answer_markup())
+            return
+        task = catalog.get_task_by_id(task_id)
+        if not task:
+            await bot.send_message(user_id, "Задание не найдено. Начните с /start")
+            return
+
+        try:
+            if task.section_name == "Письмо":
+                is_correct = None
+                feedback = _enqueue_writing(user_id, task, user_answer)
+            else:
+                is_correct, feedback = grade_answer(task, user_answer)
+
+            submitted_at = async_answer_recorder.record(user_id, task.id, user_answer, is_correct)
+            scheduler.scheduler.record(user_id, task, is_correct, submitted_at)
+
+            await bot.send_message(user_id, feedback, parse_mode="Markdown")
+            await bot.send_message(user_id, "Что делаем дальше?", reply_markup=keyboards.after_answer_markup())
+        except Exception as e:
+            logger.error(f"Error in process_answer: {e}")
+            await bot.send_message(user_id, "Произошла ошибка. Попробуйте снова.")
+
+    # --- Проверка письменного задания (в фоне) ---
+    def _enqueue_writing(user_id, task, user_answer):
+        if gigachat_breaker.rejecting():
+            # GigaChat недоступен — не занимаем очередь, работа дождётся восстановления
+            return _park_writing(user_id, task, user_answer) or WRITING_UNAVAILABLE
+        try:
+            position = async_writing_queue.submit(
+                user_id,
+                lambda: _check_writing(user_id, task, user_answer)
+            )
+        except UserLimitReached:
+            return "⏳ Ваш предыдущий текст ещё проверяется. Дождитесь разбора и отправьте следующий."
+        except QueueFull:
+            return "⏳ Сейчас на проверке слишком много работ. Попробуйте отправить текст через пару минут."
+
+        return (
+            f"🧠 Текст принят на проверку ИИ. Позиция в очереди: {position}.\n"
+            f"Разбор придёт отдельным сообщением."
+        )
+
+    def _park_writing(user_id, task, user_answer):
+        """Отложить работу до восстановления GigaChat; текст для ученика или None, если мест нет"""
+        if async_writing_queue.park(user_id, lambda: _check_writing(user_id, task, user_answer, parked=True)):
+            return WRITING_PARKED
+        return None
+
+    async def _check_writing(user_id, task, user_answer, parked=False):
+        live = AsyncLiveMessage(bot, user_id)
+        try:
+            # LLM-стек грузится в фоне после запуска (startup.load_llm)
+            from llm import aanalyze_writing_task
+            feedback = await aanalyze_writing_task(
+                level_name=task.level_name,
+                comment=task.comment_text,
+                user_text=user_answer,
+                on_partial=live.update
+            )
+        except LLMUnavailable:
+            feedback = _park_writing(user_id, task, user_answer)
+            if feedback is not None and parked and not live.started:
+                # ученик уже знает, что разбор придёт позже
+                return
+            feedback = feedback or WRITING_UNAVAILABLE
+        except Exception as e:
+            logger.error(f"LLM error: {e}")
+            feedback = "Не удалось проанализировать текст. Попробуйте позже."
+
+        await live.finish(feedback, parse_mode="Markdown")
+
+    # --- Навигация после ответа ---
+    @router.text("Следующее задание", "К списку заданий", "🏠 В главное меню")
+    async def handle_navigation(message):
+        user_id = message.from_user.id
+        text = message.text
+
+        if text == "🏠 В главное меню":
+            await send_welcome(message)
+            return
+
+        state = await aget_user_state(user_id)
+        level_id = state.get("level_id")
+        section_id = state.get("section_id")
+        if not (level_id and section_id):
+            await bot.send_message(message.chat.id, "Сначала выберите уровень (/start)")
+            return
+
+        if text == "К списку заданий":
+            level_name = reference.level_name(level_id)
+            section_name = reference.section_name(section_id)
+            if not section_name or not level_name:
+                await bot.send_message(message.chat.id, "Ошибка состояния. Начните с /start.")
+                return
+
+            await bot.send_message(
+                message.chat.id,
+                f"📚 {level_name} → {section_name}\n"
+                f"Выберите задание:",
+                reply_markup=keyboards.task_list_markup(catalog.get_tasks(level_id, section_id), "Назад к уровням")
+            )
+
+        elif text == "Следующее задание":
+            current_task = catalog.get_task_by_id(state.get("current_task_id"))
+            if not current_task:
+                await bot.send_message(message.chat.id, "Не удалось определить текущее задание.")
+                return
+
+            try:
+                if scheduler.NEXT_TASK_MODE == "smart":
+                    next_task = await scheduler.anext_task(user_id, level_id, section_id, exclude=current_task.id)
+                else:
+                    next_task = catalog.get_next_task(current_task)
+            except Exception as e:
+                logger.error(f"Ошибка при выборе следующего задания: {e}")
+                await bot.send_message(message.chat.id, "Ошибка при загрузке задания.")
+                return
+            if next_task:
+                await _send_task(message, next_task, "Введите ваш ответ:", "🎧 Прослушайте:")
+            else:
+                await bot.send_message(
+                    message.chat.id,
+                    scheduler.finished_text(user_id, level_id, section_id),
+                    reply_markup=keyboards.section_finished_markup()
+                )
+
+    # --- Возврат к выбору уровня ---
+    @router.text("Назад к уровням", "↩️ Назад к уровням")
+    async def back_to_levels(message):
+        await send_welcome(message)
+
+    # --- Статистика ученика ---
+    @router.command("progress")
+    async def show_progress(message):
+        try:
+            async with AsyncSessionLocal() as db:
+                rows = (await db.execute(progress.query(message.from_user.id))).all()
+            text = progress.progress_text(rows)
+        except Exception as e:
+            logger.error(f"Ошибка в show_progress: {e}")
+            text = "Не удалось загрузить статистику. Попробуйте позже."
+        await bot.send_message(message.chat.id, text)
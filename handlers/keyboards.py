@@ -0,0 +1,37 @@
+# handlers/keyboards.py — клавиатуры, общие для обычного и асинхронного бота
+from typing import Iterable
+
+from telebot import types
+
+import reference
+
+
+def levels_markup() -> types.ReplyKeyboardMarkup:
+    markup = types.ReplyKeyboardMarkup(resize_keyboard=True, one_time_keyboard=True)
+    markup.add(*[types.KeyboardButton(l) for l in reference.LEVEL_NAMES])
+    return markup
+
+
+def sections_markup() -> types.ReplyKeyboardMarkup:
+    markup = types.ReplyKeyboardMarkup(resize_keyboard=True, one_time_keyboard=True)
+    markup.add(*[types.KeyboardButton(s) for s in reference.SECTION_NAMES])
+    return markup
+
+
+def task_list_markup(tasks: Iterable, back_text: str) -> types.ReplyKeyboardMarkup:
+    markup = types.ReplyKeyboardMarkup(resize_keyboard=True, one_time_keyboard=True)
+    for t in tasks:
+        markup.add(types.KeyboardButton(f"Задание {t.task_number}"))
+    markup.add(types.KeyboardButton(back_text))
+    return markup
+
+
+def after_answer_markup() -> types.ReplyKeyboardMarkup:
+    markup = types.ReplyKeyboardMarkup(resize_keyboard=True)
+    markup.add("Следующее задание")
+    markup.add("К списку заданий", "🏠 В главное меню")
+    return markup
+
+
+def section_finished_markup() -> types.ReplyKeyboardMarkup:
+    return types.ReplyKeyboardMarkup(resize_keyboard=True).add("К списку заданий", "🏠 В главное меню")
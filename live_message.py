@@ -0,0 +1,128 @@
+# live_message.py — сообщение, которое дописывается по мере генерации ответа LLM
+#
+# Первый фрагмент разбора отправляется новым сообщением, дальше это же
+# сообщение правится не чаще раза в LIVE_EDIT_INTERVAL секунд — Telegram
+# ограничивает правки примерно одной в секунду на чат. Промежуточный текст
+# идёт без разметки (недописанный Markdown не разбирается) и с курсором ▌,
+# итоговый — с той же разметкой, что и раньше отдельным сообщением. Если ИИ
+# ничего не прислал потоком (ответ из кэша, ошибка), итог уходит обычным
+# сообщением.
+import logging
+import os
+import time
+from concurrent.futures import Future
+from typing import TYPE_CHECKING, Optional
+
+from outbox import Outbox
+
+if TYPE_CHECKING:
+    # aiohttp нужен только асинхронному боту
+    from telebot.async_telebot import AsyncTeleBot
+
+logger = logging.getLogger(__name__)
+
+LIVE_EDIT_INTERVAL = float(os.getenv("LIVE_EDIT_INTERVAL", "1.5"))
+
+# Предел длины текста сообщения в Bot API
+_MAX_TEXT = 4096
+_CURSOR = " ▌"
+
+
+def preview(text: str) -> str:
+    """Промежуточный текст: с курсором и не длиннее сообщения"""
+    if len(text) + len(_CURSOR) > _MAX_TEXT:
+        text = text[:_MAX_TEXT - len(_CURSOR) - 1] + "…"
+    return text + _CURSOR
+
+
+def _not_modified(error: Exception) -> bool:
+    return "message is not modified" in str(error)
+
+
+class LiveMessage:
+    """Живое сообщение через очередь исходящих (main.py)"""
+
+    def __init__(self, outbox: Outbox, chat_id: int, interval: float = LIVE_EDIT_INTERVAL):
+        self.outbox = outbox
+        self.chat_id = chat_id
+        self.interval = interval
+        self._sent: Optional[Future] = None
+        self._shown = ""
+        self._edited_at = 0.0
+
+    @property
+    def started(self) -> bool:
+        return self._sent is not None
+
+    def update(self, text: str) -> None:
+        now = time.monotonic()
+        if self._sent is None:
+            # без склейки: правка заменила бы и приклеенный чужой текст
+            self._sent = self.outbox.send_message(self.chat_id, preview(text), merge=False)
+        elif now - self._edited_at < self.interval or text == self._shown:
+            return
+        elif not self._sent.done() or self._sent.exception() is not None:
+            # первое сообщение ещё в очереди (или не ушло) — поток генерации не ждёт
+            return
+        else:
+            self.outbox.edit_message_text(preview(text), self.chat_id, self._sent.result().message_id)
+        self._shown = text
+        self._edited_at = now
+
+    def finish(self, text: str, **kwargs) -> None:
+        """Итоговый текст — правкой живого сообщения или, если его нет, новым сообщением"""
+        if self._sent is None or len(text) > _MAX_TEXT:
+            self.outbox.send_message(self.chat_id, text, **kwargs)
+            return
+
+        def deliver(sent: Future) -> None:
+            if sent.exception() is not None:
+                logger.warning(f"Живое сообщение в чат {self.chat_id} не отправлено: {sent.exception()}")
+                self.outbox.send_message(self.chat_id, text, **kwargs)
+            else:
+                self.outbox.edit_message_text(text, self.chat_id, sent.result().message_id, **kwargs)
+
+        # правка уйдёт, как только очередь доставит первое сообщение
+        self._sent.add_done_callback(deliver)
+
+
+class AsyncLiveMessage:
+    """То же для AsyncTeleBot (async_main.py): запросы идут напрямую"""
+
+    def __init__(self, bot: "AsyncTeleBot", chat_id: int, interval: float = LIVE_EDIT_INTERVAL):
+        self.bot = bot
+        self.chat_id = chat_id
+        self.interval = interval
+        self._message_id: Optional[int] = None
+        self._shown = ""
+        self._edited_at = 0.0
+
+    @property
+    def started(self) -> bool:
+        return self._message_id is not None
+
+    async def update(self, text: str) -> None:
+        now = time.monotonic()
+        if now - self._edited_at < self.interval or text == self._shown:
+            return
+        # промежуточный текст не важен: при ошибке (в том числе 429) просто ждём следующего
+        self._edited_at = now
+        try:
+            if self._message_id is None:
+                self._message_id = (await self.bot.send_message(self.chat_id, preview(text))).message_id
+            else:
+                await self.bot.edit_message_text(preview(text), self.chat_id, self._message_id)
+            self._shown = text
+        except Exception as e:
+            logger.warning(f"Живое сообщение в чат {self.chat_id}: {e}")
+
+    async def finish(self, text: str, **kwargs) -> None:
+        if self._message_id is not None and len(text) <= _MAX_TEXT:
+            try:
+                await self.bot.edit_message_text(text, self.chat_id, self._message_id, **kwargs)
+                return
+            except Exception as e:
+                if _not_modified(e):
+                    return
+                logger.warning(f"Не удалось дописать живое сообщение в чат {self.chat_id}: {e}")
+        await self.bot.send_message(self.chat_id, text, **kwargs)
@@ -1,25 +1,30 @@
+import asyncio
+import logging
 import os
+import threading
+import time
+from typing import Awaitable, Callable, Optional
 from langchain_gigachat import GigaChat
+from langchain_core.callbacks import BaseCallbackHandler
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.output_parsers import StrOutputParser
+from feedback_cache import feedback_cache, make_key
+import metrics
+import resilience
+from resilience import DeadlineExceeded, LLMUnavailable
 
+logger = logging.getLogger(__name__)
 
-# Инициализация GigaChat
-def get_gigachat_client():
-    auth = os.getenv("GIGACHAT_AUTH")
-    return GigaChat(
-        credentials=auth,
-        verify_ssl_certs=False,
-        scope="GIGACHAT_API_PERS",
-        model="GigaChat",
-        timeout=60,
-    )
-
+# Одновременных HTTP-соединений к GigaChat (не меньше числа потоков проверки текстов)
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "4"))
+# Таймаут одного HTTP-запроса; общий бюджет с повторами — LLM_DEADLINE (resilience.py)
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "45"))
+# За сколько секунд до истечения токена обновлять его в фоне
+TOKEN_REFRESH_AHEAD = int(os.getenv("GIGACHAT_TOKEN_REFRESH_AHEAD", "30"))
+# 1 — читать ответ потоком и показывать его по мере генерации (если вызывающий передал on_partial)
+LLM_STREAMING = os.getenv("LLM_STREAMING", "1") == "1"
 
-def analyze_writing_task(level_name: str, comment: str, user_text: str) -> str:
-    chat = get_gigachat_client()
-
-    prompt_template = """
+PROMPT_TEMPLATE = """
 Ты — строгий, но доброжелательный преподаватель китайского языка, эксперт по экзамену HSK.
 Пользователь выполнил задание по письму для уровня {level_name}.
 Задание было таким:
@@ -43,15 +48,187 @@ def analyze_writing_task(level_name: str, comment: str, user_text: str) -> str:
 Если текст слишком короткий или не по теме — скажи об этом вежливо.
 """
 
-    prompt = ChatPromptTemplate.from_template(prompt_template)
-    chain = prompt | chat | StrOutputParser()
+PROMPT = ChatPromptTemplate.from_template(PROMPT_TEMPLATE)
+
+# Клиент и цепочка создаются один раз на процесс: HTTP-соединения и
+# OAuth-токен переиспользуются всеми запросами. Оба объекта потокобезопасны.
+_client = None
+_chain = None
+_lock = threading.Lock()
+_refresher = None
+
+
+# Инициализация GigaChat
+def get_gigachat_client():
+    global _client
+    if _client is None:
+        with _lock:
+            if _client is None:
+                auth = os.getenv("GIGACHAT_AUTH")
+                _client = GigaChat(
+                    credentials=auth,
+                    verify_ssl_certs=False,
+                    scope="GIGACHAT_API_PERS",
+                    model="GigaChat",
+                    timeout=LLM_TIMEOUT,
+                    max_connections=LLM_MAX_CONNECTIONS,
+                )
+    return _client
+
+
+def get_chain():
+    global _chain
+    if _chain is None:
+        chat = get_gigachat_client()
+        with _lock:
+            if _chain is None:
+                _chain = PROMPT | chat | StrOutputParser()
+    return _chain
+
+
+class _TokenUsage(BaseCallbackHandler):
+    """Токены из ответа GigaChat — в метрики (StrOutputParser их отбрасывает)"""
+
+    def on_llm_end(self, response, **kwargs) -> None:
+        usage = (response.llm_output or {}).get("token_usage") or {}
+        metrics.llm_tokens.inc("prompt", amount=usage.get("prompt_tokens") or 0)
+        metrics.llm_tokens.inc("completion", amount=usage.get("completion_tokens") or 0)
+
+
+_CHAIN_CONFIG = {"callbacks": [_TokenUsage()]}
+
+
+def _refresh_token() -> float:
+    """
+    Получить (при необходимости обновить) токен.
+    Возвращает время истечения токена в секундах или 0, если оно неизвестно.
+    """
+    # SDK обновляет токен сам, если до истечения осталось меньше его буфера
+    token = get_gigachat_client()._client.get_token()
+    if not token or not token.expires_at:
+        return 0
+    return token.expires_at / 1000
+
+
+def _token_refresher() -> None:
+    while True:
+        try:
+            expires_at = _refresh_token()
+        except Exception as e:
+            logger.warning(f"Не удалось обновить токен GigaChat: {e}")
+            time.sleep(30)
+            continue
+        if not expires_at:
+            # статический токен или авторизация не настроена — обновлять нечего
+            return
+        time.sleep(max(expires_at - time.time() - TOKEN_REFRESH_AHEAD, 1))
+
+
+def warmup() -> None:
+    """Создать клиент и цепочку, получить токен и запустить его фоновое обновление"""
+    global _refresher
+    get_chain()
+    with _lock:
+        if _refresher is not None:
+            return
+        _refresher = threading.Thread(target=_token_refresher, name="gigachat-token", daemon=True)
+        _refresher.start()
+    logger.info("Клиент GigaChat инициализирован.")
+
+
+def _stream(chain, inputs, on_partial: Callable[[str], None], deadline: float) -> str:
+    """Ответ цепочки потоком: on_partial получает весь текст, накопленный на данный момент"""
+    start = time.perf_counter()
+    parts = []
+    for chunk in chain.stream(inputs, config=_CHAIN_CONFIG):
+        if time.monotonic() > deadline:
+            # поток синхронного клиента не прервать извне — проверяем между фрагментами
+            raise DeadlineExceeded("бюджет времени на разбор исчерпан")
+        if not parts:
+            metrics.llm_first_chunk_seconds.observe(time.perf_counter() - start)
+        parts.append(chunk)
+        on_partial("".join(parts))
+    return "".join(parts)
+
+
+async def _astream(chain, inputs, on_partial: Callable[[str], Awaitable[None]]) -> str:
+    start = time.perf_counter()
+    parts = []
+    async for chunk in chain.astream(inputs, config=_CHAIN_CONFIG):
+        if not parts:
+            metrics.llm_first_chunk_seconds.observe(time.perf_counter() - start)
+        parts.append(chunk)
+        await on_partial("".join(parts))
+    return "".join(parts)
+
+
+def analyze_writing_task(level_name: str, comment: str, user_text: str,
+                         on_partial: Optional[Callable[[str], None]] = None) -> str:
+    """
+    Разбор письменного задания. on_partial — показывать разбор по мере генерации
+    (при LLM_STREAMING); из кэша и при ошибке возвращается сразу итоговый текст.
+    LLMUnavailable — GigaChat недоступен, работу стоит отложить (writing_queue.park).
+    """
+    key = make_key(level_name, comment, user_text)
+    cached = feedback_cache.get(key)
+    if cached is not None:
+        metrics.llm_cache_hits.inc()
+        return cached
+
+    chain = get_chain()
+
+    inputs = {
+        "level_name": level_name,
+        "comment": comment,
+        "user_text": user_text
+    }
+    def attempt(deadline: float) -> str:
+        with metrics.track_llm():
+            if on_partial is not None and LLM_STREAMING:
+                return _stream(chain, inputs, on_partial, deadline)
+            return chain.invoke(inputs, config=_CHAIN_CONFIG)
 
     try:
-        result = chain.invoke({
-            "level_name": level_name,
-            "comment": comment,
-            "user_text": user_text
-        })
-        return result
+        result = resilience.call(attempt, LLM_TIMEOUT)
+    except LLMUnavailable:
+        raise
     except Exception as e:
-        return f"⚠️ Извините, не удалось проанализировать текст. Ошибка: {str(e)[:100]}"
\ No newline at end of file
+        return f"⚠️ Извините, не удалось проанализировать текст. Ошибка: {str(e)[:100] or e.__class__.__name__}"
+
+    # ошибки не кэшируем — только успешные разборы
+    feedback_cache.put(key, result)
+    return result
+
+
+async def aanalyze_writing_task(level_name: str, comment: str, user_text: str,
+                                on_partial: Optional[Callable[[str], Awaitable[None]]] = None) -> str:
+    """Асинхронная версия для async_main.py: модель вызывается через ainvoke/astream"""
+    key = make_key(level_name, comment, user_text)
+    # кэш работает с синхронной сессией — уводим его в поток
+    cached = await asyncio.to_thread(feedback_cache.get, key)
+    if cached is not None:
+        metrics.llm_cache_hits.inc()
+        return cached
+
+    chain = get_chain()
+
+    inputs = {
+        "level_name": level_name,
+        "comment": comment,
+        "user_text": user_text
+    }
+    async def attempt() -> str:
+        with metrics.track_llm():
+            if on_partial is not None and LLM_STREAMING:
+                return await _astream(chain, inputs, on_partial)
+            return await chain.ainvoke(inputs, config=_CHAIN_CONFIG)
+
+    try:
+        result = await resilience.acall(attempt)
+    except LLMUnavailable:
+        raise
+    except Exception as e:
+        return f"⚠️ Извините, не удалось проанализировать текст. Ошибка: {str(e)[:100] or e.__class__.__name__}"
+
+    await asyncio.to_thread(feedback_cache.put, key, result)
+    return result
\ No newline at end of file
@@ -1,11 +1,20 @@
 import os
+import sys
+import startup
+# --profile-startup — замерить импорт и инициализацию по модулям, напечатать отчёт и выйти
+if "--profile-startup" in sys.argv:
+    startup.enable()
 from dotenv import load_dotenv
 load_dotenv()
+import atexit
 import logging
-from telebot import TeleBot
+import signal
+import threading
+from telebot import TeleBot, apihelper
 from db import init_db
+from reference import init_reference_data
 from handlers.user_handlers import register_user_handlers
-from handlers.admin_handlers import register_admin_handlers
+from handlers.admin_handlers import register_admin_handlers, resume_broadcasts
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -14,32 +23,84 @@ TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
 if not TOKEN:
     raise ValueError("TELEGRAM_BOT_TOKEN не указан в .env")
 
-bot = TeleBot(TOKEN)
+# polling — long polling (по умолчанию), webhook — локальный HTTP-сервер (см. webhook.py)
+BOT_MODE = os.getenv("BOT_MODE", "polling")
 
-def init_reference_data():
-    from sqlalchemy.orm import Session
-    from db import SessionLocal
-    from models import ExamLevel, Section
+# Другой адрес Bot API, например tools/fake_telegram.py для офлайн-проверки
+if os.getenv("TELEGRAM_API_URL"):
+    apihelper.API_URL = os.getenv("TELEGRAM_API_URL")
 
-    db: Session = SessionLocal()
+# В режиме webhook обновления разбирают воркеры WebhookServer, свой пул потоков боту не нужен
+bot = TeleBot(TOKEN, threaded=(BOT_MODE != "webhook"))
+
+def run_webhook():
+    from webhook import WebhookServer
+
+    path = os.getenv("WEBHOOK_PATH", "/webhook")
+    secret = os.getenv("WEBHOOK_SECRET")
+    server = WebhookServer(
+        bot,
+        host=os.getenv("WEBHOOK_HOST", "127.0.0.1"),
+        port=int(os.getenv("WEBHOOK_PORT", "8443")),
+        path=path,
+        secret=secret,
+        workers=int(os.getenv("WEBHOOK_WORKERS", "8")),
+        queue_size=int(os.getenv("WEBHOOK_QUEUE_SIZE", "100")),
+    )
+    server.start()
+
+    # WEBHOOK_URL — внешний адрес (обычно прокси перед локальным сервером)
+    bot.remove_webhook()
+    bot.set_webhook(url=os.environ["WEBHOOK_URL"].rstrip("/") + path, secret_token=secret)
+
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stop.set())
     try:
-        for i in range(1, 6):
-            if not db.query(ExamLevel).filter(ExamLevel.name == f"HSK {i}").first():
-                db.add(ExamLevel(name=f"HSK {i}"))
-        for name in ["Аудирование", "Чтение", "Письмо"]:
-            if not db.query(Section).filter(Section.name == name).first():
-                db.add(Section(name=name))
-        db.commit()
-        logger.info("Справочные данные инициализированы.")
+        stop.wait()
+    except KeyboardInterrupt:
+        pass
     finally:
-        db.close()
+        server.stop()
 
 if __name__ == "__main__":
-    init_db()
-    init_reference_data()
+    with startup.step("init_db"):
+        init_db()
+    with startup.step("init_reference_data"):
+        init_reference_data()
+
+    with startup.step("регистрация обработчиков"):
+        register_user_handlers(bot)
+        register_admin_handlers(bot)
+
+    if startup.enabled():
+        with startup.step("import llm", background=True):
+            import llm
+        print(startup.report())
+        sys.exit(0)
+
+    # при остановке дописываем в БД накопленные ответы
+    from answer_recorder import answer_recorder
+    atexit.register(answer_recorder.shutdown)
+    # и отправляем то, что осталось в очереди исходящих
+    from outbox import outbox
+    atexit.register(outbox.shutdown)
+    signal.signal(signal.SIGTERM, lambda *_: bot.stop_polling())
+
+    # METRICS_PORT — метрики для Prometheus на локальном порту
+    import metrics
+    metrics.start_server()
+
+    # рассылки, прерванные прошлой остановкой, продолжаются с контрольной точки
+    resume_broadcasts(bot)
 
-    register_user_handlers(bot)
-    register_admin_handlers(bot)
+    # LLM-стек грузим в фоне: опрос Telegram начинается, не дожидаясь его
+    threading.Thread(target=startup.load_llm, name="llm-warmup", daemon=True).start()
 
-    logger.info("Бот запущен.")
-    bot.infinity_polling()
\ No newline at end of file
+    logger.info(f"Бот запущен ({BOT_MODE}) за {startup.elapsed():.2f} с.")
+    if BOT_MODE == "webhook":
+        run_webhook()
+    elif BOT_MODE == "polling":
+        bot.remove_webhook()
+        bot.infinity_polling()
+    else:
+        raise ValueError(f"Неизвестный BOT_MODE: {BOT_MODE}")
\ No newline at end of file
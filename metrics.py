@@ -0,0 +1,294 @@
+# metrics.py — счётчики и гистограммы бота, отдача в формате Prometheus
+#
+# Что меряем:
+#   - время и ошибки каждого обработчика (router.py, track_update);
+#   - запросы к БД: всего, их длительность и число на одно обновление (db.py);
+#   - запросы к GigaChat: время, ошибки, попадания в кэш, токены (llm.py);
+#   - глубину очереди проверки письма (writing_queue.py).
+#
+# METRICS_PORT — порт для Prometheus (/metrics), 0 — не запускать сервер.
+# Краткая сводка доступна админу командой /metrics.
+import bisect
+import contextvars
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+
+# Границы корзин гистограмм
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+LLM_BUCKETS = (0.5, 1, 2, 5, 10, 20, 30, 60, 120)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50)
+
+_registry: List["_Metric"] = []
+
+
+def _labels_text(names: Sequence[str], values: Tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{value}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"] + self._samples()
+
+    def _samples(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        super().__init__(name, help, labels)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, *label_values: str, amount: float = 1) -> None:
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def value(self, *label_values: str) -> float:
+        with self._lock:
+            return self._values.get(label_values, 0)
+
+    def values(self) -> Dict[Tuple[str, ...], float]:
+        with self._lock:
+            return dict(self._values)
+
+    def _samples(self) -> List[str]:
+        return [f"{self.name}{_labels_text(self.labels, key)} {value}" for key, value in sorted(self.values().items())]
+
+
+class Gauge(_Metric):
+    """Значение снимается функцией в момент чтения метрик"""
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, read: Callable[[], float]):
+        super().__init__(name, help)
+        self.read = read
+
+    def value(self) -> float:
+        try:
+            return self.read()
+        except Exception as e:
+            logger.warning(f"Не удалось прочитать {self.name}: {e}")
+            return 0
+
+    def _samples(self) -> List[str]:
+        return [f"{self.name} {self.value()}"]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, buckets: Sequence[float], labels: Sequence[str] = ()):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+        # метки -> (счётчики по корзинам + корзина +Inf, сумма)
+        self._series: Dict[Tuple[str, ...], Tuple[List[int], float]] = {}
+
+    def observe(self, value: float, *label_values: str) -> None:
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts, total = self._series.get(label_values) or ([0] * (len(self.buckets) + 1), 0.0)
+            counts[index] += 1
+            self._series[label_values] = (counts, total + value)
+
+    def series(self) -> Dict[Tuple[str, ...], Tuple[List[int], float]]:
+        with self._lock:
+            return {key: (list(counts), total) for key, (counts, total) in self._series.items()}
+
+    def quantile(self, q: float, *label_values: str) -> Optional[float]:
+        """Оценка квантиля сверху — граница корзины, в которую он попал"""
+        counts, _ = self.series().get(label_values, ([], 0.0))
+        count = sum(counts)
+        if not count:
+            return None
+        seen = 0
+        for bound, n in zip(self.buckets + (float("inf"),), counts):
+            seen += n
+            if seen >= q * count:
+                return bound
+        return float("inf")
+
+    def _samples(self) -> List[str]:
+        lines = []
+        for key, (counts, total) in sorted(self.series().items()):
+            cumulative = 0
+            for bound, n in zip(self.buckets + (float("inf"),), counts):
+                cumulative += n
+                le = "+Inf" if bound == float("inf") else f"{bound:g}"
+                labels = _labels_text(self.labels, key, 'le="' + le + '"')
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels_text(self.labels, key)} {total}")
+            lines.append(f"{self.name}_count{_labels_text(self.labels, key)} {cumulative}")
+        return lines
+
+
+# --- Метрики бота ---
+
+handler_seconds = Histogram("hskbot_handler_seconds", "Время обработки обновления", LATENCY_BUCKETS, ["handler"])
+handler_errors = Counter("hskbot_handler_errors_total", "Исключения в обработчиках", ["handler"])
+db_queries = Counter("hskbot_db_queries_total", "Запросы к БД")
+db_query_seconds = Histogram("hskbot_db_query_seconds", "Время запроса к БД", LATENCY_BUCKETS)
+db_queries_per_update = Histogram("hskbot_db_queries_per_update", "Запросов к БД на одно обновление", QUERY_BUCKETS)
+llm_seconds = Histogram("hskbot_llm_request_seconds", "Время запроса к GigaChat", LLM_BUCKETS, ["outcome"])
+llm_cache_hits = Counter("hskbot_llm_cache_hits_total", "Разборы письма, взятые из кэша")
+llm_tokens = Counter("hskbot_llm_tokens_total", "Токены GigaChat", ["kind"])
+llm_first_chunk_seconds = Histogram("hskbot_llm_first_chunk_seconds", "Время до первого фрагмента ответа GigaChat", LLM_BUCKETS)
+
+# Счётчик запросов текущего обновления; у каждого потока и задачи asyncio свой
+_update_queries: contextvars.ContextVar[Optional[List[int]]] = contextvars.ContextVar("update_queries", default=None)
+
+
+def gauge(name: str, help: str, read: Callable[[], float]) -> Gauge:
+    return Gauge(name, help, read)
+
+
+@contextmanager
+def track_update(handler: str):
+    """Замер обработки одного обновления: время, ошибки, число запросов к БД"""
+    queries = [0]
+    token = _update_queries.set(queries)
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        handler_errors.inc(handler)
+        raise
+    finally:
+        handler_seconds.observe(time.perf_counter() - start, handler)
+        db_queries_per_update.observe(queries[0])
+        _update_queries.reset(token)
+
+
+@contextmanager
+def track_llm():
+    """Замер запроса к GigaChat; исключение внутри блока считается ошибкой"""
+    start = time.perf_counter()
+    outcome = "error"
+    try:
+        yield
+        outcome = "ok"
+    finally:
+        llm_seconds.observe(time.perf_counter() - start, outcome)
+
+
+# --- Подключение к движку SQLAlchemy (db.py) ---
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    context._metrics_start = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    db_queries.inc()
+    start = getattr(context, "_metrics_start", None)
+    if start is not None:
+        db_query_seconds.observe(time.perf_counter() - start)
+    queries = _update_queries.get()
+    if queries is not None:
+        queries[0] += 1
+
+
+def instrument_engine(engine) -> None:
+    from sqlalchemy import event
+
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+
+
+# --- Вывод ---
+
+def render() -> str:
+    lines = []
+    for metric in list(_registry):
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+def _seconds(value: Optional[float]) -> str:
+    if value is None:
+        return "—"
+    if value == float("inf"):
+        return f"> {LATENCY_BUCKETS[-1]:g} с"
+    return f"≤ {value:g} с"
+
+
+def summary_text() -> str:
+    """Короткая сводка для команды /metrics"""
+    lines = ["📊 Метрики", "", "Обработчики (вызовов, p95, ошибок):"]
+    errors = handler_errors.values()
+    series = handler_seconds.series()
+    for (name,), (counts, _) in sorted(series.items(), key=lambda item: -sum(item[1][0])):
+        p95 = handler_seconds.quantile(0.95, name)
+        lines.append(f"• {name}: {sum(counts)}, {_seconds(p95)}, {int(errors.get((name,), 0))}")
+    if not series:
+        lines.append("• пока нет данных")
+
+    counts, total = db_queries_per_update.series().get((), ([], 0.0))
+    updates = sum(counts)
+    lines += [
+        "",
+        f"БД: запросов {int(db_queries.value())}, "
+        f"в среднем на обновление {total / updates if updates else 0:.2f}",
+    ]
+
+    llm = llm_seconds.series()
+    ok_counts, ok_total = llm.get(("ok",), ([], 0.0))
+    ok = sum(ok_counts)
+    failed = sum(llm.get(("error",), ([], 0.0))[0])
+    lines += [
+        f"GigaChat: запросов {ok + failed}, ошибок {failed}, "
+        f"среднее {ok_total / ok if ok else 0:.1f} с, из кэша {int(llm_cache_hits.value())}",
+        f"Токены: запрос {int(llm_tokens.value('prompt'))}, ответ {int(llm_tokens.value('completion'))}",
+    ]
+    for metric in _registry:
+        if isinstance(metric, Gauge):
+            lines.append(f"{metric.help}: {metric.value():g}")
+    return "\n".join(lines)
+
+
+def start_server(port: int = METRICS_PORT, host: str = METRICS_HOST) -> Optional[ThreadingHTTPServer]:
+    """HTTP-сервер для Prometheus в фоновом потоке; port=0 — не запускать"""
+    if not port:
+        return None
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = render().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            logger.debug(format % args)
+
+    httpd = ThreadingHTTPServer((host, port), Handler)
+    httpd.daemon_threads = True
+    threading.Thread(target=httpd.serve_forever, name="metrics-http", daemon=True).start()
+    logger.info(f"Метрики Prometheus: http://{host}:{port}/metrics")
+    return httpd
@@ -0,0 +1,159 @@
+# migrations.py — версионные изменения схемы существующей БД
+#
+# create_all() создаёт только отсутствующие таблицы и не трогает уже
+# существующие, поэтому индексы и ограничения для старой hsk.db добавляются
+# здесь. Номер последней применённой миграции хранится в schema_version,
+# каждая миграция выполняется в своей транзакции. Запуск — из db.init_db().
+import logging
+from typing import Callable, List, Tuple
+
+from sqlalchemy import text
+from sqlalchemy.engine import Connection, Engine
+
+logger = logging.getLogger(__name__)
+
+
+def _unique_task_numbers(conn: Connection) -> None:
+    """Уникальный индекс tasks(level_id, section_id, task_number); дубликаты удаляются"""
+    duplicates = conn.execute(text(
+        "SELECT level_id, section_id, task_number, MIN(id) FROM tasks"
+        " GROUP BY level_id, section_id, task_number HAVING COUNT(*) > 1"
+    )).fetchall()
+    for level_id, section_id, task_number, keep_id in duplicates:
+        # остаётся задание с меньшим id — его и показывал каталог; ответы переносим на него
+        params = {"level_id": level_id, "section_id": section_id, "task_number": task_number, "keep_id": keep_id}
+        same_number = (
+            "SELECT id FROM tasks WHERE level_id = :level_id AND section_id = :section_id"
+            " AND task_number = :task_number AND id != :keep_id"
+        )
+        conn.execute(text(f"UPDATE user_sessions SET task_id = :keep_id WHERE task_id IN ({same_number})"), params)
+        removed = conn.execute(text(f"DELETE FROM tasks WHERE id IN ({same_number})"), params).rowcount
+        logger.warning(
+            f"Удалено дубликатов задания №{task_number} (уровень {level_id}, раздел {section_id}): {removed}"
+        )
+
+    conn.execute(text(
+        "CREATE UNIQUE INDEX IF NOT EXISTS ux_tasks_level_section_number"
+        " ON tasks (level_id, section_id, task_number)"
+    ))
+
+
+def _user_sessions_indexes(conn: Connection) -> None:
+    """История пользователя по времени и статистика по заданию без полного прохода по таблице"""
+    conn.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_user_sessions_user_submitted"
+        " ON user_sessions (user_id, submitted_at)"
+    ))
+    conn.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_user_sessions_task_correct"
+        " ON user_sessions (task_id, is_correct)"
+    ))
+
+
+def _backfill_progress(conn: Connection) -> None:
+    """Агрегаты статистики (progress.py) по уже накопленной истории ответов"""
+    from progress import rebuild
+
+    logger.info(f"Агрегаты статистики заполнены: учеников {rebuild(conn)}")
+
+
+def _backfill_wrong_answers(conn: Connection) -> None:
+    """Частые неверные ответы по заданиям (difficulty.py) по уже накопленной истории"""
+    from difficulty import rebuild
+
+    logger.info(f"Частые неверные ответы посчитаны: заданий {rebuild(conn)}")
+
+
+def _compile_answers(conn: Connection) -> None:
+    """Ключи заданий — в спецификации проверки (grading.py)"""
+    from sqlalchemy import select, update
+
+    from grading import compile_answer
+    from models import Section, Task
+
+    rows = conn.execute(
+        select(Task.id, Section.name, Task.correct_answer).join(Section, Section.id == Task.section_id)
+    ).fetchall()
+    compiled = 0
+    for task_id, section_name, answer in rows:
+        if answer is None or isinstance(answer, dict):
+            continue
+        conn.execute(update(Task).where(Task.id == task_id).values(
+            correct_answer=compile_answer(section_name, answer)
+        ))
+        compiled += 1
+    logger.info(f"Ключи заданий разобраны: {compiled}")
+
+
+def _refold_wrong_answers(conn: Connection) -> None:
+    """Пересчитать частые неверные ответы с нормализацией, как в проверке ответов"""
+    from difficulty import rebuild
+
+    logger.info(f"Частые неверные ответы пересчитаны: заданий {rebuild(conn)}")
+
+
+def _recompile_cyrillic_choices(conn: Connection) -> None:
+    """Русские слова из похожих на варианты букв («все») — не варианты: разобрать ключи заново"""
+    from sqlalchemy import select, update
+
+    from difficulty import rebuild
+    from grading import compile_answer
+    from models import Section, Task
+
+    rows = conn.execute(
+        select(Task.id, Section.name, Task.correct_answer).join(Section, Section.id == Task.section_id)
+    ).fetchall()
+    recompiled = 0
+    for task_id, section_name, spec in rows:
+        if not isinstance(spec, dict) or spec.get("kind") != "choices":
+            continue
+        compiled = compile_answer(section_name, spec["answer"])
+        if compiled != spec:
+            conn.execute(update(Task).where(Task.id == task_id).values(correct_answer=compiled))
+            recompiled += 1
+    logger.info(f"Ключи из русских слов разобраны заново: {recompiled}")
+    if recompiled:
+        # частые неверные ответы этих заданий нормализованы как варианты
+        rebuild(conn)
+
+
+def _refold_sets_and_case(conn: Connection) -> None:
+    """Наборы вариантов — без учёта порядка, точные ответы — с учётом регистра, как в проверке"""
+    from difficulty import rebuild
+
+    logger.info(f"Частые неверные ответы пересчитаны: заданий {rebuild(conn)}")
+
+
+# (версия, описание, функция) — только добавлять в конец, не менять применённые
+MIGRATIONS: List[Tuple[int, str, Callable[[Connection], None]]] = [
+    (1, "уникальный номер задания в разделе", _unique_task_numbers),
+    (2, "индексы user_sessions", _user_sessions_indexes),
+    (3, "агрегаты статистики учеников", _backfill_progress),
+    (4, "частые неверные ответы по заданиям", _backfill_wrong_answers),
+    (5, "спецификации проверки ответов", _compile_answers),
+    (6, "нормализация частых неверных ответов", _refold_wrong_answers),
+    (7, "ключи из русских слов — не варианты", _recompile_cyrillic_choices),
+    (8, "частые неверные ответы: наборы и регистр как в проверке", _refold_sets_and_case),
+]
+
+
+def current_version(conn: Connection) -> int:
+    conn.execute(text("CREATE TABLE IF NOT EXISTS schema_version (version INTEGER NOT NULL)"))
+    return conn.execute(text("SELECT MAX(version) FROM schema_version")).scalar() or 0
+
+
+def run_migrations(engine: Engine) -> int:
+    """Применить недостающие миграции; возвращает итоговую версию схемы"""
+    with engine.begin() as conn:
+        version = current_version(conn)
+
+    for number, description, migrate in MIGRATIONS:
+        if number <= version:
+            continue
+        with engine.begin() as conn:
+            migrate(conn)
+            conn.execute(text("INSERT INTO schema_version (version) VALUES (:version)"), {"version": number})
+        version = number
+        logger.info(f"Миграция {number} применена: {description}")
+
+    return version
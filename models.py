@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, ForeignKey, DateTime, Boolean, Text
+from sqlalchemy import Column, Integer, String, ForeignKey, Date, DateTime, Boolean, Text, Index
 from sqlalchemy.orm import declarative_base, relationship
 from datetime import datetime
 from sqlalchemy import JSON
@@ -32,6 +32,11 @@ class Task(Base):
     level = relationship("ExamLevel")
     section = relationship("Section")
 
+    # те же индексы для существующих БД создаёт migrations.py
+    __table_args__ = (
+        Index("ux_tasks_level_section_number", "level_id", "section_id", "task_number", unique=True),
+    )
+
 # Optional: for analytics
 class UserSession(Base):
     __tablename__ = 'user_sessions'
@@ -42,4 +47,72 @@ class UserSession(Base):
     is_correct = Column(Boolean, nullable=True)  # null for writing
     submitted_at = Column(DateTime, default=datetime.utcnow)
 
-    task = relationship("Task")
\ No newline at end of file
+    task = relationship("Task")
+
+    __table_args__ = (
+        Index("ix_user_sessions_user_submitted", "user_id", "submitted_at"),
+        Index("ix_user_sessions_task_correct", "task_id", "is_correct"),
+    )
+
+# Агрегаты по ответам: обновляются вместе с записью user_sessions (см. progress.py)
+class UserProgress(Base):
+    __tablename__ = 'user_progress'
+    user_id = Column(Integer, primary_key=True)
+    attempts = Column(Integer, nullable=False, default=0)
+    graded = Column(Integer, nullable=False, default=0)  # ответы с автопроверкой (без письма)
+    correct = Column(Integer, nullable=False, default=0)
+    current_streak = Column(Integer, nullable=False, default=0)  # дней подряд с ответами
+    best_streak = Column(Integer, nullable=False, default=0)
+    last_active_on = Column(Date, nullable=True)
+
+class UserSectionStats(Base):
+    __tablename__ = 'user_section_stats'
+    user_id = Column(Integer, primary_key=True)
+    level_id = Column(Integer, primary_key=True)
+    section_id = Column(Integer, primary_key=True)
+    attempts = Column(Integer, nullable=False, default=0)
+    graded = Column(Integer, nullable=False, default=0)
+    correct = Column(Integer, nullable=False, default=0)
+
+class TaskStats(Base):
+    __tablename__ = 'task_stats'
+    task_id = Column(Integer, ForeignKey('tasks.id'), primary_key=True)
+    attempts = Column(Integer, nullable=False, default=0)
+    graded = Column(Integer, nullable=False, default=0)
+    correct = Column(Integer, nullable=False, default=0)
+
+# Частые неверные ответы по заданию: Space-Saving, не больше DIFFICULTY_TOP_K строк на задание
+class TaskWrongAnswer(Base):
+    __tablename__ = 'task_wrong_answers'
+    task_id = Column(Integer, ForeignKey('tasks.id'), primary_key=True)
+    answer = Column(String(64), primary_key=True)
+    count = Column(Integer, nullable=False)  # оценка сверху
+    error = Column(Integer, nullable=False, default=0)  # на сколько count может быть завышен
+
+# Кэш ответов LLM по письменным заданиям (см. feedback_cache.py)
+class FeedbackCacheEntry(Base):
+    __tablename__ = 'llm_feedback_cache'
+    key = Column(String(64), primary_key=True)  # sha256 от (уровень, задание, нормализованный текст)
+    feedback = Column(Text, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    last_used_at = Column(DateTime, default=datetime.utcnow, nullable=False, index=True)
+
+# Рассылки админа и место, до которого дошли (см. broadcast.py)
+class Broadcast(Base):
+    __tablename__ = 'broadcasts'
+    id = Column(Integer, primary_key=True)
+    text = Column(Text, nullable=False)
+    created_by = Column(Integer, nullable=False)
+    status = Column(String(20), nullable=False, default="running")  # running, done, cancelled
+    last_user_id = Column(Integer, nullable=False, default=0)  # все получатели с user_id <= уже обработаны
+    delivered = Column(Integer, nullable=False, default=0)
+    blocked = Column(Integer, nullable=False, default=0)
+    failed = Column(Integer, nullable=False, default=0)
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    finished_at = Column(DateTime, nullable=True)
+
+# Пользователи, заблокировавшие бота: рассылка их пропускает, пока они не вернутся
+class BlockedUser(Base):
+    __tablename__ = 'blocked_users'
+    user_id = Column(Integer, primary_key=True)
+    blocked_at = Column(DateTime, default=datetime.utcnow, nullable=False)
\ No newline at end of file
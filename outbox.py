@@ -0,0 +1,360 @@
+# outbox.py — очередь исходящих сообщений с лимитами Telegram
+#
+# Обработчики не ждут ответа Bot API: send_message/send_photo/send_audio
+# ставят запрос в очередь и сразу возвращают Future с итоговым Message.
+# Очередь разбирают OUTBOX_WORKERS потоков:
+#   - общий лимит OUTBOX_GLOBAL_RATE сообщений в секунду на бота и лимит
+#     OUTBOX_CHAT_RATE на чат (с запасом OUTBOX_CHAT_BURST подряд: короткие
+#     серии в личный чат Telegram допускает, а один шаг ученика — это до
+#     пяти сообщений: ответ, «Что делаем дальше?», фото, аудио и текст);
+#   - сообщения одного чата уходят строго по порядку;
+#   - соседние текстовые сообщения одному чату, ещё не отправленные,
+#     склеиваются в одно (клавиатура остаётся только у последнего);
+#   - из нескольких ещё не отправленных правок одного сообщения уходит
+#     только последняя;
+#   - на 429 чат ждёт retry_after из ответа, сетевые ошибки и 5xx
+#     повторяются с нарастающей паузой до OUTBOX_MAX_RETRIES раз.
+import heapq
+import itertools
+import logging
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+from telebot import TeleBot
+from telebot.apihelper import ApiTelegramException
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+OUTBOX_WORKERS = int(os.getenv("OUTBOX_WORKERS", "4"))
+OUTBOX_GLOBAL_RATE = float(os.getenv("OUTBOX_GLOBAL_RATE", "30"))
+OUTBOX_CHAT_RATE = float(os.getenv("OUTBOX_CHAT_RATE", "1"))
+OUTBOX_CHAT_BURST = int(os.getenv("OUTBOX_CHAT_BURST", "6"))
+OUTBOX_MAX_RETRIES = int(os.getenv("OUTBOX_MAX_RETRIES", "3"))
+# Сколько ждать следующего текста тому же чату, прежде чем отправить текст без склейки
+OUTBOX_COALESCE_MS = int(os.getenv("OUTBOX_COALESCE_MS", "20"))
+
+# Предел длины текста сообщения в Bot API
+_MAX_TEXT = 4096
+_MAX_RETRY_DELAY = 30.0
+# Символы, которые в Markdown что-то значат: без них текст выглядит одинаково с parse_mode и без
+_MARKDOWN_CHARS = set("*_`[")
+# Сколько чатов держать, прежде чем убирать простаивающие
+_PRUNE_CHATS = 1000
+
+sent_total = metrics.Counter("hskbot_outbox_sent_total", "Запросов к Bot API из очереди исходящих", ["method"])
+coalesced_total = metrics.Counter("hskbot_outbox_coalesced_total", "Текстов, склеенных с соседним сообщением")
+retries_total = metrics.Counter("hskbot_outbox_retries_total", "Повторы отправки", ["reason"])
+failed_total = metrics.Counter("hskbot_outbox_failed_total", "Сообщения, которые не удалось отправить", ["method"])
+
+
+class _Bucket:
+    """Token bucket: rate запросов в секунду, до burst подряд"""
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def full(self, now: float) -> bool:
+        return self.tokens + (now - self.updated) * self.rate >= self.burst
+
+    def wait_time(self, now: float) -> float:
+        """Через сколько секунд появится токен (0 — уже есть)"""
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self) -> None:
+        self.tokens -= 1
+
+
+class _Request:
+    __slots__ = ("method", "chat_id", "args", "kwargs", "mergeable", "futures", "attempts", "created")
+
+    def __init__(self, method: str, chat_id: Any, args: tuple, kwargs: Dict[str, Any], mergeable: bool = True):
+        self.method = method
+        self.chat_id = chat_id
+        self.args = args
+        self.kwargs = kwargs
+        self.mergeable = mergeable
+        self.futures: List[Future] = [Future()]
+        self.attempts = 0
+        self.created = time.monotonic()
+
+    # --- Склейка текстов ---
+
+    def text(self) -> str:
+        return self.args[0]
+
+    def _parse_mode(self) -> Optional[str]:
+        mode = self.kwargs.get("parse_mode")
+        # текст без разметки можно считать Markdown-текстом — он не изменится
+        if mode is None and not _MARKDOWN_CHARS & set(self.text()):
+            return "Markdown"
+        return mode
+
+    def can_merge(self, other: "_Request") -> bool:
+        if not (self.mergeable and other.mergeable):
+            return False
+        if self.method == other.method == "edit_message_text":
+            # новая правка того же сообщения заменяет старую
+            return self.kwargs.get("message_id") == other.kwargs.get("message_id")
+        if self.method != "send_message" or other.method != "send_message":
+            return False
+        if self.kwargs.get("reply_markup") is not None:
+            return False
+        mine = {k: v for k, v in self.kwargs.items() if k not in ("parse_mode", "reply_markup")}
+        theirs = {k: v for k, v in other.kwargs.items() if k not in ("parse_mode", "reply_markup")}
+        return (
+            mine == theirs
+            and self._parse_mode() == other._parse_mode()
+            and len(self.text()) + 2 + len(other.text()) <= _MAX_TEXT
+        )
+
+    def merge(self, other: "_Request") -> None:
+        if self.method == "edit_message_text":
+            self.args, self.kwargs = other.args, other.kwargs
+            self.futures.extend(other.futures)
+            return
+        parse_mode = self._parse_mode() if self.kwargs.get("parse_mode") or other.kwargs.get("parse_mode") else None
+        self.args = (self.text() + "\n\n" + other.text(),) + self.args[1:]
+        self.kwargs = dict(other.kwargs, parse_mode=parse_mode)
+        self.futures.extend(other.futures)
+
+
+class _Chat:
+    __slots__ = ("requests", "bucket", "busy", "scheduled")
+
+    def __init__(self, rate: float, burst: float):
+        self.requests: Deque[_Request] = deque()
+        self.bucket = _Bucket(rate, burst)
+        self.busy = False
+        self.scheduled = False
+
+
+class Outbox:
+    def __init__(self, workers: int, global_rate: float, chat_rate: float, chat_burst: int,
+                 max_retries: int, coalesce_ms: int):
+        self.workers = workers
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_retries = max_retries
+        self.coalesce = coalesce_ms / 1000
+
+        self.bot: Optional[TeleBot] = None
+        self._global = _Bucket(global_rate, global_rate)
+        self._chats: Dict[Any, _Chat] = {}
+        # (когда чат можно обслужить, порядковый номер, chat_id)
+        self._ready: List[Tuple[float, int, Any]] = []
+        self._seq = itertools.count()
+        self._pending = 0
+        self._cond = threading.Condition()
+        self._threads: List[threading.Thread] = []
+        self._stopped = False
+
+    def bind(self, bot: TeleBot) -> "Outbox":
+        self.bot = bot
+        return self
+
+    # --- Постановка в очередь ---
+
+    def send_message(self, chat_id, text: str, **kwargs) -> Future:
+        return self.call("send_message", chat_id, text, **kwargs)
+
+    def send_photo(self, chat_id, photo, **kwargs) -> Future:
+        return self.call("send_photo", chat_id, photo, **kwargs)
+
+    def send_audio(self, chat_id, audio, **kwargs) -> Future:
+        return self.call("send_audio", chat_id, audio, **kwargs)
+
+    def edit_message_text(self, text: str, chat_id, message_id: int, **kwargs) -> Future:
+        # chat_id — первый аргумент для очереди, порядок аргументов TeleBot восстанавливается в _send
+        return self.call("edit_message_text", chat_id, text, message_id=message_id, **kwargs)
+
+    def call(self, method: str, chat_id, *args, merge: bool = True, **kwargs) -> Future:
+        """
+        Поставить вызов bot.<method>(chat_id, *args, **kwargs) в очередь чата.
+        merge=False — не склеивать с соседними (сообщение потом будут править)
+        """
+        request = _Request(method, chat_id, args, kwargs, merge)
+        with self._cond:
+            if not self._threads:
+                self._start()
+            chat = self._chats.get(chat_id)
+            if chat is None:
+                chat = self._chats[chat_id] = _Chat(self.chat_rate, self.chat_burst)
+
+            # первый запрос занятого чата уже отправляется — к нему не клеим
+            mergeable = len(chat.requests) > (1 if chat.busy else 0)
+            if mergeable and chat.requests[-1].can_merge(request):
+                chat.requests[-1].merge(request)
+                coalesced_total.inc()
+            else:
+                chat.requests.append(request)
+                self._pending += 1
+                # одиночный текст чуть ждёт: вдруг обработчик пришлёт следующий
+                delay = self.coalesce if method == "send_message" else 0.0
+                self._schedule(chat_id, chat, time.monotonic() + delay)
+        return request.futures[0]
+
+    def depth(self) -> int:
+        """Запросов в очереди, ещё не отправленных"""
+        with self._cond:
+            return self._pending
+
+    # --- Разбор очереди ---
+
+    def _start(self) -> None:
+        for i in range(self.workers):
+            t = threading.Thread(target=self._worker, name=f"outbox-{i}", daemon=True)
+            t.start()
+            self._threads.append(t)
+        logger.info(f"Очередь исходящих сообщений запущена: {self.workers} потоков.")
+
+    def _schedule(self, chat_id, chat: _Chat, at: float) -> None:
+        # вызывается под self._cond
+        if chat.scheduled or chat.busy or not chat.requests:
+            return
+        chat.scheduled = True
+        heapq.heappush(self._ready, (at, next(self._seq), chat_id))
+        self._cond.notify()
+
+    def _next(self) -> Optional[Tuple[Any, _Chat, _Request]]:
+        """Дождаться чата, которому можно отправить, и забрать его первый запрос"""
+        with self._cond:
+            while True:
+                if self._stopped and not self._ready:
+                    return None
+                now = time.monotonic()
+                if not self._ready:
+                    self._cond.wait()
+                    continue
+                at, _, chat_id = self._ready[0]
+                if at > now:
+                    self._cond.wait(at - now)
+                    continue
+
+                chat = self._chats[chat_id]
+                chat_wait = chat.bucket.wait_time(now)
+                if chat_wait:
+                    heapq.heapreplace(self._ready, (now + chat_wait, next(self._seq), chat_id))
+                    continue
+                global_wait = self._global.wait_time(now)
+                if global_wait:
+                    self._cond.wait(global_wait)
+                    continue
+
+                heapq.heappop(self._ready)
+                chat.scheduled = False
+                chat.busy = True
+                chat.bucket.take()
+                self._global.take()
+                return chat_id, chat, chat.requests[0]
+
+    def _worker(self) -> None:
+        while True:
+            item = self._next()
+            if item is None:
+                return
+            chat_id, chat, request = item
+            delay = self._send(request)
+            with self._cond:
+                chat.busy = False
+                if delay is None:
+                    chat.requests.popleft()
+                    self._pending -= 1
+                self._schedule(chat_id, chat, time.monotonic() + (delay or 0.0))
+                if len(self._chats) > _PRUNE_CHATS:
+                    self._prune()
+                self._cond.notify_all()
+
+    def _prune(self) -> None:
+        # пустые чаты с полным запасом токенов ничего не помнят — их можно забыть
+        now = time.monotonic()
+        for chat_id in [chat_id for chat_id, chat in self._chats.items()
+                        if not chat.requests and not chat.busy and chat.bucket.full(now)]:
+            del self._chats[chat_id]
+
+    def _send(self, request: _Request) -> Optional[float]:
+        """Выполнить запрос. None — готово (успех или окончательная ошибка), иначе пауза до повтора"""
+        method = getattr(self.bot, request.method)
+        try:
+            if request.method == "edit_message_text":
+                result = method(request.args[0], request.chat_id, *request.args[1:], **request.kwargs)
+            else:
+                result = method(request.chat_id, *request.args, **request.kwargs)
+        except ApiTelegramException as e:
+            if e.error_code != 400 or "message is not modified" not in e.description:
+                return self._failed(request, e)
+            # правка с тем же текстом — сообщение уже такое, как нужно
+            result = None
+        except Exception as e:
+            return self._failed(request, e)
+
+        sent_total.inc(request.method)
+        for future in request.futures:
+            future.set_result(result)
+        return None
+
+    def _failed(self, request: _Request, error: Exception) -> Optional[float]:
+        delay, reason = self._retry_delay(request, error)
+        if delay is not None:
+            retries_total.inc(reason)
+            logger.warning(f"{request.method} в чат {request.chat_id}: {error}; повтор через {delay:.1f} с")
+            return delay
+        failed_total.inc(request.method)
+        logger.error(f"Не удалось выполнить {request.method} в чат {request.chat_id}: {error}")
+        for future in request.futures:
+            future.set_exception(error)
+        return None
+
+    def _retry_delay(self, request: _Request, error: Exception) -> Tuple[Optional[float], str]:
+        request.attempts += 1
+        if isinstance(error, ApiTelegramException):
+            if error.error_code == 429:
+                # retry_after — требование Telegram, в число попыток не входит
+                request.attempts -= 1
+                parameters = error.result_json.get("parameters") or {}
+                return float(parameters.get("retry_after", 1)), "429"
+            if error.error_code == 400 and "can't parse entities" in error.description and request.kwargs.get("parse_mode"):
+                # разметка из LLM или склейки не разобралась — отправляем тот же текст без неё
+                request.kwargs["parse_mode"] = None
+                return 0.0, "markup"
+            if error.error_code < 500:
+                # 400/403: неверный запрос или бот заблокирован — повтор не поможет
+                return None, ""
+        if request.attempts > self.max_retries:
+            return None, ""
+        return min(2.0 ** (request.attempts - 1), _MAX_RETRY_DELAY), "error"
+
+    def flush(self, timeout: float = 10) -> bool:
+        """Дождаться отправки всего, что в очереди. False — не успели за timeout"""
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while self._pending:
+                left = deadline - time.monotonic()
+                if left <= 0:
+                    return False
+                self._cond.wait(left)
+        return True
+
+    def shutdown(self, timeout: float = 10) -> None:
+        """Отправить оставшееся и остановить потоки"""
+        if not self.flush(timeout):
+            logger.error(f"При остановке не отправлено сообщений: {self.depth()}")
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+
+
+outbox = Outbox(OUTBOX_WORKERS, OUTBOX_GLOBAL_RATE, OUTBOX_CHAT_RATE, OUTBOX_CHAT_BURST,
+                OUTBOX_MAX_RETRIES, OUTBOX_COALESCE_MS)
+
+metrics.gauge("hskbot_outbox_depth", "Исходящих сообщений в очереди", outbox.depth)
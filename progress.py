@@ -0,0 +1,240 @@
+# progress.py — статистика учеников по агрегатным таблицам
+#
+# Считать /progress по user_sessions — значит проходить всю историю ученика
+# на каждый запрос. Вместо этого answer_recorder в той же транзакции, что и
+# запись пачки ответов, вызывает apply(): он прибавляет счётчики в
+# user_progress (итоги и серия дней), user_section_stats (по уровню и
+# разделу) и task_stats (по заданию). /progress — один запрос по первичному
+# ключу: строка user_progress и не больше 15 строк user_section_stats.
+#
+# Уже накопленная история переносится в агрегаты миграцией 3 (rebuild()).
+# Пересчитать вручную, при остановленном боте:
+#   python progress.py --rebuild
+import itertools
+import logging
+import os
+from collections import defaultdict
+from datetime import date, datetime, timedelta, timezone
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Set, Tuple
+from zoneinfo import ZoneInfo
+
+from sqlalchemy import delete, select, text
+from sqlalchemy.engine import Connection
+from sqlalchemy.orm import Session
+
+import reference
+from db import SessionLocal, upsert_add
+from models import Task, TaskStats, UserProgress, UserSectionStats, UserSession
+
+logger = logging.getLogger(__name__)
+
+# Граница суток для серии — полночь по этому часовому поясу
+PROGRESS_TIMEZONE = ZoneInfo(os.getenv("PROGRESS_TIMEZONE", "Europe/Moscow"))
+
+COUNTERS = ["attempts", "graded", "correct"]
+
+_ONE_DAY = timedelta(days=1)
+
+
+def local_day(moment: datetime) -> date:
+    """День ответа; submitted_at хранится в UTC без часового пояса"""
+    return moment.replace(tzinfo=timezone.utc).astimezone(PROGRESS_TIMEZONE).date()
+
+
+def advance_streak(current: int, best: int, last_day: Optional[date],
+                   days: Iterable[date]) -> Tuple[int, int, Optional[date]]:
+    """Продлить серию дней подряд новыми днями с ответами"""
+    for day in sorted(days):
+        if last_day is not None and day <= last_day:
+            continue
+        current = current + 1 if last_day is not None and day == last_day + _ONE_DAY else 1
+        best = max(best, current)
+        last_day = day
+    return current, best, last_day
+
+
+def _counts(is_correct: Optional[bool]) -> Tuple[int, int, int]:
+    return 1, int(is_correct is not None), int(bool(is_correct))
+
+
+def _add(total: List[int], counts: Tuple[int, int, int]) -> None:
+    for i, value in enumerate(counts):
+        total[i] += value
+
+
+# --- Обновление агрегатов ---
+
+def apply(db: Session, rows: Sequence[Dict[str, Any]]) -> None:
+    """Учесть пачку новых ответов (строки user_sessions); commit — на вызывающем"""
+    if not rows:
+        return
+
+    task_ids = {row["task_id"] for row in rows}
+    places = {
+        task_id: (level_id, section_id)
+        for task_id, level_id, section_id in db.execute(
+            select(Task.id, Task.level_id, Task.section_id).where(Task.id.in_(task_ids))
+        )
+    }
+
+    tasks: Dict[int, List[int]] = defaultdict(lambda: [0, 0, 0])
+    sections: Dict[Tuple[int, int, int], List[int]] = defaultdict(lambda: [0, 0, 0])
+    users: Dict[int, List[int]] = defaultdict(lambda: [0, 0, 0])
+    days: Dict[int, Set[date]] = defaultdict(set)
+    for row in rows:
+        counts = _counts(row["is_correct"])
+        _add(users[row["user_id"]], counts)
+        days[row["user_id"]].add(local_day(row["submitted_at"]))
+        place = places.get(row["task_id"])
+        if place:
+            _add(tasks[row["task_id"]], counts)
+            _add(sections[(row["user_id"],) + place], counts)
+
+    upsert_add(db, TaskStats, [
+        dict(zip(["task_id"] + COUNTERS, [task_id] + total)) for task_id, total in tasks.items()
+    ], ["task_id"], COUNTERS)
+    upsert_add(db, UserSectionStats, [
+        dict(zip(["user_id", "level_id", "section_id"] + COUNTERS, list(key) + total))
+        for key, total in sections.items()
+    ], ["user_id", "level_id", "section_id"], COUNTERS)
+
+    # серия зависит от прошлого дня — читаем её в этой же транзакции
+    streaks = {
+        user_id: (current, best, last_day)
+        for user_id, current, best, last_day in db.execute(
+            select(UserProgress.user_id, UserProgress.current_streak, UserProgress.best_streak,
+                   UserProgress.last_active_on).where(UserProgress.user_id.in_(users))
+        )
+    }
+    progress_rows = []
+    for user_id, total in users.items():
+        current, best, last_day = advance_streak(*streaks.get(user_id, (0, 0, None)), days[user_id])
+        progress_rows.append({
+            "user_id": user_id,
+            "attempts": total[0],
+            "graded": total[1],
+            "correct": total[2],
+            "current_streak": current,
+            "best_streak": best,
+            "last_active_on": last_day,
+        })
+    upsert_add(db, UserProgress, progress_rows, ["user_id"], COUNTERS,
+               update_columns=["current_streak", "best_streak", "last_active_on"])
+
+
+def rebuild(conn: Connection) -> int:
+    """Пересчитать агрегаты по всей user_sessions; возвращает число учеников"""
+    for model in (TaskStats, UserSectionStats, UserProgress):
+        conn.execute(delete(model))
+
+    correct = "SUM(CASE WHEN s.is_correct THEN 1 ELSE 0 END)"
+    conn.execute(text(
+        "INSERT INTO task_stats (task_id, attempts, graded, correct)"
+        f" SELECT s.task_id, COUNT(*), COUNT(s.is_correct), {correct}"
+        " FROM user_sessions s JOIN tasks t ON t.id = s.task_id GROUP BY s.task_id"
+    ))
+    conn.execute(text(
+        "INSERT INTO user_section_stats (user_id, level_id, section_id, attempts, graded, correct)"
+        f" SELECT s.user_id, t.level_id, t.section_id, COUNT(*), COUNT(s.is_correct), {correct}"
+        " FROM user_sessions s JOIN tasks t ON t.id = s.task_id"
+        " GROUP BY s.user_id, t.level_id, t.section_id"
+    ))
+
+    # итоги и серии — одним проходом по истории в порядке индекса (user_id, submitted_at)
+    history = conn.execution_options(stream_results=True, yield_per=10000).execute(
+        select(UserSession.user_id, UserSession.submitted_at, UserSession.is_correct)
+        .order_by(UserSession.user_id, UserSession.submitted_at)
+    )
+    progress_rows = []
+    for user_id, answers in itertools.groupby(history, key=lambda row: row.user_id):
+        total = [0, 0, 0]
+        days = set()
+        for answer in answers:
+            _add(total, _counts(answer.is_correct))
+            if answer.submitted_at is not None:
+                days.add(local_day(answer.submitted_at))
+        current, best, last_day = advance_streak(0, 0, None, days)
+        progress_rows.append({
+            "user_id": user_id,
+            "attempts": total[0],
+            "graded": total[1],
+            "correct": total[2],
+            "current_streak": current,
+            "best_streak": best,
+            "last_active_on": last_day,
+        })
+
+    for start in range(0, len(progress_rows), 1000):
+        conn.execute(UserProgress.__table__.insert(), progress_rows[start:start + 1000])
+    return len(progress_rows)
+
+
+# --- Чтение ---
+
+def query(user_id: int):
+    """Всё для /progress одним запросом по первичным ключам"""
+    return (
+        select(UserProgress, UserSectionStats)
+        .outerjoin(UserSectionStats, UserSectionStats.user_id == UserProgress.user_id)
+        .where(UserProgress.user_id == user_id)
+        .order_by(UserSectionStats.level_id, UserSectionStats.section_id)
+    )
+
+
+def _percent(correct: int, graded: int) -> str:
+    return f"{round(correct * 100 / graded)}%"
+
+
+def progress_text(rows: Sequence[Tuple[UserProgress, Optional[UserSectionStats]]],
+                  today: Optional[date] = None) -> str:
+    if not rows:
+        return "📊 Вы ещё не ответили ни на одно задание. Начните с /start"
+
+    total = rows[0][0]
+    today = today or local_day(datetime.utcnow())
+    # серия прервана, если вчера и сегодня ответов не было
+    streak = total.current_streak if total.last_active_on and total.last_active_on >= today - _ONE_DAY else 0
+
+    lines = ["📊 Ваш прогресс", "", f"Ответов: {total.attempts}"]
+    if total.graded:
+        lines.append(f"Верных: {total.correct} из {total.graded} ({_percent(total.correct, total.graded)})")
+    lines.append(f"🔥 Серия: {streak} дн. подряд, рекорд — {total.best_streak}")
+
+    level_id = None
+    for _, stats in rows:
+        if stats is None:
+            continue
+        if stats.level_id != level_id:
+            level_id = stats.level_id
+            lines += ["", reference.level_name(level_id) or f"Уровень {level_id}"]
+        section = reference.section_name(stats.section_id) or f"Раздел {stats.section_id}"
+        if stats.graded:
+            lines.append(f"• {section}: {stats.attempts} отв., верно {_percent(stats.correct, stats.graded)}")
+        else:
+            lines.append(f"• {section}: {stats.attempts} отв.")
+    return "\n".join(lines)
+
+
+def get_progress_text(user_id: int) -> str:
+    db = SessionLocal()
+    try:
+        return progress_text(db.execute(query(user_id)).all())
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    from db import engine
+
+    parser = argparse.ArgumentParser(description="Агрегаты статистики учеников")
+    parser.add_argument("--rebuild", action="store_true", help="пересчитать по всей истории (бот должен быть остановлен)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    if args.rebuild:
+        with engine.begin() as conn:
+            logger.info(f"Агрегаты пересчитаны: учеников {rebuild(conn)}")
+    else:
+        parser.print_help()
@@ -0,0 +1,82 @@
+# reference.py — справочник уровней и разделов
+#
+# Пять уровней и три раздела фиксированы и создаются init_reference_data()
+# при запуске. Справочник загружается один раз и дальше отвечает на запросы
+# «имя → id» и «id → имя» без обращений к БД.
+import logging
+from typing import Dict, List, Optional
+
+from db import SessionLocal, insert_ignore
+from models import ExamLevel, Section
+
+logger = logging.getLogger(__name__)
+
+LEVEL_NAMES: List[str] = [f"HSK {i}" for i in range(1, 6)]
+SECTION_NAMES: List[str] = ["Аудирование", "Чтение", "Письмо"]
+
+_level_ids: Dict[str, int] = {}
+_level_names: Dict[int, str] = {}
+_section_ids: Dict[str, int] = {}
+_section_names: Dict[int, str] = {}
+_loaded = False
+
+
+def init_reference_data() -> None:
+    """Создать недостающие уровни и разделы и загрузить справочник"""
+    db = SessionLocal()
+    try:
+        # один INSERT ... ON CONFLICT DO NOTHING на таблицу вместо SELECT на каждую запись
+        insert_ignore(db, ExamLevel, [{"name": name} for name in LEVEL_NAMES], ["name"])
+        insert_ignore(db, Section, [{"name": name} for name in SECTION_NAMES], ["name"])
+        db.commit()
+        logger.info("Справочные данные инициализированы.")
+    finally:
+        db.close()
+
+    load()
+
+
+def load() -> None:
+    """Загрузить справочник из БД (вызывается после init_reference_data)"""
+    global _level_ids, _level_names, _section_ids, _section_names, _loaded
+    db = SessionLocal()
+    try:
+        levels = db.query(ExamLevel.id, ExamLevel.name).all()
+        sections = db.query(Section.id, Section.name).all()
+    finally:
+        db.close()
+
+    # новые словари подменяются целиком — читатели не видят частично заполненных
+    _level_ids = {name: id_ for id_, name in levels}
+    _level_names = {id_: name for id_, name in levels}
+    _section_ids = {name: id_ for id_, name in sections}
+    _section_names = {id_: name for id_, name in sections}
+    _loaded = True
+
+    logger.info(f"Справочник загружен: {len(levels)} уровней, {len(sections)} разделов.")
+
+
+def _ensure_loaded() -> None:
+    # на случай использования без main.py (скрипты, бенчмарки)
+    if not _loaded:
+        load()
+
+
+def level_id(name: str) -> Optional[int]:
+    _ensure_loaded()
+    return _level_ids.get(name)
+
+
+def level_name(level_id_: int) -> Optional[str]:
+    _ensure_loaded()
+    return _level_names.get(level_id_)
+
+
+def section_id(name: str) -> Optional[int]:
+    _ensure_loaded()
+    return _section_ids.get(name)
+
+
+def section_name(section_id_: int) -> Optional[str]:
+    _ensure_loaded()
+    return _section_names.get(section_id_)
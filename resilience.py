@@ -0,0 +1,208 @@
+# resilience.py — защита бота от медленного или недоступного GigaChat
+#
+# Каждый разбор письма получает общий бюджет времени LLM_DEADLINE секунд.
+# Временные ошибки (таймаут, обрыв соединения, 429, 5xx) повторяются до
+# LLM_RETRIES раз с паузой «full jitter» — случайной от 0 до удвоенной
+# предыдущей, чтобы повторы разных работ не приходили одной волной, — и
+# только пока укладываются в бюджет. Синхронную попытку извне не прервать
+# (клиент ограничен своим таймаутом LLM_TIMEOUT), поэтому в синхронном
+# call() повтор начинается, только если на целую попытку бюджета хватает.
+#
+# Предохранитель (circuit breaker) размыкается после LLM_BREAKER_FAILURES
+# временных ошибок подряд; ответы 4xx и ошибки нашего кода (колбэков
+# потока, метрик) о здоровье GigaChat не говорят и не считаются. Дальше
+# вызовы сразу получают LLMUnavailable, а потоки проверки не ждут таймаутов. Через LLM_BREAKER_RESET секунд один
+# пробный вызов проверяет сервис: успех замыкает предохранитель, неудача
+# снова размыкает. Работы, отложенные, пока он разомкнут, очередь проверки
+# (writing_queue.py) запускает заново при замыкании.
+import asyncio
+import logging
+import os
+import random
+import threading
+import time
+from typing import Awaitable, Callable, List, TypeVar
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+LLM_DEADLINE = float(os.getenv("LLM_DEADLINE", "90"))
+LLM_RETRIES = int(os.getenv("LLM_RETRIES", "2"))
+LLM_RETRY_BASE = float(os.getenv("LLM_RETRY_BASE", "1"))
+LLM_RETRY_MAX = float(os.getenv("LLM_RETRY_MAX", "10"))
+LLM_BREAKER_FAILURES = int(os.getenv("LLM_BREAKER_FAILURES", "5"))
+LLM_BREAKER_RESET = float(os.getenv("LLM_BREAKER_RESET", "30"))
+
+# Асинхронный повтор не начинается, если до конца бюджета меньше этого, сек
+_MIN_ATTEMPT = 5.0
+_RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+T = TypeVar("T")
+
+transitions_total = metrics.Counter(
+    "hskbot_breaker_transitions_total", "Переключения предохранителя", ["breaker", "state"]
+)
+llm_retries_total = metrics.Counter("hskbot_llm_retries_total", "Повторы запросов к GigaChat")
+
+
+class LLMUnavailable(Exception):
+    """GigaChat недоступен: предохранитель разомкнут"""
+
+
+class DeadlineExceeded(TimeoutError):
+    """Бюджет времени на разбор исчерпан"""
+
+
+class CircuitBreaker:
+    def __init__(self, name: str, failure_threshold: int, reset_timeout: float):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+
+        self._state = CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+        self._listeners: List[Callable[[str], None]] = []
+
+        metrics.gauge(
+            f"hskbot_{name}_breaker_state",
+            f"Предохранитель {name} (0 — замкнут, 1 — разомкнут, 0.5 — проверка)",
+            lambda: {CLOSED: 0.0, HALF_OPEN: 0.5, OPEN: 1.0}[self._state],
+        )
+
+    @property
+    def state(self) -> str:
+        return self._state
+
+    def listen(self, callback: Callable[[str], None]) -> None:
+        """callback(новое состояние) — при каждом переключении"""
+        self._listeners.append(callback)
+
+    def rejecting(self) -> bool:
+        """Разомкнут и пробу ещё рано — вызов сейчас точно получит отказ"""
+        with self._lock:
+            return self._state == OPEN and time.monotonic() - self._opened_at < self.reset_timeout
+
+    def allow(self) -> bool:
+        """Можно ли вызывать сервис; в разомкнутом состоянии раз в reset_timeout пропускает пробу"""
+        with self._lock:
+            if self._state == CLOSED:
+                return True
+            if self._state == OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+                self._switch(HALF_OPEN)
+            if self._state == HALF_OPEN and not self._probing:
+                self._probing = True
+                return True
+            return False
+
+    def success(self) -> None:
+        with self._lock:
+            self._failures = 0
+            self._probing = False
+            if self._state != CLOSED:
+                self._switch(CLOSED)
+
+    def release(self) -> None:
+        """Вызов закончился ошибкой, не связанной с сервисом: пробу можно повторить"""
+        with self._lock:
+            self._probing = False
+
+    def failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            self._probing = False
+            if self._state == HALF_OPEN or (self._state == CLOSED and self._failures >= self.failure_threshold):
+                self._opened_at = time.monotonic()
+                self._switch(OPEN)
+
+    def _switch(self, state: str) -> None:
+        # вызывается под self._lock; слушатели — после, чтобы они могли звать allow()
+        self._state = state
+        transitions_total.inc(self.name, state)
+        log = logger.warning if state == OPEN else logger.info
+        log(f"Предохранитель {self.name}: {state} (неудач подряд: {self._failures})")
+        threading.Thread(target=self._notify, args=(state,), name=f"{self.name}-breaker", daemon=True).start()
+
+    def _notify(self, state: str) -> None:
+        for callback in self._listeners:
+            try:
+                callback(state)
+            except Exception as e:
+                logger.error(f"Ошибка обработчика предохранителя {self.name}: {e}")
+
+
+gigachat_breaker = CircuitBreaker("gigachat", LLM_BREAKER_FAILURES, LLM_BREAKER_RESET)
+
+
+def is_transient(error: Exception) -> bool:
+    """Ошибка, которую имеет смысл повторить"""
+    # httpx к этому моменту уже загружен клиентом GigaChat
+    import httpx
+    from gigachat.exceptions import ResponseError
+
+    if isinstance(error, ResponseError):
+        return error.status_code in _RETRY_STATUSES
+    return isinstance(error, (httpx.TimeoutException, httpx.TransportError, TimeoutError))
+
+
+def _failed(breaker: CircuitBreaker, attempt: int, error: Exception, deadline: float, min_attempt: float) -> float:
+    """Учесть неудачную попытку: пауза перед повтором или исключение, если повторять не нужно"""
+    if not is_transient(error):
+        # 4xx или ошибка колбэка — сервис ответил, предохранитель не трогаем
+        breaker.release()
+        raise error
+    breaker.failure()
+
+    delay = random.uniform(0, min(LLM_RETRY_MAX, LLM_RETRY_BASE * 2 ** attempt))
+    if breaker.state != CLOSED or attempt >= LLM_RETRIES or time.monotonic() + delay + min_attempt > deadline:
+        if breaker.state != CLOSED:
+            # последняя неудача разомкнула предохранитель — работу отложат до восстановления
+            raise LLMUnavailable() from error
+        raise error
+
+    llm_retries_total.inc()
+    logger.warning(f"Ошибка GigaChat ({error.__class__.__name__}: {str(error)[:100]}), повтор через {delay:.1f} с")
+    return delay
+
+
+def call(attempt: Callable[[float], T], attempt_timeout: float,
+         breaker: CircuitBreaker = gigachat_breaker) -> T:
+    """
+    attempt(deadline) с повторами в пределах LLM_DEADLINE; deadline — по time.monotonic().
+    attempt_timeout — сколько может длиться одна попытка (таймаут клиента).
+    """
+    deadline = time.monotonic() + LLM_DEADLINE
+    for n in range(LLM_RETRIES + 1):
+        if not breaker.allow():
+            raise LLMUnavailable()
+        try:
+            result = attempt(deadline)
+        except Exception as e:
+            time.sleep(_failed(breaker, n, e, deadline, attempt_timeout))
+            continue
+        breaker.success()
+        return result
+    raise AssertionError("недостижимо")
+
+
+async def acall(attempt: Callable[[], Awaitable[T]], breaker: CircuitBreaker = gigachat_breaker) -> T:
+    """То же для async: каждая попытка прерывается по истечении бюджета"""
+    deadline = time.monotonic() + LLM_DEADLINE
+    for n in range(LLM_RETRIES + 1):
+        if not breaker.allow():
+            raise LLMUnavailable()
+        try:
+            result = await asyncio.wait_for(attempt(), max(deadline - time.monotonic(), 0.001))
+        except Exception as e:
+            await asyncio.sleep(_failed(breaker, n, e, deadline, _MIN_ATTEMPT))
+            continue
+        breaker.success()
+        return result
+    raise AssertionError("недостижимо")
@@ -0,0 +1,144 @@
+# router.py — маршрутизация сообщений по (режим, шаг) и тексту кнопки
+#
+# TeleBot проверяет предикаты всех обработчиков по очереди, и каждый из них
+# заново читает состояние пользователя. Router регистрируется в боте одним
+# обработчиком: состояние читается один раз, а обработчик находится поиском
+# в словарях — время не растёт с числом кнопок и шагов админки.
+import logging
+import re
+from typing import TYPE_CHECKING, Callable, Dict, List, Optional, Pattern, Tuple, Union
+
+import sys
+
+from telebot import TeleBot
+
+import metrics
+from state import aget_user_state, get_user_state
+
+if TYPE_CHECKING:
+    # aiohttp нужен только асинхронному боту — синхронный его не грузит
+    from telebot.async_telebot import AsyncTeleBot
+
+logger = logging.getLogger(__name__)
+
+# Шаг «любой» — обработчик срабатывает независимо от шага
+ANY = None
+
+CONTENT_TYPES = ["text", "photo", "audio", "voice", "document"]
+
+Handler = Callable[..., None]
+
+
+class Router:
+    def __init__(self):
+        self._commands: Dict[str, Handler] = {}
+        self._texts: Dict[Tuple[str, Optional[str], str], Handler] = {}
+        self._patterns: Dict[str, List[Tuple[Pattern, Handler]]] = {}
+        self._steps: Dict[Tuple[str, str, str], Handler] = {}
+        self._guards: Dict[str, Callable[[int], bool]] = {}
+
+    # --- Регистрация ---
+
+    def command(self, *names: str):
+        """/команда — работает в любом режиме"""
+        def decorator(handler: Handler) -> Handler:
+            for name in names:
+                self._commands[name] = handler
+            return handler
+        return decorator
+
+    def text(self, *texts: str, mode: str = "user", step: Optional[str] = ANY):
+        """Точный текст кнопки в режиме mode (и, если задан, на шаге step)"""
+        def decorator(handler: Handler) -> Handler:
+            for text in texts:
+                self._texts[(mode, step, text)] = handler
+            return handler
+        return decorator
+
+    def pattern(self, regex: str, mode: str = "user"):
+        """Текст по регулярному выражению — проверяется после точных совпадений"""
+        compiled = re.compile(regex)
+
+        def decorator(handler: Handler) -> Handler:
+            self._patterns.setdefault(mode, []).append((compiled, handler))
+            return handler
+        return decorator
+
+    def step(self, *steps: str, mode: str, content_types: Tuple[str, ...] = ("text",)):
+        """Любое сообщение указанного типа на шаге step"""
+        def decorator(handler: Handler) -> Handler:
+            for step in steps:
+                for content_type in content_types:
+                    self._steps[(mode, step, content_type)] = handler
+            return handler
+        return decorator
+
+    def guard(self, mode: str, check: Callable[[int], bool]) -> None:
+        """Дополнительная проверка пользователя для режима (например, is_admin)"""
+        self._guards[mode] = check
+
+    # --- Диспетчеризация ---
+
+    def call_command(self, name: str, message) -> None:
+        self._commands[name](message)
+
+    def _command(self, message) -> Optional[Handler]:
+        text = message.text if message.content_type == "text" else None
+        if text and text.startswith("/"):
+            name = text.split(maxsplit=1)[0][1:].split("@", 1)[0]
+            return self._commands.get(name)
+        return None
+
+    def resolve(self, message, state: Optional[Dict] = None) -> Optional[Handler]:
+        """state — уже прочитанное состояние пользователя (асинхронный бот читает его сам)"""
+        handler = self._command(message)
+        if handler:
+            return handler
+
+        text = message.text if message.content_type == "text" else None
+        user_id = message.from_user.id
+        if state is None:
+            state = get_user_state(user_id)
+        mode = state.get("mode", "user")
+        step = state.get("step")
+
+        guard = self._guards.get(mode)
+        if guard and not guard(user_id):
+            return None
+
+        if text is not None:
+            handler = self._texts.get((mode, step, text)) or self._texts.get((mode, ANY, text))
+            if handler:
+                return handler
+            for compiled, handler in self._patterns.get(mode, ()):
+                if compiled.fullmatch(text):
+                    return handler
+
+        return self._steps.get((mode, step, message.content_type))
+
+    def dispatch(self, message) -> None:
+        handler = self.resolve(message)
+        if handler:
+            with metrics.track_update(handler.__name__):
+                handler(message)
+
+    async def dispatch_async(self, message) -> None:
+        """То же для AsyncTeleBot: обработчики — корутины"""
+        handler = self._command(message) or self.resolve(message, await aget_user_state(message.from_user.id))
+        if handler:
+            with metrics.track_update(handler.__name__):
+                await handler(message)
+
+
+def router_for(bot: Union[TeleBot, "AsyncTeleBot"]) -> Router:
+    """Router бота; при первом вызове регистрируется в TeleBot/AsyncTeleBot"""
+    router = getattr(bot, "router", None)
+    if router is None:
+        router = Router()
+        bot.router = router
+        # AsyncTeleBot может быть только у того, кто уже загрузил telebot.async_telebot
+        async_telebot = sys.modules.get("telebot.async_telebot")
+        is_async = async_telebot is not None and isinstance(bot, async_telebot.AsyncTeleBot)
+        dispatch = router.dispatch_async if is_async else router.dispatch
+        bot.register_message_handler(dispatch, content_types=CONTENT_TYPES)
+    return router
@@ -0,0 +1,292 @@
+# scheduler.py — «умное» следующее задание: повтор ошибок с растущими интервалами
+#
+# Для каждого ученика в каждом разделе в памяти держится индекс из двух куч:
+#   - повторы: (срок, задание) — задание с неверным ответом снова становится
+#     «к повтору» через SCHEDULER_INTERVALS[0] минут, каждый следующий
+#     верный ответ отодвигает его на следующий интервал, после последнего
+#     интервала задание считается выученным; новый неверный ответ
+#     начинает отсчёт заново;
+#   - новые: (номер, задание) — ещё не решённые задания раздела.
+# Выбор следующего — просмотр вершин куч, O(log n): сначала повторы, срок
+# которых наступил (но не больше SCHEDULER_REVIEW_STREAK подряд, чтобы
+# новые задания не застревали), затем новые, а когда новых не осталось —
+# ближайший повтор раньше срока.
+#
+# Индекс строится лениво — одним запросом по истории ученика в разделе
+# (индекс user_sessions(user_id, submitted_at)) при первом «Следующем
+# задании» — и дальше обновляется на каждом ответе (record()). К истории
+# добавляются ещё не записанные ответы из буфера answer_recorder (БД может
+# быть недоступна), а ответы, пришедшие, пока индекс строится, копятся с
+# begin_load() и добавляются в load(). Один ответ может попасть и туда, и
+# сюда — повторы отсеиваются по (задание, submitted_at). Хранится не
+# больше SCHEDULER_MAX_INDEXES индексов, давно не нужные вытесняются.
+#
+# По умолчанию (NEXT_TASK_MODE=sequential) «Следующее задание» идёт по
+# номеру, как раньше; планировщик включается NEXT_TASK_MODE=smart.
+import heapq
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Set, Tuple
+
+from sqlalchemy import select
+
+import catalog
+from answer_recorder import answer_recorder, async_answer_recorder
+from catalog import CatalogTask
+from db import SessionLocal
+from models import UserSession
+
+logger = logging.getLogger(__name__)
+
+# smart — повтор ошибок вперемешку с новыми, sequential — по номеру задания
+NEXT_TASK_MODE = os.getenv("NEXT_TASK_MODE", "sequential")
+# Интервалы повтора в минутах: 10 минут, час, сутки, трое суток
+SCHEDULER_INTERVALS = [
+    int(minutes) * 60 for minutes in os.getenv("SCHEDULER_INTERVALS", "10,60,1440,4320").split(",")
+]
+SCHEDULER_REVIEW_STREAK = int(os.getenv("SCHEDULER_REVIEW_STREAK", "3"))
+SCHEDULER_MAX_INDEXES = int(os.getenv("SCHEDULER_MAX_INDEXES", "10000"))
+
+# (task_id, is_correct, submitted_at) в порядке ответов
+History = Iterable[Tuple[int, Optional[bool], Optional[datetime]]]
+Key = Tuple[int, int, int]
+
+
+class _Index:
+    """Очередь заданий одного ученика в одном разделе"""
+
+    def __init__(self, level_id: int, section_id: int):
+        self.level_id = level_id
+        self.section_id = section_id
+        self.version = 0
+        self.seen: Set[int] = set()
+        # актуальные срок и ступень повтора; устаревшие записи кучи пропускаются при чтении
+        self.due: Dict[int, float] = {}
+        self.step: Dict[int, int] = {}
+        self.reviews: List[Tuple[float, int]] = []
+        self.unseen: List[Tuple[int, int]] = []
+        self.reviews_in_row = 0
+
+    def refresh(self) -> None:
+        """Пересобрать новые задания, если админ изменил каталог"""
+        version = catalog.version()
+        if version == self.version:
+            return
+        self.version = version
+        tasks = catalog.get_tasks(self.level_id, self.section_id)
+        self.unseen = [(t.task_number, t.id) for t in tasks if t.id not in self.seen]
+        heapq.heapify(self.unseen)
+        # удалённые задания больше не повторяем
+        present = {t.id for t in tasks}
+        for task_id in [task_id for task_id in self.due if task_id not in present]:
+            del self.due[task_id]
+            del self.step[task_id]
+
+    def answer(self, task_id: int, is_correct: Optional[bool], at: float) -> None:
+        self.seen.add(task_id)
+        if is_correct is None:
+            # письмо проверяет ИИ — в повторы не попадает
+            return
+        if not is_correct:
+            step = 0
+        elif task_id in self.due:
+            step = self.step[task_id] + 1
+        else:
+            # верно с первого раза или уже выучено
+            return
+
+        if step >= len(SCHEDULER_INTERVALS):
+            del self.due[task_id]
+            del self.step[task_id]
+            return
+        self.step[task_id] = step
+        self.due[task_id] = at + SCHEDULER_INTERVALS[step]
+        heapq.heappush(self.reviews, (self.due[task_id], task_id))
+
+    def _top(self, heap: list, is_valid, exclude: Optional[int]):
+        """Вершина кучи без устаревших записей и без exclude"""
+        while heap and not is_valid(heap[0]):
+            heapq.heappop(heap)
+        if not heap or heap[0][1] != exclude:
+            return heap[0] if heap else None
+        # текущее задание пропускаем, не теряя его записи
+        skipped = heapq.heappop(heap)
+        top = self._top(heap, is_valid, None)
+        heapq.heappush(heap, skipped)
+        return top
+
+    def pick(self, now: float, exclude: Optional[int]) -> Optional[int]:
+        review = self._top(self.reviews, lambda item: self.due.get(item[1]) == item[0], exclude)
+        new = self._top(self.unseen, lambda item: item[1] not in self.seen, exclude)
+
+        if review and review[0] <= now and (new is None or self.reviews_in_row < SCHEDULER_REVIEW_STREAK):
+            self.reviews_in_row += 1
+            return review[1]
+        if new:
+            self.reviews_in_row = 0
+            return new[1]
+        # новых нет — повторяем ближайшее, не дожидаясь срока
+        return review[1] if review else None
+
+
+def _timestamp(moment: Optional[datetime]) -> float:
+    # submitted_at хранится в UTC без часового пояса
+    return moment.replace(tzinfo=timezone.utc).timestamp() if moment else time.time()
+
+
+class Scheduler:
+    def __init__(self, max_indexes: int):
+        self.max_indexes = max_indexes
+        self._indexes: "OrderedDict[Key, _Index]" = OrderedDict()
+        # ответы, пришедшие, пока индекс строится, и сколько запросов его строят
+        self._loading: Dict[Key, List[Tuple[int, Optional[bool], datetime]]] = {}
+        self._loaders: Dict[Key, int] = {}
+        self._lock = threading.Lock()
+
+    def begin_load(self, user_id: int, level_id: int, section_id: int) -> Optional[_Index]:
+        """
+        Индекс ученика или None — тогда его нужно построить load() (или
+        отказаться cancel_load()); ответы до load() не потеряются.
+        """
+        key = (user_id, level_id, section_id)
+        with self._lock:
+            index = self._indexes.get(key)
+            if index is not None:
+                self._indexes.move_to_end(key)
+                return index
+            self._loading.setdefault(key, [])
+            self._loaders[key] = self._loaders.get(key, 0) + 1
+            return None
+
+    def _loaded(self, key: Key) -> None:
+        # вызывается под self._lock
+        self._loaders[key] -= 1
+        if not self._loaders[key]:
+            del self._loaders[key]
+
+    def cancel_load(self, user_id: int, level_id: int, section_id: int) -> None:
+        """История не прочиталась: последний строящий перестаёт копить ответы"""
+        key = (user_id, level_id, section_id)
+        with self._lock:
+            self._loaded(key)
+            if key not in self._loaders:
+                self._loading.pop(key, None)
+
+    def load(self, user_id: int, level_id: int, section_id: int, history: History) -> _Index:
+        key = (user_id, level_id, section_id)
+        index = _Index(level_id, section_id)
+        recorded: Set[Tuple[int, datetime]] = set()
+        for task_id, is_correct, submitted_at in history:
+            index.answer(task_id, is_correct, _timestamp(submitted_at))
+            recorded.add((task_id, submitted_at))
+        with self._lock:
+            self._loaded(key)
+            answers = self._loading.pop(key, [])
+            if key in self._indexes:
+                # индекс уже построил параллельный запрос
+                return self._indexes[key]
+            for task_id, is_correct, submitted_at in answers:
+                if (task_id, submitted_at) not in recorded:
+                    index.answer(task_id, is_correct, _timestamp(submitted_at))
+            self._indexes[key] = index
+            while len(self._indexes) > self.max_indexes:
+                self._indexes.popitem(last=False)
+        return index
+
+    def pending(self, user_id: int, level_id: int, section_id: int) -> int:
+        """Сколько заданий ждут повтора"""
+        with self._lock:
+            index = self._indexes.get((user_id, level_id, section_id))
+            return len(index.due) if index is not None else 0
+
+    def record(self, user_id: int, task: CatalogTask, is_correct: Optional[bool], submitted_at: datetime) -> None:
+        """Учесть ответ; индекс, который ещё не строился, прочитает его из истории"""
+        key = (user_id, task.level_id, task.section_id)
+        with self._lock:
+            index = self._indexes.get(key)
+            if index is not None:
+                index.answer(task.id, is_correct, _timestamp(submitted_at))
+            elif key in self._loading:
+                self._loading[key].append((task.id, is_correct, submitted_at))
+
+    def pick(self, index: _Index, exclude: Optional[int] = None) -> Optional[CatalogTask]:
+        """Следующее задание по индексу из begin_load()/load() — даже если его уже вытеснили"""
+        with self._lock:
+            index.refresh()
+            task_id = index.pick(time.time(), exclude)
+        return catalog.get_task_by_id(task_id) if task_id is not None else None
+
+
+scheduler = Scheduler(SCHEDULER_MAX_INDEXES)
+
+
+def finished_text(user_id: int, level_id: int, section_id: int) -> str:
+    """Ответ, когда next_task() ничего не нашёл"""
+    if NEXT_TASK_MODE != "smart":
+        return "🏁 Это было последнее задание в разделе.\nВозвращайтесь за новыми!"
+    if scheduler.pending(user_id, level_id, section_id):
+        # осталось только что решённое задание — сразу его не повторяем
+        return "🏁 Новых заданий в разделе нет, ошибки повторим чуть позже.\nВыберите другой раздел или возвращайтесь сюда позже."
+    return "🏁 Все задания раздела решены, ошибок для повтора нет.\nВозвращайтесь за новыми!"
+
+
+def history_query(user_id: int, level_id: int, section_id: int):
+    task_ids = [t.id for t in catalog.get_tasks(level_id, section_id)]
+    return (
+        select(UserSession.task_id, UserSession.is_correct, UserSession.submitted_at)
+        .where(UserSession.user_id == user_id, UserSession.task_id.in_(task_ids))
+        .order_by(UserSession.submitted_at, UserSession.id)
+    )
+
+
+def with_buffered(history: Sequence, buffered: List[Dict[str, Any]], level_id: int, section_id: int) -> History:
+    """История из БД и ещё не записанные ответы раздела — без повторов, по времени"""
+    task_ids = {t.id for t in catalog.get_tasks(level_id, section_id)}
+    stored = {(task_id, submitted_at) for task_id, _, submitted_at in history}
+    answers = list(history) + [
+        (row["task_id"], row["is_correct"], row["submitted_at"]) for row in buffered
+        if row["task_id"] in task_ids and (row["task_id"], row["submitted_at"]) not in stored
+    ]
+    # submitted_at старых записей может быть пустым — они самые ранние
+    return sorted(answers, key=lambda answer: answer[2] or datetime.min)
+
+
+def next_task(user_id: int, level_id: int, section_id: int,
+              exclude: Optional[int] = None) -> Optional[CatalogTask]:
+    index = scheduler.begin_load(user_id, level_id, section_id)
+    if index is None:
+        try:
+            # буфер — до запроса: строка, записанная между ними, попадёт в оба и отсеется
+            buffered = answer_recorder.buffered(user_id)
+            db = SessionLocal()
+            try:
+                history = db.execute(history_query(user_id, level_id, section_id)).all()
+            finally:
+                db.close()
+        except Exception:
+            scheduler.cancel_load(user_id, level_id, section_id)
+            raise
+        index = scheduler.load(user_id, level_id, section_id, with_buffered(history, buffered, level_id, section_id))
+    return scheduler.pick(index, exclude)
+
+
+async def anext_task(user_id: int, level_id: int, section_id: int,
+                     exclude: Optional[int] = None) -> Optional[CatalogTask]:
+    index = scheduler.begin_load(user_id, level_id, section_id)
+    if index is None:
+        from db_async import AsyncSessionLocal
+
+        try:
+            buffered = async_answer_recorder.buffered(user_id)
+            async with AsyncSessionLocal() as db:
+                history = (await db.execute(history_query(user_id, level_id, section_id))).all()
+        except BaseException:
+            # и отмена задачи посреди запроса
+            scheduler.cancel_load(user_id, level_id, section_id)
+            raise
+        index = scheduler.load(user_id, level_id, section_id, with_buffered(history, buffered, level_id, section_id))
+    return scheduler.pick(index, exclude)
@@ -0,0 +1,133 @@
+# startup.py — замер времени запуска бота: python main.py --profile-startup
+#
+# enable() подменяет builtins.__import__ и засекает первую загрузку каждого
+# модуля: полное время (с вложенными импортами) и собственное — за вычетом
+# вложенных. step() засекает шаги запуска (init_db, init_reference_data,
+# регистрация обработчиков); шаги с background=True в обычном запуске идут
+# в фоне и во время готовности не входят. report() собирает отчёт: шаги и
+# самые дорогие пакеты по собственному времени импорта.
+#
+# Без enable() step() ничего не делает, а elapsed() всегда показывает время
+# с начала запуска — его пишет лог «Бот запущен». Импортировать модуль нужно
+# первым в main.py, до тяжёлых зависимостей. load_llm() — фоновая загрузка
+# LLM-стека для обоих ботов (main.py и async_main.py).
+import builtins
+import importlib.util
+import sys
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Dict, List, Tuple
+
+_started = time.perf_counter()
+_enabled = False
+_real_import = builtins.__import__
+
+# модуль -> (полное время, собственное время), сек
+_modules: Dict[str, Tuple[float, float]] = {}
+# время вложенных импортов текущего уровня — чтобы вычесть его из собственного
+_children: List[float] = []
+_steps: List[Tuple[str, float]] = []
+_first_step_at = 0.0
+_ready_at = 0.0
+
+# Сколько пакетов показывать в отчёте
+_TOP_PACKAGES = 15
+
+
+def elapsed() -> float:
+    """Секунд с начала запуска"""
+    return time.perf_counter() - _started
+
+
+def enabled() -> bool:
+    return _enabled
+
+
+def load_llm() -> None:
+    """
+    Загрузить LLM-стек (langchain, GigaChat — это большая часть времени импорта),
+    создать клиент и получить OAuth-токен. Запускается в фоне, когда бот уже
+    принимает обновления; разбор письма, пришедший раньше, подождёт импорта.
+    """
+    import llm
+    llm.warmup()
+
+
+def _timed_import(name, globals=None, locals=None, fromlist=(), level=0):
+    fullname = name
+    if level:
+        package = (globals or {}).get("__package__") or ""
+        try:
+            fullname = importlib.util.resolve_name("." * level + name, package)
+        except (ImportError, ValueError):
+            return _real_import(name, globals, locals, fromlist, level)
+    if fullname in sys.modules:
+        return _real_import(name, globals, locals, fromlist, level)
+
+    _children.append(0.0)
+    start = time.perf_counter()
+    try:
+        return _real_import(name, globals, locals, fromlist, level)
+    finally:
+        total = time.perf_counter() - start
+        nested = _children.pop()
+        if _children:
+            _children[-1] += total
+        _modules.setdefault(fullname, (total, total - nested))
+
+
+def enable() -> None:
+    global _enabled
+    if not _enabled:
+        _enabled = True
+        builtins.__import__ = _timed_import
+
+
+@contextmanager
+def step(name: str, background: bool = False):
+    global _first_step_at, _ready_at
+    if not _enabled:
+        yield
+        return
+    start = time.perf_counter()
+    if not _steps:
+        _first_step_at = start
+    if background and not _ready_at:
+        _ready_at = start
+    try:
+        yield
+    finally:
+        _steps.append((name + (" (в фоне)" if background else ""), time.perf_counter() - start))
+
+
+def report() -> str:
+    ready = (_ready_at or time.perf_counter()) - _started
+    lines = [f"⏱ Готов к работе через {ready:.2f} с, всего {elapsed():.2f} с", "", "Шаги:"]
+    if _steps:
+        lines.append(f"  {'импорт main.py':<32} {_first_step_at - _started:>6.3f} с")
+    lines += [f"  {name:<32} {seconds:>6.3f} с" for name, seconds in _steps]
+
+    # собственное время модулей, сложенное по пакетам верхнего уровня
+    packages: Dict[str, List[float]] = defaultdict(lambda: [0.0, 0])
+    for module, (_, own) in _modules.items():
+        package = packages[module.split(".")[0]]
+        package[0] += own
+        package[1] += 1
+    lines += ["", "Импорт по пакетам (собственное время, модулей):"]
+    for package, (own, count) in sorted(packages.items(), key=lambda item: -item[1][0])[:_TOP_PACKAGES]:
+        lines.append(f"  {package:<32} {own:>6.3f} с {count:>5}")
+
+    lines += ["", "Модули бота (полное время импорта, с зависимостями):"]
+    local = [
+        (module, total) for module, (total, _) in _modules.items()
+        if getattr(sys.modules.get(module), "__file__", None) and not _is_dependency(module)
+    ]
+    for module, total in sorted(local, key=lambda item: -item[1]):
+        lines.append(f"  {module:<32} {total:>6.3f} с")
+    return "\n".join(lines)
+
+
+def _is_dependency(module: str) -> bool:
+    path = sys.modules[module].__file__
+    return "site-packages" in path or "dist-packages" in path or path.startswith(sys.base_prefix)
@@ -1,15 +1,28 @@
 # ✅ state.py — ПОЛНАЯ ВЕРСИЯ ДЛЯ СПОСОБА 1
-from threading import Lock
-from typing import Any, Dict
+import asyncio
+import os
+import time
+from typing import Any, Dict, Optional
 
-_state: Dict[int, Dict[str, Any]] = {}
-_lock = Lock()
+from state_store import create_store
+
+# Хранилище выбирается через STATE_BACKEND: memory (по умолчанию), sqlite, redis
+STATE_BACKEND = os.getenv("STATE_BACKEND", "memory")
+_store = create_store(
+    backend=STATE_BACKEND,
+    ttl=float(os.getenv("STATE_TTL_SECONDS", "86400")),
+    max_users=int(os.getenv("STATE_MAX_USERS", "100000")),
+    sqlite_path=os.getenv("STATE_SQLITE_PATH", "state.db"),
+    redis_url=os.getenv("STATE_REDIS_URL", "redis://localhost:6379/0"),
+)
+
+# Сколько задание ждёт ответа; потом сообщение ученика уже не считается ответом
+ANSWER_TTL_SECONDS = float(os.getenv("ANSWER_TTL_SECONDS", "21600"))
 
 
 def get_user_state(user_id: int) -> Dict[str, Any]:
     """Получить словарь состояния пользователя"""
-    with _lock:
-        return _state.get(user_id, {})
+    return _store.get(user_id)
 
 
 def set_user_state(user_id: int, **kwargs) -> None:
@@ -19,10 +32,7 @@ def set_user_state(user_id: int, **kwargs) -> None:
         set_user_state(123, mode="admin", step="choose_level")
         set_user_state(123, data={"level": "HSK 1"})
     """
-    with _lock:
-        if user_id not in _state:
-            _state[user_id] = {}
-        _state[user_id].update(kwargs)
+    _store.update(user_id, kwargs)
 
 
 def is_user_mode(user_id: int) -> bool:
@@ -37,7 +47,59 @@ def is_admin_mode(user_id: int) -> bool:
     return state.get("mode") == "admin"
 
 
+def await_answer(user_id: int, task_id: int) -> None:
+    """
+    Ждать ответ на задание: шаг "answer", номер задания и срок ожидания.
+    Хранится в том же хранилище, что и остальное состояние, поэтому с
+    STATE_BACKEND=sqlite/redis переживает перезапуск и переезд на другой процесс.
+    """
+    set_user_state(user_id, step="answer", current_task_id=task_id,
+                   answer_expires=time.time() + ANSWER_TTL_SECONDS)
+
+
+def take_pending_answer(user_id: int) -> Optional[int]:
+    """
+    Снять ожидание ответа; возвращает task_id или None, если срок истёк.
+    Снятие атомарное: из двух одновременных ответов задание получит один.
+    """
+    state = _store.pop(user_id, ["step", "answer_expires"])
+    if state.get("step") != "answer":
+        return None
+    expires = state.get("answer_expires")
+    if expires is not None and expires < time.time():
+        return None
+    return state.get("current_task_id")
+
+
 def clear_user_state(user_id: int) -> None:
     """Очистить всё состояние пользователя"""
-    with _lock:
-        _state.pop(user_id, None)
\ No newline at end of file
+    _store.clear(user_id)
+
+
+# --- То же для асинхронного бота ---
+
+async def _run(func, *args, **kwargs):
+    # sqlite и redis ходят на диск и в сеть — не из цикла событий
+    if STATE_BACKEND == "memory":
+        return func(*args, **kwargs)
+    return await asyncio.to_thread(func, *args, **kwargs)
+
+
+async def aget_user_state(user_id: int) -> Dict[str, Any]:
+    return await _run(get_user_state, user_id)
+
+
+async def aset_user_state(user_id: int, **kwargs) -> None:
+    await _run(set_user_state, user_id, **kwargs)
+
+
+async def aclear_user_state(user_id: int) -> None:
+    await _run(clear_user_state, user_id)
+
+
+async def aawait_answer(user_id: int, task_id: int) -> None:
+    await _run(await_answer, user_id, task_id)
+
+
+async def atake_pending_answer(user_id: int) -> Optional[int]:
+    return await _run(take_pending_answer, user_id)
\ No newline at end of file
@@ -0,0 +1,239 @@
+# state_store.py — хранилища состояния пользователей для state.py
+#
+#   memory — словари в памяти, разбитые на шарды со своими блокировками;
+#            неактивные пользователи вытесняются по TTL и по лимиту числа записей
+#   sqlite — отдельный файл SQLite, состояние переживает перезапуск бота
+#   redis  — Redis (или совместимый сервер), если запущено несколько процессов бота
+import json
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class StateStore:
+    """Интерфейс хранилища: состояние пользователя — словарь полей"""
+
+    def get(self, user_id: int) -> Dict[str, Any]:
+        raise NotImplementedError
+
+    def update(self, user_id: int, fields: Dict[str, Any]) -> None:
+        raise NotImplementedError
+
+    def pop(self, user_id: int, names: Sequence[str]) -> Dict[str, Any]:
+        """Атомарно удалить поля names; возвращает состояние до удаления"""
+        raise NotImplementedError
+
+    def clear(self, user_id: int) -> None:
+        raise NotImplementedError
+
+
+class _Shard:
+    def __init__(self):
+        self.lock = threading.Lock()
+        # user_id -> (время последнего обращения, состояние); порядок — LRU
+        self.items: "OrderedDict[int, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+
+
+class MemoryStateStore(StateStore):
+    def __init__(self, shards: int = 16, ttl: float = 86400, max_users: int = 100000):
+        self.ttl = ttl
+        self.shard_limit = max(max_users // shards, 1)
+        self._shards: List[_Shard] = [_Shard() for _ in range(shards)]
+
+    def _shard(self, user_id: int) -> _Shard:
+        return self._shards[user_id % len(self._shards)]
+
+    def _evict(self, shard: _Shard, now: float) -> None:
+        # в начале OrderedDict — самые давно активные записи
+        while shard.items:
+            touched, _ = next(iter(shard.items.values()))
+            if now - touched < self.ttl and len(shard.items) <= self.shard_limit:
+                break
+            shard.items.popitem(last=False)
+
+    def get(self, user_id: int) -> Dict[str, Any]:
+        shard = self._shard(user_id)
+        now = time.monotonic()
+        with shard.lock:
+            item = shard.items.get(user_id)
+            if item is None:
+                return {}
+            touched, state = item
+            if now - touched >= self.ttl:
+                del shard.items[user_id]
+                return {}
+            shard.items[user_id] = (now, state)
+            shard.items.move_to_end(user_id)
+            return dict(state)
+
+    def update(self, user_id: int, fields: Dict[str, Any]) -> None:
+        shard = self._shard(user_id)
+        now = time.monotonic()
+        with shard.lock:
+            item = shard.items.get(user_id)
+            state = item[1] if item and now - item[0] < self.ttl else {}
+            state.update(fields)
+            shard.items[user_id] = (now, state)
+            shard.items.move_to_end(user_id)
+            self._evict(shard, now)
+
+    def pop(self, user_id: int, names: Sequence[str]) -> Dict[str, Any]:
+        shard = self._shard(user_id)
+        now = time.monotonic()
+        with shard.lock:
+            item = shard.items.get(user_id)
+            if item is None or now - item[0] >= self.ttl:
+                return {}
+            state = item[1]
+            before = dict(state)
+            for name in names:
+                state.pop(name, None)
+            return before
+
+    def clear(self, user_id: int) -> None:
+        shard = self._shard(user_id)
+        with shard.lock:
+            shard.items.pop(user_id, None)
+
+    def __len__(self) -> int:
+        return sum(len(shard.items) for shard in self._shards)
+
+
+class SQLiteStateStore(StateStore):
+    def __init__(self, path: str, ttl: float = 86400):
+        self.path = path
+        self.ttl = ttl
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS user_state ("
+                " user_id INTEGER PRIMARY KEY,"
+                " state TEXT NOT NULL,"
+                " updated_at REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS ix_user_state_updated_at ON user_state (updated_at)")
+        self._purge_expired()
+
+    def _connect(self) -> sqlite3.Connection:
+        # у каждого потока своё соединение: sqlite3 не любит общих
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _purge_expired(self) -> None:
+        deleted = self._connect().execute(
+            "DELETE FROM user_state WHERE updated_at < ?", (time.time() - self.ttl,)
+        ).rowcount
+        if deleted:
+            logger.info(f"Удалено устаревших состояний пользователей: {deleted}")
+
+    def get(self, user_id: int) -> Dict[str, Any]:
+        row = self._connect().execute(
+            "SELECT state, updated_at FROM user_state WHERE user_id = ?", (user_id,)
+        ).fetchone()
+        if row is None or time.time() - row[1] >= self.ttl:
+            return {}
+        return json.loads(row[0])
+
+    def update(self, user_id: int, fields: Dict[str, Any]) -> None:
+        conn = self._connect()
+        now = time.time()
+        # BEGIN IMMEDIATE — чтение и запись одной транзакцией без гонок между потоками
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT state, updated_at FROM user_state WHERE user_id = ?", (user_id,)
+            ).fetchone()
+            state = json.loads(row[0]) if row and now - row[1] < self.ttl else {}
+            state.update(fields)
+            conn.execute(
+                "INSERT INTO user_state (user_id, state, updated_at) VALUES (?, ?, ?) "
+                "ON CONFLICT(user_id) DO UPDATE SET state = excluded.state, updated_at = excluded.updated_at",
+                (user_id, json.dumps(state, ensure_ascii=False), now)
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def pop(self, user_id: int, names: Sequence[str]) -> Dict[str, Any]:
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT state, updated_at FROM user_state WHERE user_id = ?", (user_id,)
+            ).fetchone()
+            if row is None or time.time() - row[1] >= self.ttl:
+                conn.execute("COMMIT")
+                return {}
+            before = json.loads(row[0])
+            state = {name: value for name, value in before.items() if name not in names}
+            conn.execute(
+                "UPDATE user_state SET state = ?, updated_at = ? WHERE user_id = ?",
+                (json.dumps(state, ensure_ascii=False), time.time(), user_id)
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return before
+
+    def clear(self, user_id: int) -> None:
+        self._connect().execute("DELETE FROM user_state WHERE user_id = ?", (user_id,))
+
+
+class RedisStateStore(StateStore):
+    def __init__(self, url: str, ttl: float = 86400, prefix: str = "hskbot:state:"):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError("Для STATE_BACKEND=redis установите пакет redis") from None
+
+        self.ttl = int(ttl)
+        self.prefix = prefix
+        self._redis = redis.Redis.from_url(url)
+
+    def _key(self, user_id: int) -> str:
+        return f"{self.prefix}{user_id}"
+
+    def get(self, user_id: int) -> Dict[str, Any]:
+        raw = self._redis.hgetall(self._key(user_id))
+        return {field.decode(): json.loads(value) for field, value in raw.items()}
+
+    def update(self, user_id: int, fields: Dict[str, Any]) -> None:
+        # каждое поле хранится отдельно в hash — HSET не требует чтения перед записью
+        key = self._key(user_id)
+        pipe = self._redis.pipeline()
+        pipe.hset(key, mapping={name: json.dumps(value, ensure_ascii=False) for name, value in fields.items()})
+        pipe.expire(key, self.ttl)
+        pipe.execute()
+
+    def pop(self, user_id: int, names: Sequence[str]) -> Dict[str, Any]:
+        # pipeline по умолчанию — MULTI/EXEC: между чтением и удалением никто не вклинится
+        pipe = self._redis.pipeline()
+        pipe.hgetall(self._key(user_id))
+        pipe.hdel(self._key(user_id), *names)
+        raw, _ = pipe.execute()
+        return {field.decode(): json.loads(value) for field, value in raw.items()}
+
+    def clear(self, user_id: int) -> None:
+        self._redis.delete(self._key(user_id))
+
+
+def create_store(backend: str, ttl: float, max_users: int, sqlite_path: str, redis_url: str) -> StateStore:
+    if backend == "memory":
+        return MemoryStateStore(ttl=ttl, max_users=max_users)
+    if backend == "sqlite":
+        return SQLiteStateStore(sqlite_path, ttl=ttl)
+    if backend == "redis":
+        return RedisStateStore(redis_url, ttl=ttl)
+    raise ValueError(f"Неизвестный STATE_BACKEND: {backend}")
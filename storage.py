@@ -0,0 +1,132 @@
+# storage.py — профили подключения к БД для db.py и db_async.py
+#
+#   sqlite     — WAL, busy_timeout, synchronous/cache_size/temp_store на каждом
+#                соединении; соединения не привязаны к потоку, что нужно
+#                пулу потоков TeleBot
+#   postgresql — пул соединений (размер, переполнение, pre-ping, recycle) и
+#                statement_timeout на стороне сервера
+#   default    — create_engine() без настроек, как было раньше
+#
+# DB_PROFILE=auto (по умолчанию) выбирает профиль по схеме DATABASE_URL.
+# При запуске check() проверяет, что настройки действительно применились,
+# а диалект поддерживает INSERT ... ON CONFLICT (db.upsert и соседи).
+import logging
+import os
+from typing import Any, Dict
+
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger(__name__)
+
+DB_PROFILE = os.getenv("DB_PROFILE", "auto")
+
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL")  # в режиме WAL NORMAL не теряет целостность
+SQLITE_CACHE_SIZE_KB = int(os.getenv("SQLITE_CACHE_SIZE_KB", "20000"))
+
+PG_POOL_SIZE = int(os.getenv("PG_POOL_SIZE", "10"))
+PG_MAX_OVERFLOW = int(os.getenv("PG_MAX_OVERFLOW", "20"))
+PG_POOL_TIMEOUT = int(os.getenv("PG_POOL_TIMEOUT", "10"))
+PG_POOL_RECYCLE = int(os.getenv("PG_POOL_RECYCLE", "1800"))
+PG_STATEMENT_TIMEOUT_MS = int(os.getenv("PG_STATEMENT_TIMEOUT_MS", "5000"))
+
+PROFILES = ("sqlite", "postgresql", "default")
+# Диалекты с INSERT ... ON CONFLICT, на котором держится запись ответов и статистики
+UPSERT_DIALECTS = ("sqlite", "postgresql")
+
+
+def profile_for(url: str, profile: str = DB_PROFILE) -> str:
+    if profile != "auto":
+        if profile not in PROFILES:
+            raise ValueError(f"Неизвестный DB_PROFILE: {profile}")
+        return profile
+    if url.startswith("sqlite"):
+        return "sqlite"
+    if url.startswith("postgresql"):
+        return "postgresql"
+    return "default"
+
+
+def engine_options(url: str, profile: str) -> Dict[str, Any]:
+    """Аргументы create_engine()/create_async_engine() для профиля"""
+    if profile == "sqlite":
+        options: Dict[str, Any] = {}
+        if "+aiosqlite" not in url:
+            # соединение из пула может достаться любому потоку TeleBot
+            options["connect_args"] = {"check_same_thread": False, "timeout": SQLITE_BUSY_TIMEOUT_MS / 1000}
+        return options
+    if profile == "postgresql":
+        options = {
+            "pool_size": PG_POOL_SIZE,
+            "max_overflow": PG_MAX_OVERFLOW,
+            "pool_timeout": PG_POOL_TIMEOUT,
+            "pool_recycle": PG_POOL_RECYCLE,
+            "pool_pre_ping": True,
+        }
+        if "+asyncpg" in url:
+            options["connect_args"] = {"server_settings": {"statement_timeout": str(PG_STATEMENT_TIMEOUT_MS)}}
+        else:
+            options["connect_args"] = {"options": f"-c statement_timeout={PG_STATEMENT_TIMEOUT_MS}"}
+        return options
+    return {}
+
+
+def _sqlite_pragmas(dbapi_conn, connection_record) -> None:
+    cursor = dbapi_conn.cursor()
+    try:
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+        cursor.execute(f"PRAGMA synchronous={SQLITE_SYNCHRONOUS}")
+        cursor.execute(f"PRAGMA cache_size=-{SQLITE_CACHE_SIZE_KB}")
+        cursor.execute("PRAGMA temp_store=MEMORY")
+    finally:
+        cursor.close()
+
+
+def configure(engine: Engine, profile: str) -> Engine:
+    """Настройки, которые нужно применять к каждому новому соединению"""
+    if profile == "sqlite":
+        event.listen(engine, "connect", _sqlite_pragmas)
+    return engine
+
+
+def make_engine(url: str, profile: str = DB_PROFILE) -> Engine:
+    profile = profile_for(url, profile)
+    return configure(create_engine(url, echo=False, **engine_options(url, profile)), profile)
+
+
+def check(engine: Engine) -> Dict[str, Any]:
+    """Самопроверка при запуске: БД доступна, настройки профиля применились"""
+    dialect = engine.dialect.name
+    if dialect not in UPSERT_DIALECTS:
+        # иначе ошибка всплыла бы только при первой записи ответов
+        raise RuntimeError(
+            f"DATABASE_URL: диалект {dialect} не поддерживается, нужен {' или '.join(UPSERT_DIALECTS)}"
+        )
+    with engine.connect() as conn:
+        conn.execute(text("SELECT 1"))
+        if dialect == "sqlite":
+            info = {
+                "journal_mode": conn.execute(text("PRAGMA journal_mode")).scalar(),
+                "busy_timeout": conn.execute(text("PRAGMA busy_timeout")).scalar(),
+                "synchronous": conn.execute(text("PRAGMA synchronous")).scalar(),
+            }
+        elif dialect == "postgresql":
+            info = {
+                "server_version": conn.execute(text("SHOW server_version")).scalar(),
+                "statement_timeout": conn.execute(text("SHOW statement_timeout")).scalar(),
+                "pool_size": engine.pool.size() if hasattr(engine.pool, "size") else None,
+            }
+        else:
+            info = {}
+
+    if dialect == "sqlite" and engine.url.database not in (None, "", ":memory:"):
+        if str(info["journal_mode"]).lower() != "wal":
+            logger.warning(f"SQLite работает без WAL (journal_mode={info['journal_mode']}): "
+                           f"проверьте DB_PROFILE и файловую систему с БД")
+        if not info["busy_timeout"]:
+            logger.warning("SQLite: busy_timeout = 0, параллельные записи будут падать с 'database is locked'")
+
+    logger.info(f"БД ({dialect}): " + ", ".join(f"{key}={value}" for key, value in info.items()))
+    return info
@@ -0,0 +1,344 @@
+# task_import.py — массовая загрузка заданий из файла (команда /import в админке)
+#
+# Принимается:
+#   - ZIP с manifest.json или manifest.csv и медиафайлами;
+#   - отдельный JSON или CSV, если фото и аудио уже загружены в Telegram.
+#
+# Поля строки манифеста: level, section, task_number, photo, audio, comment,
+# answer. photo/audio — имя файла в архиве или готовый file_id Telegram.
+#
+# Сначала проверяется весь манифест, затем медиа загружаются в Telegram
+# (не больше IMPORT_UPLOAD_WORKERS одновременно), и все задания пишутся
+# одной транзакцией: существующие (уровень, раздел, номер) обновляются.
+import csv
+import io
+import json
+import logging
+import os
+import posixpath
+import threading
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional, Tuple
+
+import catalog
+import grading
+import reference
+from db import SessionLocal, upsert
+from models import Task
+
+logger = logging.getLogger(__name__)
+
+IMPORT_UPLOAD_WORKERS = int(os.getenv("IMPORT_UPLOAD_WORKERS", "4"))
+# Больше Bot API всё равно не даст скачать
+IMPORT_MAX_BYTES = int(os.getenv("IMPORT_MAX_BYTES", str(20 * 1024 * 1024)))
+# Суммарный размер распакованных файлов архива
+IMPORT_MAX_UNPACKED_BYTES = int(os.getenv("IMPORT_MAX_UNPACKED_BYTES", str(200 * 1024 * 1024)))
+# Куда загружать медиа ради file_id (например, закрытый канал); по умолчанию — в чат админа
+IMPORT_MEDIA_CHAT_ID = os.getenv("IMPORT_MEDIA_CHAT_ID")
+# Не чаще одного обновления сообщения о прогрессе за столько секунд
+IMPORT_PROGRESS_INTERVAL = float(os.getenv("IMPORT_PROGRESS_INTERVAL", "2"))
+
+MANIFEST_NAMES = ("manifest.json", "manifest.csv")
+
+FIELD_ALIASES = {
+    "number": "task_number",
+    "correct_answer": "answer",
+    "comment_text": "comment",
+}
+
+
+class TaskImportError(Exception):
+    """Файл нельзя импортировать; errors — список проблем для админа"""
+
+    def __init__(self, errors: List[str]):
+        super().__init__("; ".join(errors))
+        self.errors = errors
+
+
+@dataclass
+class ImportRow:
+    line: int
+    level_id: int
+    section_id: int
+    section_name: str
+    task_number: int
+    photo: str
+    audio: Optional[str]
+    comment: str
+    answer: Optional[str]
+
+
+@dataclass
+class ImportResult:
+    created: int
+    updated: int
+    uploaded: int
+
+
+# --- Разбор файла ---
+
+def _parse_manifest(name: str, content: bytes) -> List[Dict[str, str]]:
+    try:
+        return _read_manifest(name, content)
+    except (ValueError, csv.Error) as e:
+        # UnicodeDecodeError и JSONDecodeError — тоже ValueError
+        raise TaskImportError([f"Не удалось прочитать {name}: {e}"]) from None
+
+
+def _read_manifest(name: str, content: bytes) -> List[Dict[str, str]]:
+    if name.lower().endswith(".json"):
+        data = json.loads(content.decode("utf-8-sig"))
+        if isinstance(data, dict):
+            data = data.get("tasks")
+        if not isinstance(data, list) or not all(isinstance(item, dict) for item in data):
+            raise TaskImportError(["JSON должен быть списком заданий или объектом {\"tasks\": [...]}"])
+        return data
+
+    if name.lower().endswith(".csv"):
+        text = content.decode("utf-8-sig")
+        dialect = csv.Sniffer().sniff(text.split("\n", 1)[0], delimiters=",;\t")
+        return list(csv.DictReader(io.StringIO(text), dialect=dialect))
+
+    raise TaskImportError([f"Неизвестный формат манифеста: {name}"])
+
+
+def _open_package(filename: str, content: bytes) -> Tuple[List[Dict[str, str]], Dict[str, Callable[[], bytes]]]:
+    """Строки манифеста и медиафайлы архива: путь -> функция чтения"""
+    if not filename.lower().endswith(".zip"):
+        return _parse_manifest(filename, content), {}
+
+    try:
+        archive = zipfile.ZipFile(io.BytesIO(content))
+    except zipfile.BadZipFile:
+        raise TaskImportError(["Файл не является ZIP-архивом"]) from None
+
+    infos = [info for info in archive.infolist() if not info.is_dir() and not info.filename.startswith("__MACOSX/")]
+    if sum(info.file_size for info in infos) > IMPORT_MAX_UNPACKED_BYTES:
+        raise TaskImportError([f"Архив после распаковки больше {IMPORT_MAX_UNPACKED_BYTES // (1024 * 1024)} МБ"])
+
+    manifests = [info for info in infos if posixpath.basename(info.filename) in MANIFEST_NAMES]
+    if len(manifests) != 1:
+        raise TaskImportError([f"В архиве должен быть ровно один {' или '.join(MANIFEST_NAMES)}"])
+
+    # пути медиа — относительно папки манифеста
+    root = posixpath.dirname(manifests[0].filename)
+    media = {
+        posixpath.relpath(info.filename, root) if root else info.filename: (lambda name=info.filename: archive.read(name))
+        for info in infos if info is not manifests[0]
+    }
+    return _parse_manifest(manifests[0].filename, archive.read(manifests[0])), media
+
+
+def _validate(raw_rows: List[Dict[str, str]], media: Dict[str, Callable[[], bytes]]) -> List[ImportRow]:
+    errors: List[str] = []
+    rows: List[ImportRow] = []
+    seen: Dict[Tuple[int, int, int], int] = {}
+
+    if not raw_rows:
+        raise TaskImportError(["Манифест пуст"])
+
+    for line, raw in enumerate(raw_rows, start=1):
+        item = {FIELD_ALIASES.get(key.strip(), key.strip()): str(value).strip() if value is not None else ""
+                for key, value in raw.items() if key}
+        problems = []
+
+        level_id = reference.level_id(item.get("level", ""))
+        if not level_id:
+            problems.append(f"неизвестный уровень «{item.get('level', '')}»")
+        section_name = item.get("section", "")
+        section_id = reference.section_id(section_name)
+        if not section_id:
+            problems.append(f"неизвестный раздел «{section_name}»")
+
+        try:
+            task_number = int(item.get("task_number", ""))
+            if task_number < 1:
+                raise ValueError
+        except ValueError:
+            task_number = 0
+            problems.append("номер задания должен быть целым числом ≥ 1")
+
+        photo = item.get("photo", "")
+        audio = item.get("audio") or None
+        if not photo:
+            problems.append("нет фото")
+        if section_name == "Аудирование" and not audio:
+            problems.append("для аудирования нужен аудиофайл")
+        for value in (photo, audio):
+            # путь с расширением, которого нет в архиве, — скорее опечатка, чем file_id
+            if value and "." in posixpath.basename(value) and value not in media:
+                problems.append(f"файла «{value}» нет в архиве")
+
+        comment = item.get("comment", "")
+        if not comment:
+            problems.append("нет комментария")
+        answer = item.get("answer") or None
+        if section_name != "Письмо" and not answer:
+            problems.append("нет правильного ответа")
+
+        if level_id and section_id and task_number:
+            key = (level_id, section_id, task_number)
+            if key in seen:
+                problems.append(f"тот же номер, что в строке {seen[key]}")
+            seen.setdefault(key, line)
+
+        if problems:
+            errors.append(f"строка {line}: " + ", ".join(problems))
+        else:
+            rows.append(ImportRow(line, level_id, section_id, section_name, task_number,
+                                  photo, audio, comment, None if section_name == "Письмо" else answer))
+
+    if errors:
+        raise TaskImportError(errors)
+    return rows
+
+
+# --- Импорт ---
+
+class _Progress:
+    """Обновление сообщения о ходе импорта не чаще IMPORT_PROGRESS_INTERVAL"""
+
+    def __init__(self, report: Callable[[str], None]):
+        self._report = report
+        self._lock = threading.Lock()
+        self._last = 0.0
+
+    def __call__(self, text: str, force: bool = False) -> None:
+        with self._lock:
+            now = time.monotonic()
+            if not force and now - self._last < IMPORT_PROGRESS_INTERVAL:
+                return
+            self._last = now
+        try:
+            self._report(text)
+        except Exception as e:
+            # сообщение о прогрессе не должно срывать импорт
+            logger.warning(f"Не удалось обновить прогресс импорта: {e}")
+
+
+def import_package(
+    filename: str,
+    content: bytes,
+    upload: Callable[[str, str, bytes], str],
+    report: Callable[[str], None],
+) -> ImportResult:
+    """
+    Импорт из файла. upload(kind, name, content) -> file_id загружает фото
+    ("photo") или аудио ("audio") в Telegram; report(text) показывает прогресс.
+    """
+    progress = _Progress(report)
+    progress("🔍 Проверяем файл...", force=True)
+
+    raw_rows, media = _open_package(filename, content)
+    rows = _validate(raw_rows, media)
+
+    # каждый файл архива загружаем один раз, даже если он нужен нескольким заданиям
+    to_upload: Dict[Tuple[str, str], None] = {}
+    for row in rows:
+        if row.photo in media:
+            to_upload[("photo", row.photo)] = None
+        if row.audio and row.audio in media:
+            to_upload[("audio", row.audio)] = None
+
+    file_ids: Dict[Tuple[str, str], str] = {}
+    total = len(to_upload)
+    done = 0
+    done_lock = threading.Lock()
+
+    def _upload(item: Tuple[str, str]) -> None:
+        nonlocal done
+        kind, name = item
+        file_ids[item] = upload(kind, posixpath.basename(name), media[name]())
+        with done_lock:
+            done += 1
+            current = done
+        progress(f"📤 Загружено файлов: {current}/{total}")
+
+    if total:
+        progress(f"📤 Загружаем файлы: 0/{total}", force=True)
+        with ThreadPoolExecutor(max_workers=IMPORT_UPLOAD_WORKERS, thread_name_prefix="import-upload") as pool:
+            # list() — чтобы первая же ошибка загрузки прервала импорт
+            list(pool.map(_upload, to_upload))
+
+    def _file_id(kind: str, value: Optional[str]) -> Optional[str]:
+        if not value:
+            return None
+        return file_ids.get((kind, value), value)
+
+    values = [
+        {
+            "level_id": row.level_id,
+            "section_id": row.section_id,
+            "task_number": row.task_number,
+            "photo_file_id": _file_id("photo", row.photo),
+            "audio_file_id": _file_id("audio", row.audio),
+            "comment_text": row.comment,
+            "correct_answer": grading.compile_answer(row.section_name, row.answer),
+        }
+        for row in rows
+    ]
+
+    progress(f"💾 Сохраняем задания: {len(values)}", force=True)
+    db = SessionLocal()
+    try:
+        keys = {(v["level_id"], v["section_id"], v["task_number"]) for v in values}
+        existing = {
+            key for key in db.query(Task.level_id, Task.section_id, Task.task_number)
+            .filter(Task.level_id.in_({k[0] for k in keys}), Task.section_id.in_({k[1] for k in keys}))
+            .all()
+            if tuple(key) in keys
+        }
+        upsert(
+            db, Task, values,
+            index_elements=["level_id", "section_id", "task_number"],
+            update_columns=["photo_file_id", "audio_file_id", "comment_text", "correct_answer"],
+        )
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+    # импорт идёт в рабочем потоке — каталог перечитываем здесь, а не в цикле событий
+    catalog.reload()
+    result = ImportResult(created=len(values) - len(existing), updated=len(existing), uploaded=total)
+    logger.info(f"Импорт {filename}: добавлено {result.created}, обновлено {result.updated}, файлов {total}")
+    return result
+
+
+HELP_TEXT = (
+    "📦 Отправьте файл с заданиями документом:\n\n"
+    "• ZIP-архив: manifest.json или manifest.csv и файлы фото/аудио;\n"
+    "• JSON или CSV, если фото и аудио уже загружены (указаны file_id).\n\n"
+    "Поля: level, section, task_number, photo, audio, comment, answer.\n"
+    "Задания с уже существующим номером будут обновлены."
+)
+
+
+def file_too_big(size: Optional[int]) -> bool:
+    return bool(size) and size > IMPORT_MAX_BYTES
+
+
+def too_big_text() -> str:
+    return f"❌ Файл больше {IMPORT_MAX_BYTES // (1024 * 1024)} МБ. Разбейте импорт на несколько архивов."
+
+
+def result_text(result: ImportResult) -> str:
+    return (
+        f"✅ Импорт завершён\n\n"
+        f"Добавлено заданий: {result.created}\n"
+        f"Обновлено: {result.updated}\n"
+        f"Загружено файлов: {result.uploaded}"
+    )
+
+
+def errors_text(error: TaskImportError, limit: int = 20) -> str:
+    lines = ["❌ Импорт отменён, ничего не сохранено:", ""]
+    lines += [f"• {e}" for e in error.errors[:limit]]
+    if len(error.errors) > limit:
+        lines.append(f"... и ещё {len(error.errors) - limit}")
+    return "\n".join(lines)
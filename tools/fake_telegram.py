@@ -0,0 +1,288 @@
+# tools/fake_telegram.py — локальная замена Bot API для офлайн-проверки бота
+#
+# Сервер отвечает на вызовы Bot API (sendMessage, sendPhoto, ... — фиктивным
+# сообщением) и проигрывает обновления из JSONL-файла:
+#   - в режиме polling отдаёт их через getUpdates;
+#   - в режиме webhook, получив setWebhook, отправляет их POST-запросами
+#     на указанный ботом адрес.
+#
+# Для нагрузочных прогонов есть сценарии пользователей (add_script): следующее
+# сообщение пользователя появляется, только когда бот ответил ему клавиатурой
+# (reply_markup) и прошло think_time секунд, — как у живого человека, который
+# ждёт кнопок и читает ответ. latency —
+# задержка каждого вызова Bot API, чтобы бот ждал сеть, как с настоящим Telegram.
+#
+# Запуск:
+#   python -m tools.fake_telegram updates.jsonl --port 8081
+#   TELEGRAM_API_URL="http://127.0.0.1:8081/bot{0}/{1}" python main.py
+import argparse
+import itertools
+import json
+import logging
+import threading
+import time
+import urllib.error
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional, Tuple
+from urllib.parse import parse_qsl, urlsplit
+
+logger = logging.getLogger(__name__)
+
+BOT_USER = {"id": 1, "is_bot": True, "first_name": "HSK Bot", "username": "hsk_test_bot"}
+
+
+def load_updates(path: str) -> List[Dict[str, Any]]:
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def message_update(update_id: int, user_id: int, text: str) -> Dict[str, Any]:
+    """Update с текстовым сообщением пользователя user_id"""
+    message = {
+        "message_id": update_id,
+        "date": int(time.time()),
+        "chat": {"id": user_id, "type": "private"},
+        "from": {"id": user_id, "is_bot": False, "first_name": f"user{user_id}"},
+        "text": text,
+    }
+    if text.startswith("/"):
+        message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+    return {"update_id": update_id, "message": message}
+
+
+class FakeTelegram:
+    def __init__(self, updates: List[Dict[str, Any]], host: str = "127.0.0.1", port: int = 0,
+                 rate: float = 0, latency: float = 0, think_time: float = 0, script_timeout: float = 5):
+        self.rate = rate
+        self.latency = latency
+        self.think_time = think_time
+        self.script_timeout = script_timeout
+        self.calls: List[Tuple[str, Dict[str, Any]]] = []
+        self.webhook_url: Optional[str] = None
+        self.webhook_secret: Optional[str] = None
+        self._pusher: Optional[threading.Thread] = None
+
+        self._updates = list(updates)
+        self._next = 0
+        self._lock = threading.Condition()
+        self._message_ids = itertools.count(1)
+        self._update_ids = itertools.count(max((u["update_id"] for u in updates), default=0) + 1)
+        # сценарии: user_id -> оставшиеся сообщения; время отправки последнего сообщения
+        self._scripts: Dict[int, Deque[str]] = {}
+        self._sent_at: Dict[int, float] = {}
+        # user_id -> когда пользователь «дочитает» ответ и напишет следующее сообщение
+        self._due: Dict[int, float] = {}
+        # время от сообщения пользователя до ответа бота с клавиатурой, секунды
+        self.response_times: List[float] = []
+        self._httpd = ThreadingHTTPServer((host, port), self._make_handler())
+        self._httpd.daemon_threads = True
+        # бот, остановленный посреди запроса, рвёт соединение — это не ошибка
+        self._httpd.handle_error = lambda request, address: logger.debug(f"Соединение с {address} прервано")
+
+    @property
+    def api_url(self) -> str:
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}/bot{{0}}/{{1}}"
+
+    def add_updates(self, updates: List[Dict[str, Any]]) -> None:
+        with self._lock:
+            self._updates.extend(updates)
+            self._lock.notify_all()
+
+    def add_script(self, user_id: int, texts: List[str]) -> None:
+        """Сценарий пользователя: первое сообщение сразу, остальные — после ответа бота"""
+        with self._lock:
+            self._scripts[user_id] = deque(texts)
+            self._release(user_id)
+
+    def _release(self, user_id: int) -> None:
+        # вызывается под self._lock
+        self._due.pop(user_id, None)
+        script = self._scripts.get(user_id)
+        if not script:
+            self._scripts.pop(user_id, None)
+            self._sent_at.pop(user_id, None)
+            return
+        self._updates.append(message_update(next(self._update_ids), user_id, script.popleft()))
+        self._sent_at[user_id] = time.monotonic()
+        self._lock.notify_all()
+
+    def _release_stalled(self) -> None:
+        # вызывается под self._lock: бот не ответил клавиатурой — пользователь пишет дальше
+        now = time.monotonic()
+        for user_id, due in list(self._due.items()):
+            if due <= now:
+                self._release(user_id)
+        for user_id, sent_at in list(self._sent_at.items()):
+            if now - sent_at >= self.script_timeout:
+                self._release(user_id)
+
+    def wait_idle(self, timeout: Optional[float] = 30) -> bool:
+        """Дождаться, пока все обновления и сценарии будут отданы боту (timeout=None — без ограничения)"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._lock:
+            while self._next < len(self._updates) or self._scripts:
+                self._release_stalled()
+                step = 0.01 if self._due else 0.5
+                left = None if deadline is None else deadline - time.monotonic()
+                if left is not None and left <= 0:
+                    return False
+                self._lock.wait(min(left, step) if left is not None else step)
+        return True
+
+    def start(self) -> None:
+        threading.Thread(target=self._httpd.serve_forever, name="fake-telegram", daemon=True).start()
+        logger.info(f"Фейковый Bot API: {self.api_url}")
+
+    def stop(self) -> None:
+        self._httpd.shutdown()
+
+    # --- Bot API ---
+
+    def call(self, method: str, params: Dict[str, Any]) -> Any:
+        with self._lock:
+            self.calls.append((method, params))
+        if self.latency and method != "getUpdates":
+            time.sleep(self.latency)
+
+        if method == "getMe":
+            return BOT_USER
+        if method == "getUpdates":
+            return self._get_updates(int(params.get("offset", 0) or 0), float(params.get("timeout", 0) or 0))
+        if method == "setWebhook":
+            # пустой url — так TeleBot.remove_webhook() снимает webhook
+            self.webhook_url = params.get("url") or None
+            self.webhook_secret = params.get("secret_token")
+            if self.webhook_url and self._pusher is None:
+                self._pusher = threading.Thread(target=self._push_updates, name="fake-telegram-push", daemon=True)
+                self._pusher.start()
+            return True
+        if method == "deleteWebhook":
+            self.webhook_url = None
+            return True
+        if method.startswith("send") or method.startswith("edit"):
+            if params.get("reply_markup"):
+                self._on_keyboard(int(params.get("chat_id", 0) or 0))
+            return self._fake_message(params)
+        return True
+
+    def _on_keyboard(self, chat_id: int) -> None:
+        with self._lock:
+            sent_at = self._sent_at.get(chat_id)
+            if sent_at is None:
+                return
+            self.response_times.append(time.monotonic() - sent_at)
+            del self._sent_at[chat_id]
+            if self.think_time:
+                self._due[chat_id] = time.monotonic() + self.think_time
+            else:
+                self._release(chat_id)
+
+    def _get_updates(self, offset: int, timeout: float) -> List[Dict[str, Any]]:
+        if self.rate:
+            # с заданной частотой отдаём по одному обновлению за вызов
+            time.sleep(1 / self.rate)
+        limit = 1 if self.rate else 100
+        deadline = time.monotonic() + min(timeout, 1.0)
+        with self._lock:
+            while True:
+                # всё, что меньше offset, бот уже подтвердил
+                while self._next < len(self._updates) and self._updates[self._next]["update_id"] < offset:
+                    self._next += 1
+                self._lock.notify_all()
+                batch = self._updates[self._next:self._next + limit]
+                left = deadline - time.monotonic()
+                if batch or left <= 0:
+                    return batch
+                self._lock.wait(left)
+
+    def _push_updates(self) -> None:
+        while True:
+            with self._lock:
+                if not self.webhook_url or self._next >= len(self._updates):
+                    self._lock.wait(0.5)
+                    continue
+                update = self._updates[self._next]
+
+            request = urllib.request.Request(
+                self.webhook_url,
+                data=json.dumps(update).encode(),
+                headers={"Content-Type": "application/json"},
+            )
+            if self.webhook_secret:
+                request.add_header("X-Telegram-Bot-Api-Secret-Token", self.webhook_secret)
+            try:
+                urllib.request.urlopen(request, timeout=10).close()
+            except (urllib.error.URLError, OSError) as e:
+                # как и Telegram, повторяем доставку, пока бот не примет обновление
+                logger.warning(f"Webhook не принял обновление {update['update_id']}: {e}")
+                time.sleep(1)
+                continue
+
+            with self._lock:
+                self._next += 1
+                self._lock.notify_all()
+            if self.rate:
+                time.sleep(1 / self.rate)
+
+    def _fake_message(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        chat_id = int(params.get("chat_id", 0) or 0)
+        message = {
+            "message_id": int(params.get("message_id") or next(self._message_ids)),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": BOT_USER,
+        }
+        if "text" in params:
+            message["text"] = params["text"]
+        return message
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def _handle(self):
+                url = urlsplit(self.path)
+                method = url.path.rsplit("/", 1)[-1]
+                params = dict(parse_qsl(url.query))
+                # TeleBot шлёт параметры в строке запроса, AsyncTeleBot — в теле формы
+                length = int(self.headers.get("Content-Length", 0) or 0)
+                if length:
+                    body = self.rfile.read(length).decode("utf-8", "replace")
+                    if self.headers.get("Content-Type", "").startswith("application/x-www-form-urlencoded"):
+                        params.update(parse_qsl(body))
+                body = json.dumps({"ok": True, "result": server.call(method, params)}).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            do_GET = _handle
+            do_POST = _handle
+
+            def log_message(self, format, *args):
+                logger.debug(format % args)
+
+        return Handler
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Локальная замена Telegram Bot API")
+    parser.add_argument("updates", help="JSONL-файл с объектами Update")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--rate", type=float, default=0, help="обновлений в секунду (0 — без паузы)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    fake = FakeTelegram(load_updates(args.updates), args.host, args.port, args.rate)
+    fake.start()
+    fake.wait_idle(timeout=None)
+    logger.info(f"Все обновления отданы, вызовов Bot API: {len(fake.calls)}. Ctrl+C для выхода.")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,129 @@
+# webhook.py — приём обновлений Telegram через webhook
+#
+# HTTP-сервер только принимает обновление, отбрасывает повторы по update_id
+# и кладёт его в очередь одного из воркеров, после чего сразу отвечает 200.
+# Обновления одного пользователя всегда попадают к одному воркеру, поэтому
+# порядок его сообщений сохраняется. Если очередь воркера заполнена, сервер
+# отвечает 503 — Telegram повторит доставку позже.
+import json
+import logging
+import queue
+import threading
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional
+
+from telebot import TeleBot, types
+
+logger = logging.getLogger(__name__)
+
+# Сколько последних update_id помнить для отсева повторов
+_SEEN_LIMIT = 10000
+
+
+def _routing_key(update: Dict[str, Any]) -> int:
+    """id пользователя из обновления (для сообщений, колбэков и т.п.)"""
+    for value in update.values():
+        if isinstance(value, dict):
+            sender = value.get("from") or value.get("user")
+            if isinstance(sender, dict) and "id" in sender:
+                return sender["id"]
+    return update.get("update_id", 0)
+
+
+class WebhookServer:
+    def __init__(self, bot: TeleBot, host: str, port: int, path: str,
+                 secret: Optional[str], workers: int, queue_size: int):
+        self.bot = bot
+        self.path = path
+        self.secret = secret
+
+        self._queues: List["queue.Queue"] = [queue.Queue(maxsize=queue_size) for _ in range(workers)]
+        self._seen: "OrderedDict[int, None]" = OrderedDict()
+        self._seen_lock = threading.Lock()
+        self._threads: List[threading.Thread] = []
+        self._stopped = threading.Event()
+        self._httpd = ThreadingHTTPServer((host, port), self._make_handler())
+        self._httpd.daemon_threads = True
+
+    @property
+    def port(self) -> int:
+        return self._httpd.server_address[1]
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                if self.path != server.path:
+                    self.send_error(404)
+                    return
+                if server.secret and self.headers.get("X-Telegram-Bot-Api-Secret-Token") != server.secret:
+                    self.send_error(403)
+                    return
+                try:
+                    length = int(self.headers.get("Content-Length", 0))
+                    update = json.loads(self.rfile.read(length))
+                    if not isinstance(update, dict):
+                        raise ValueError("ожидался объект Update")
+                except (ValueError, TypeError):
+                    self.send_error(400)
+                    return
+
+                self.send_response(200 if server.accept(update) else 503)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+
+            def log_message(self, format, *args):
+                logger.debug(format % args)
+
+        return Handler
+
+    def accept(self, update: Dict[str, Any]) -> bool:
+        """Поставить обновление в очередь. False — очередь переполнена"""
+        update_id = update.get("update_id")
+        with self._seen_lock:
+            if update_id in self._seen:
+                return True
+            self._seen[update_id] = None
+            if len(self._seen) > _SEEN_LIMIT:
+                self._seen.popitem(last=False)
+
+        worker_queue = self._queues[_routing_key(update) % len(self._queues)]
+        try:
+            worker_queue.put_nowait(update)
+            return True
+        except queue.Full:
+            # забываем id, чтобы повторная доставка от Telegram была принята
+            with self._seen_lock:
+                self._seen.pop(update_id, None)
+            logger.warning("Очередь webhook переполнена, обновление отклонено.")
+            return False
+
+    def _worker(self, worker_queue: "queue.Queue") -> None:
+        while True:
+            try:
+                update = worker_queue.get(timeout=0.5)
+            except queue.Empty:
+                # после остановки воркер выходит, только разобрав свою очередь
+                if self._stopped.is_set():
+                    return
+                continue
+            try:
+                self.bot.process_new_updates([types.Update.de_json(update)])
+            except Exception as e:
+                logger.error(f"Ошибка обработки обновления {update.get('update_id')}: {e}")
+
+    def start(self) -> None:
+        for i, worker_queue in enumerate(self._queues):
+            t = threading.Thread(target=self._worker, args=(worker_queue,), name=f"webhook-worker-{i}", daemon=True)
+            t.start()
+            self._threads.append(t)
+        threading.Thread(target=self._httpd.serve_forever, name="webhook-http", daemon=True).start()
+        logger.info(f"Webhook слушает порт {self.port}, воркеров: {len(self._queues)}.")
+
+    def stop(self) -> None:
+        self._httpd.shutdown()
+        self._stopped.set()
+        for t in self._threads:
+            t.join(timeout=5)
@@ -0,0 +1,237 @@
+# writing_queue.py — очередь проверки письменных заданий через LLM
+#
+# Запрос к GigaChat длится до минуты, поэтому он не выполняется в потоках
+# TeleBot: задания ставятся в ограниченную очередь, которую разбирает
+# отдельный пул потоков. Лимиты на размер очереди и на число работ одного
+# пользователя держат под контролем память и расход запросов к LLM.
+#
+# Пока предохранитель GigaChat разомкнут (resilience.py), работы не ждут
+# таймаутов, а откладываются (park): через LLM_BREAKER_RESET секунд одна
+# из них уходит пробным запросом, а когда предохранитель замыкается,
+# очередь принимает все отложенные — ученик получает разбор без повторной
+# отправки. Отложенных не больше WRITING_PARKED_LIMIT, хранятся они в
+# памяти процесса.
+import asyncio
+import logging
+import os
+import queue
+import threading
+from collections import deque
+from typing import Awaitable, Callable, Deque, Dict, List, Optional, Set, Tuple
+
+import metrics
+import resilience
+from resilience import gigachat_breaker
+
+logger = logging.getLogger(__name__)
+
+WRITING_WORKERS = int(os.getenv("WRITING_WORKERS", "2"))
+WRITING_QUEUE_SIZE = int(os.getenv("WRITING_QUEUE_SIZE", "50"))
+WRITING_MAX_PER_USER = int(os.getenv("WRITING_MAX_PER_USER", "1"))
+WRITING_PARKED_LIMIT = int(os.getenv("WRITING_PARKED_LIMIT", "200"))
+
+
+class QueueFull(Exception):
+    """Очередь заполнена — новые работы не принимаются"""
+
+
+class UserLimitReached(Exception):
+    """У пользователя уже есть работы на проверке"""
+
+
+class WritingQueue:
+    def __init__(self, workers: int, max_size: int, max_per_user: int, max_parked: int):
+        self.workers = workers
+        self.max_size = max_size
+        self.max_per_user = max_per_user
+        self.max_parked = max_parked
+
+        self._jobs: "queue.Queue" = queue.Queue()
+        self._lock = threading.Lock()
+        self._waiting = 0
+        self._in_flight: Dict[int, int] = {}
+        self._threads: List[threading.Thread] = []
+        self._parked: Deque[Tuple[int, Callable[[], None]]] = deque()
+
+    def _start(self) -> None:
+        for i in range(self.workers):
+            t = threading.Thread(target=self._worker, name=f"writing-worker-{i}", daemon=True)
+            t.start()
+            self._threads.append(t)
+        logger.info(f"Очередь проверки текстов запущена: {self.workers} потоков.")
+
+    def submit(self, user_id: int, job: Callable[[], None]) -> int:
+        """
+        Поставить работу в очередь.
+        Возвращает позицию в очереди (1 — следующая на проверку).
+        """
+        with self._lock:
+            if self._waiting >= self.max_size:
+                raise QueueFull()
+            if self._in_flight.get(user_id, 0) >= self.max_per_user:
+                raise UserLimitReached()
+            return self._put(user_id, job)
+
+    def _put(self, user_id: int, job: Callable[[], None]) -> int:
+        # вызывается под self._lock
+        if not self._threads:
+            self._start()
+        self._waiting += 1
+        self._in_flight[user_id] = self._in_flight.get(user_id, 0) + 1
+        self._jobs.put((user_id, job))
+        return self._waiting
+
+    def depth(self) -> int:
+        """Число работ, ожидающих проверки"""
+        with self._lock:
+            return self._waiting
+
+    def park(self, user_id: int, job: Callable[[], None]) -> bool:
+        """Отложить работу до восстановления GigaChat; False — отложенных уже слишком много"""
+        with self._lock:
+            if len(self._parked) >= self.max_parked:
+                return False
+            self._parked.append((user_id, job))
+            return True
+
+    def parked(self) -> int:
+        with self._lock:
+            return len(self._parked)
+
+    def resume_parked(self, limit: Optional[int] = None) -> int:
+        """Вернуть отложенные работы в очередь — без лимитов: они уже были приняты"""
+        with self._lock:
+            count = len(self._parked) if limit is None else min(limit, len(self._parked))
+            for _ in range(count):
+                self._put(*self._parked.popleft())
+        if count:
+            logger.info(f"Отложенные работы возвращены в очередь проверки: {count}")
+        return count
+
+    def on_breaker(self, state: str) -> None:
+        """Слушатель предохранителя GigaChat"""
+        if state == resilience.CLOSED:
+            self.resume_parked()
+        elif state == resilience.OPEN:
+            # отложенная работа станет пробным запросом, как только он будет разрешён
+            timer = threading.Timer(gigachat_breaker.reset_timeout, self.resume_parked, kwargs={"limit": 1})
+            timer.daemon = True
+            timer.start()
+
+    def _worker(self) -> None:
+        while True:
+            user_id, job = self._jobs.get()
+            with self._lock:
+                self._waiting -= 1
+            try:
+                job()
+            except Exception as e:
+                logger.error(f"Ошибка в задаче проверки текста: {e}")
+            finally:
+                with self._lock:
+                    left = self._in_flight.get(user_id, 0) - 1
+                    if left > 0:
+                        self._in_flight[user_id] = left
+                    else:
+                        self._in_flight.pop(user_id, None)
+
+
+class AsyncWritingQueue:
+    """То же для асинхронного бота: вместо потоков — задачи asyncio с семафором"""
+
+    def __init__(self, workers: int, max_size: int, max_per_user: int, max_parked: int):
+        self.workers = workers
+        self.max_size = max_size
+        self.max_per_user = max_per_user
+        self.max_parked = max_parked
+
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._waiting = 0
+        self._in_flight: Dict[int, int] = {}
+        # ссылки на задачи, чтобы их не собрал сборщик мусора
+        self._tasks: Set[asyncio.Task] = set()
+        self._parked: Deque[Tuple[int, Callable[[], Awaitable[None]]]] = deque()
+
+    def submit(self, user_id: int, job: Callable[[], Awaitable[None]]) -> int:
+        if self._waiting >= self.max_size:
+            raise QueueFull()
+        if self._in_flight.get(user_id, 0) >= self.max_per_user:
+            raise UserLimitReached()
+        return self._put(user_id, job)
+
+    def _put(self, user_id: int, job: Callable[[], Awaitable[None]]) -> int:
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.workers)
+            self._loop = asyncio.get_running_loop()
+        self._waiting += 1
+        self._in_flight[user_id] = self._in_flight.get(user_id, 0) + 1
+        task = asyncio.create_task(self._run(user_id, job))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return self._waiting
+
+    def depth(self) -> int:
+        return self._waiting
+
+    def park(self, user_id: int, job: Callable[[], Awaitable[None]]) -> bool:
+        if len(self._parked) >= self.max_parked:
+            return False
+        self._parked.append((user_id, job))
+        return True
+
+    def parked(self) -> int:
+        return len(self._parked)
+
+    def resume_parked(self, limit: Optional[int] = None) -> int:
+        count = len(self._parked) if limit is None else min(limit, len(self._parked))
+        for _ in range(count):
+            self._put(*self._parked.popleft())
+        if count:
+            logger.info(f"Отложенные работы возвращены в очередь проверки: {count}")
+        return count
+
+    def on_breaker(self, state: str) -> None:
+        # слушатели вызываются из отдельного потока — работаем через цикл событий бота
+        if self._loop is None:
+            return
+        if state == resilience.CLOSED:
+            self._loop.call_soon_threadsafe(self.resume_parked)
+        elif state == resilience.OPEN:
+            self._loop.call_soon_threadsafe(
+                self._loop.call_later, gigachat_breaker.reset_timeout, self.resume_parked, 1
+            )
+
+    async def _run(self, user_id: int, job: Callable[[], Awaitable[None]]) -> None:
+        async with self._semaphore:
+            self._waiting -= 1
+            try:
+                await job()
+            except Exception as e:
+                logger.error(f"Ошибка в задаче проверки текста: {e}")
+            finally:
+                left = self._in_flight.get(user_id, 0) - 1
+                if left > 0:
+                    self._in_flight[user_id] = left
+                else:
+                    self._in_flight.pop(user_id, None)
+
+
+writing_queue = WritingQueue(WRITING_WORKERS, WRITING_QUEUE_SIZE, WRITING_MAX_PER_USER, WRITING_PARKED_LIMIT)
+
+async_writing_queue = AsyncWritingQueue(WRITING_WORKERS, WRITING_QUEUE_SIZE, WRITING_MAX_PER_USER, WRITING_PARKED_LIMIT)
+
+gigachat_breaker.listen(writing_queue.on_breaker)
+gigachat_breaker.listen(async_writing_queue.on_breaker)
+
+metrics.gauge(
+    "hskbot_llm_queue_depth",
+    "Письменных работ в очереди на проверку",
+    lambda: writing_queue.depth() + async_writing_queue.depth()
+)
+
+metrics.gauge(
+    "hskbot_llm_parked",
+    "Письменных работ ждут восстановления GigaChat",
+    lambda: writing_queue.parked() + async_writing_queue.parked()
+)